@@ -1,26 +1,28 @@
 import json
 from podtp import Podtp
 import time
-import numpy as np
 import cv2
 
 def main():
     with open('config.json', 'r') as file:
         config = json.loads(file.read())
+    # decode straight to OpenCV's channel order
+    config["pixel_format"] = "bgr"
     
     podtp = Podtp(config)
     if podtp.connect():
         podtp.start_stream()
         sensor = podtp.sensor_data
+        seq = sensor.seq('frame')
         while True:
-            frame = sensor.frame
-            # print(sensor.depth.data)
-            if frame is not None:
-                frame = np.array(frame)
-                cv2_image = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-                cv2.imshow('frame', cv2_image)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
+            # wake up only when a new frame lands, keep the window responsive otherwise
+            new_seq = sensor.wait_for_update('frame', seq, 0.1)
+            if new_seq is not None:
+                seq = new_seq
+                # print(sensor.depth.data)
+                cv2.imshow('frame', sensor.frame)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
         podtp.stop_stream()
         podtp.disconnect()
 
@@ -1,5 +1,5 @@
 import json
-from podtp import Podtp, print_t
+from podtp import Podtp, JpegRecorder, print_t
 import pygame
 import sys, time
 
@@ -14,6 +14,10 @@ def control(podtp: Podtp):
     # save depth and state data
     depth_data = open('cache/depth.txt', 'w')
     state_data = open('cache/state.txt', 'w')
+    # record the stream as received on a background thread, the loop never waits for the disk
+    recorder = JpegRecorder('cache/video.avi', fps=15)
+    recorder.start()
+    podtp.sensor_data.subscribe('jpeg', recorder.put)
     screen = pygame.display.set_mode((1280, 720))
     pygame.display.set_caption('Drone Control')
     running = True
@@ -24,7 +28,6 @@ def control(podtp: Podtp):
     vz = 0
     height = 0.4
     last_command_time = 0
-    counter = 0
 
     # podtp.command_takeoff()
     # time.sleep(2)
@@ -87,14 +90,14 @@ def control(podtp: Podtp):
         # For this example, we'll just fill the screen with black
         # screen.fill((0, 0, 0))
         image_surface = pygame.surfarray.make_surface(podtp.sensor_data.frame.transpose(1, 0, 2))
-        # save the image
-        pygame.image.save(image_surface, f'cache/image/{counter}.png')
-        counter += 1
 
         screen.blit(image_surface, (0, 0))
         pygame.display.flip()
         clock.tick(10)
 
+    podtp.sensor_data.unsubscribe('jpeg', recorder.put)
+    recorder.stop()
+    print_t(f'Recorded {recorder.written} frames, dropped {recorder.dropped}')
     # Quit Pygame
     pygame.quit()
     sys.exit()
@@ -1,5 +1,4 @@
 import json
-from time import sleep
 from podtp import Podtp
 from podtp import PodtpType
 from matplotlib import pyplot as plt
@@ -38,7 +37,12 @@ def update_plot(data):
 
 def data_gen(podtp: Podtp):
     """Generator function to yield data packets."""
+    seq = podtp.sensor_data.seq('depth')
     while True:
+        new_seq = podtp.sensor_data.wait_for_update('depth', seq, 1)
+        if new_seq is None:
+            continue
+        seq = new_seq
         data = podtp.sensor_data.depth.data
         for i in range(0, len(data)):
             for j in range(0, len(data[i])):
@@ -46,7 +50,6 @@ def data_gen(podtp: Podtp):
                     data[i][j] = 1
 
         yield data
-        sleep(0.1)
 
 def main():
     with open('config.json', 'r') as file:
@@ -1,3 +1,9 @@
-from .podtp_packet import PodtpPacket, PodtpType, PodtpPort
+from .podtp_packet import PodtpPacket, PodtpPacketPool, PodtpType, PodtpPort
 from .podtp import Podtp
+from .async_podtp import AsyncPodtp
+from .fleet import PodtpFleet
+from .image_packet import JpegFrame
+from .recorder import JpegRecorder
+from .frame_ring import FrameRing
+from .undistort import Undistorter
 from .utils import print_t
\ No newline at end of file
@@ -0,0 +1,365 @@
+import asyncio
+import time
+from typing import AsyncIterator, Callable, Optional
+import numpy as np
+
+from .podtp_packet import PodtpPacket, PodtpPacketPool, PodtpType, PodtpPort, header_byte
+from .podtp_parser import PodtpParser
+from .podtp_codec import PodtpMessage, PODTP_MAX_FRAME_SIZE, \
+    MSG_COMMAND_RPYT, MSG_COMMAND_TAKEOFF, MSG_COMMAND_LAND, MSG_COMMAND_HOVER, \
+    MSG_COMMAND_POSITION, MSG_COMMAND_VELOCITY, MSG_LOG_STRING, MSG_LOG_DISTANCE, MSG_LOG_STATE, \
+    MSG_CTRL_LOCK, MSG_CTRL_KEEP_ALIVE, MSG_CTRL_RESET_ESTIMATOR, MSG_CTRL_OBSTACLE_AVOIDANCE, \
+    MSG_ESP32_ECHO, MSG_ESP32_ENABLE_STM32, MSG_ESP32_CONFIG_CAMERA, MSG_ESP32_ENABLE_STREAM
+from .camera_config import CameraConfig
+from .sensor import Sensor
+from .image_packet import ImageParser, JpegFrame
+from .jpeg_decoder import JpegDecoder
+from .undistort import Undistorter, UndistortingDecoder
+from .decode_pool import DecodePool, DECODE_WORKERS
+from .stream_stats import StreamStats
+from .udp_batch import STREAM_RECEIVE_BUFFER, set_receive_buffer
+from .podtp import COMMAND_TIMEOUT_MS
+from .utils import print_t
+
+# items kept per async iterator before the oldest is dropped
+SUBSCRIBER_QUEUE_SIZE = 8
+
+class _DataProtocol(asyncio.Protocol):
+    def __init__(self, podtp: 'AsyncPodtp') -> None:
+        self.podtp = podtp
+
+    def data_received(self, data: bytes) -> None:
+        for packet in self.podtp.packet_parser.process(data):
+            self.podtp._handle_packet(packet)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.podtp._connection_lost(exc)
+
+class _StreamProtocol(asyncio.DatagramProtocol):
+    def __init__(self, podtp: 'AsyncPodtp') -> None:
+        self.podtp = podtp
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self.podtp._handle_datagram(data)
+
+def _publish(queues: set, item) -> None:
+    # latest data wins, a slow consumer loses its oldest items instead of blocking the loop
+    for queue in queues:
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(item)
+
+class AsyncPodtp:
+    """
+    asyncio counterpart of Podtp. The data link and the stream link are
+    asyncio protocols and keep-alive is an event loop timer, so any number of
+    drones can share one event loop without extra threads.
+    """
+    def __init__(self, config: dict):
+        if 'ip_index' in config:
+            config["ip"] = config["ip_list"][config["ip_index"]]
+        self.ip = config["ip"]
+        self.port = config.get("port", 80)
+        self.stream_port = config.get("stream_port", 81)
+        # asyncio reads one datagram per callback, only the kernel buffer is enlarged
+        self.stream_receive_buffer = config.get("stream_receive_buffer", STREAM_RECEIVE_BUFFER)
+
+        self.packet_pool = PodtpPacketPool()
+        self.packet_parser = PodtpParser(self.packet_pool)
+        self.packet_queue: dict[int, asyncio.Queue] = {}
+        for type in PodtpType:
+            self.packet_queue[type.value] = asyncio.Queue()
+        self.send_buffer = bytearray(PODTP_MAX_FRAME_SIZE)
+        self.last_packet_time = time.time()
+        self.keep_alive = True
+
+        self.transport: Optional[asyncio.Transport] = None
+        self.stream_transport: Optional[asyncio.DatagramTransport] = None
+        self._keep_alive_handle: Optional[asyncio.TimerHandle] = None
+        self.connected = False
+        self.stream_on = False
+
+        self.image_parser = ImageParser()
+        # frames decode on worker threads and are handed back to the event loop
+        self.jpeg_decoder = JpegDecoder.from_config(config)
+        # optional fisheye undistortion, applied on the decode workers after decoding
+        self.undistorter = Undistorter.from_config(config)
+        self.frame_decoder = self.jpeg_decoder if self.undistorter is None \
+            else UndistortingDecoder(self.jpeg_decoder, self.undistorter)
+        self.decode_pool = DecodePool(self.frame_decoder, self._frame_decoded,
+                                      config.get("decode_workers", DECODE_WORKERS),
+                                      config.get("decode_processes", False))
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # no link to read socket drops from, the datagram transport owns the socket
+        self.stream_stats = StreamStats(self.image_parser, self.decode_pool)
+        # with decode_frames off only sensor_data.jpeg and jpeg_frames() are updated
+        self.decode_frames = config.get("decode_frames", True)
+        self.sensor_data = Sensor()
+        self._frame_queues: set[asyncio.Queue] = set()
+        self._jpeg_queues: set[asyncio.Queue] = set()
+        self._telemetry_queues: set[asyncio.Queue] = set()
+        self._build_dispatch_table()
+
+    def _build_dispatch_table(self):
+        # same layout as Podtp: callbacks and sink per raw header byte
+        self.handlers: list[tuple[Callable[[PodtpPacket], None], ...]] = [()] * 256
+        self.sinks: list[Callable[[PodtpPacket], None]] = [self.packet_pool.release] * 256
+        for header in range(256):
+            packet_queue = self.packet_queue.get(header >> 4)
+            if packet_queue is not None and header >> 4 != PodtpType.LOG:
+                self.sinks[header] = packet_queue.put_nowait
+        self.subscribe(PodtpType.LOG, PodtpPort.LOG_STRING, self._handle_log_string)
+        self.subscribe(PodtpType.LOG, PodtpPort.LOG_DISTANCE, self._handle_log_distance)
+        self.subscribe(PodtpType.LOG, PodtpPort.LOG_STATE, self._handle_log_state)
+
+    def subscribe(self, type: PodtpType, port: PodtpPort, callback: Callable[[PodtpPacket], None]):
+        """
+        Call callback(packet) from the event loop for every packet of (type, port).
+        The packet may be recycled once the callback returns.
+        """
+        for ack in (0, 1):
+            header = header_byte(type, port, ack)
+            self.handlers[header] = self.handlers[header] + (callback,)
+
+    def unsubscribe(self, type: PodtpType, port: PodtpPort, callback: Callable[[PodtpPacket], None]):
+        for ack in (0, 1):
+            header = header_byte(type, port, ack)
+            self.handlers[header] = tuple(c for c in self.handlers[header] if c != callback)
+
+    async def connect(self, timeout=5) -> bool:
+        """
+        Connect to the ESP32.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            self.transport, _ = await asyncio.wait_for(
+                loop.create_connection(lambda: _DataProtocol(self), self.ip, self.port), timeout)
+        except (OSError, asyncio.TimeoutError):
+            print_t(f'Failed to connect to {self.ip}:{self.port}')
+            return False
+        self.connected = True
+        self.last_packet_time = time.time()
+        self._schedule_keep_alive()
+        print_t(f'Connected to {self.ip}:{self.port}')
+        return True
+
+    async def disconnect(self):
+        print_t('Disconnecting...')
+        await self.stop_stream()
+        self.connected = False
+        if self._keep_alive_handle is not None:
+            self._keep_alive_handle.cancel()
+            self._keep_alive_handle = None
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        print_t(f'Disconnected from {self.ip}:{self.port}')
+
+    def _connection_lost(self, exc: Optional[Exception]):
+        if self.connected:
+            print_t(f'Connection to {self.ip}:{self.port} lost: {exc}')
+        self.connected = False
+        if self._keep_alive_handle is not None:
+            self._keep_alive_handle.cancel()
+            self._keep_alive_handle = None
+
+    def _schedule_keep_alive(self):
+        # fire exactly when the link would otherwise go quiet for COMMAND_TIMEOUT_MS
+        delay = self.last_packet_time + COMMAND_TIMEOUT_MS / 1000 - time.time()
+        loop = asyncio.get_running_loop()
+        self._keep_alive_handle = loop.call_later(max(delay, 0), self._keep_alive_func)
+
+    def _keep_alive_func(self):
+        if not self.connected:
+            return
+        if self.keep_alive and time.time() - self.last_packet_time >= COMMAND_TIMEOUT_MS / 1000:
+            self._write_message(MSG_CTRL_KEEP_ALIVE)
+        self._schedule_keep_alive()
+
+    async def start_stream(self, config: Optional[CameraConfig] = None):
+        await self._config_camera(config or CameraConfig())
+        await asyncio.sleep(0.5) # wait for the esp32 to configure the camera and close the previous TCP link
+        await self._enable_stream()
+        loop = asyncio.get_running_loop()
+        try:
+            self.stream_transport, _ = await loop.create_datagram_endpoint(
+                lambda: _StreamProtocol(self), local_addr=('0.0.0.0', self.stream_port))
+        except OSError as e:
+            print_t(f'Failed to open stream port {self.stream_port}: {e}')
+            return
+        if self.stream_receive_buffer:
+            set_receive_buffer(self.stream_transport.get_extra_info('socket'), self.stream_receive_buffer)
+        self._loop = loop
+        self.decode_pool.start()
+        self.stream_on = True
+
+    async def stop_stream(self):
+        if not self.stream_on:
+            return
+        self.stream_on = False
+        self.stream_transport.close()
+        self.stream_transport = None
+        # waits for decodes still running, keep that off the loop
+        await asyncio.get_running_loop().run_in_executor(None, self.decode_pool.stop)
+        await self._enable_stream(False)
+
+    async def _enable_stream(self, enable = True):
+        await self._send_message(MSG_ESP32_ENABLE_STREAM, 1 if enable else 0)
+
+    async def _config_camera(self, config: CameraConfig):
+        await self._send_message(MSG_ESP32_CONFIG_CAMERA, *config.values())
+
+    def _handle_packet(self, packet: PodtpPacket):
+        header = packet.raw.raw[0]
+        for callback in self.handlers[header]:
+            # a failing subscriber must not take the receive loop down with it
+            try:
+                callback(packet)
+            except Exception as e:
+                print_t(f'Packet callback {getattr(callback, "__qualname__", callback)} failed: {e!r}')
+        self.sinks[header](packet)
+
+    def _handle_log_string(self, packet: PodtpPacket):
+        print_t(f'Log: {bytes(MSG_LOG_STRING.decode_payload(packet)).decode()}', end='')
+
+    def _handle_log_distance(self, packet: PodtpPacket):
+        self.sensor_data.depth = MSG_LOG_DISTANCE.decode(packet)
+        if self._telemetry_queues:
+            _publish(self._telemetry_queues, (Sensor.Channel.DEPTH, self._snapshot(self.sensor_data.depth)))
+
+    def _handle_log_state(self, packet: PodtpPacket):
+        self.sensor_data.state = MSG_LOG_STATE.decode(packet)
+        if self._telemetry_queues:
+            _publish(self._telemetry_queues, (Sensor.Channel.STATE, self._snapshot(self.sensor_data.state)))
+
+    @staticmethod
+    def _snapshot(value: Sensor.Depth | Sensor.State) -> tuple[int, np.ndarray]:
+        # the sensor object is updated in place, consumers get a copy of this update
+        return value.timestamp, value.data.copy()
+
+    def _handle_datagram(self, data: bytes):
+        seq, jpeg = self.image_parser.assemble(data)
+        if jpeg is None:
+            return
+        frame = JpegFrame(seq, jpeg, self.image_parser.image_started, time.time())
+        self.stream_stats.frame_completed(frame.started, frame.received)
+        self.sensor_data.jpeg = frame
+        if self._jpeg_queues:
+            _publish(self._jpeg_queues, frame)
+        if self.decode_frames:
+            self.decode_pool.submit(seq, jpeg)
+        else:
+            self.stream_stats.frame_delivered()
+
+    def _frame_decoded(self, seq: int, frame: np.ndarray):
+        if self.decode_pool.workers <= 0:
+            self._publish_frame(frame)
+        elif self._loop is not None:
+            self._loop.call_soon_threadsafe(self._publish_frame, frame)
+
+    def _publish_frame(self, frame: np.ndarray):
+        self.stream_stats.frame_delivered()
+        self.sensor_data.frame = frame
+        if self._frame_queues:
+            _publish(self._frame_queues, frame)
+
+    async def _iterate(self, queues: set) -> AsyncIterator:
+        queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+        queues.add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            queues.discard(queue)
+
+    def frames(self) -> AsyncIterator[np.ndarray]:
+        """
+        Iterate over decoded frames as they arrive. Frames a slow consumer
+        does not pick up in time are skipped.
+        """
+        return self._iterate(self._frame_queues)
+
+    def jpeg_frames(self) -> AsyncIterator[JpegFrame]:
+        """
+        Iterate over frames before decoding, compressed and upside down.
+        """
+        return self._iterate(self._jpeg_queues)
+
+    def telemetry(self) -> AsyncIterator[tuple[Sensor.Channel, object]]:
+        """
+        Iterate over (Sensor.Channel.DEPTH | Sensor.Channel.STATE, (timestamp, data)) updates.
+        """
+        return self._iterate(self._telemetry_queues)
+
+    async def _get_packet(self, type: PodtpType, timeout = 1) -> Optional[PodtpPacket]:
+        try:
+            return await asyncio.wait_for(self.packet_queue[type.value].get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def _write_message(self, message: PodtpMessage, *values, payload: bytes = b'') -> bool:
+        if self.transport is None or not self.connected:
+            print_t(f'Failed to send packet: Not connected to {self.ip}:{self.port}')
+            return False
+        self.last_packet_time = time.time()
+        size = message.encode_into(self.send_buffer, 0, *values, payload=payload)
+        # the transport copies whatever it cannot send right away, the buffer can be reused
+        self.transport.write(memoryview(self.send_buffer)[:size])
+        return True
+
+    async def _send_message(self, message: PodtpMessage, *values, payload: bytes = b'', timeout = 2) -> bool:
+        if not self._write_message(message, *values, payload=payload):
+            return False
+        if message.ack:
+            packet = await self._get_packet(PodtpType.ACK, timeout)
+            if not packet or packet.header.port != PodtpPort.ACK_OK:
+                return False
+        return True
+
+    async def stm32_enable(self, enable: bool):
+        await self._send_message(MSG_ESP32_ENABLE_STM32, 1 if enable else 0)
+
+    async def esp32_echo(self, message: str = 'Hello, ESP32!'):
+        """
+        Send a message to the ESP32 and wait for a response.
+        """
+        await self._send_message(MSG_ESP32_ECHO, payload=message.encode())
+        packet = await self._get_packet(PodtpType.ESP32)
+        if packet:
+            print_t(f'Echo: {packet.data[:packet.length - 1].decode()}')
+        else:
+            print_t('No response')
+
+    async def command_takeoff(self) -> bool:
+        return await self._send_message(MSG_COMMAND_TAKEOFF)
+
+    async def command_land(self) -> bool:
+        return await self._send_message(MSG_COMMAND_LAND)
+
+    async def ctrl_lock(self, lock: bool) -> bool:
+        return await self._send_message(MSG_CTRL_LOCK, 1 if lock else 0)
+
+    async def ctrl_obstacle_avoidance(self, mode: int) -> bool:
+        """
+        mode = 0: disable, 1: stop, 2: avoid
+        """
+        return await self._send_message(MSG_CTRL_OBSTACLE_AVOIDANCE, mode)
+
+    async def command_setpoint(self, roll: float, pitch: float, yaw: float, thrust: float) -> bool:
+        return await self._send_message(MSG_COMMAND_RPYT, roll, pitch, yaw, thrust)
+
+    async def command_hover(self, vx: float, vy: float, vyaw: float, height: float) -> bool:
+        return await self._send_message(MSG_COMMAND_HOVER, vx, vy, vyaw, height)
+
+    async def command_velocity(self, vx: float, vy: float, vyaw: float, vz: float) -> bool:
+        return await self._send_message(MSG_COMMAND_VELOCITY, vx, vy, vyaw, vz)
+
+    async def command_position(self, x: float, y: float, z: float, yaw: float) -> bool:
+        return await self._send_message(MSG_COMMAND_POSITION, x, y, z, yaw)
+
+    async def reset_estimator(self, starting_height=0) -> bool:
+        """
+        Reset the estimator with the given starting height (cm).
+        """
+        assert starting_height < 100 and starting_height >= 0, "Height must be between 0 and 100 (cm)"
+        return await self._send_message(MSG_CTRL_RESET_ESTIMATOR, starting_height)
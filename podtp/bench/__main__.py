@@ -0,0 +1,70 @@
+import argparse
+import json
+import platform
+import sys
+import time
+from ..utils import print_t
+
+# units where a larger number is an improvement, everything else is a cost
+HIGHER_IS_BETTER = {'packets/s', 'frames/s'}
+
+def run(micro: bool = True, scenarios: bool = True, duration: float = 3) -> dict:
+    results = {}
+    if micro:
+        from . import micro as micro_benchmarks
+        results.update(micro_benchmarks.benchmark())
+    if scenarios:
+        from . import scenarios as scenario_benchmarks
+        results.update(scenario_benchmarks.benchmark(duration))
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': {name: {'value': value, 'unit': unit} for name, (value, unit) in results.items()},
+    }
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Names of results that got worse than the baseline by more than tolerance.
+    """
+    regressions = []
+    for name, result in report['results'].items():
+        previous = baseline['results'].get(name)
+        if previous is None or previous['unit'] != result['unit'] or previous['value'] == 0:
+            continue
+        change = result['value'] / previous['value'] - 1
+        if result['unit'] in HIGHER_IS_BETTER:
+            change = -change
+        if change > tolerance:
+            regressions.append(f'{name}: {previous["value"]:.1f} -> {result["value"]:.1f} {result["unit"]}')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='POD-XIAO benchmark suite')
+    parser.add_argument('--micro', help='Only run micro-benchmarks', action='store_true')
+    parser.add_argument('--scenarios', help='Only run end-to-end scenarios', action='store_true')
+    parser.add_argument('-d', '--duration', help='Seconds per end-to-end scenario', type=float, default=3)
+    parser.add_argument('-o', '--output', help='Write the JSON report to this file', type=str)
+    parser.add_argument('-c', '--compare', help='Baseline JSON report to compare against', type=str)
+    parser.add_argument('-t', '--tolerance', help='Allowed relative regression', type=float, default=0.1)
+    args = parser.parse_args()
+
+    run_all = not args.micro and not args.scenarios
+    report = run(args.micro or run_all, args.scenarios or run_all, args.duration)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            regressions = compare(report, json.loads(file.read()), args.tolerance)
+        for regression in regressions:
+            print_t(f'Regression: {regression}')
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
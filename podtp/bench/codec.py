@@ -0,0 +1,49 @@
+import argparse
+import struct
+import timeit
+from ..podtp_packet import PodtpPacket, PodtpType, PodtpPort
+from ..podtp_codec import MSG_COMMAND_HOVER, MSG_LOG_DISTANCE, MSG_LOG_STATE, PODTP_MAX_FRAME_SIZE
+from ..utils import print_t
+
+def legacy_encode_hover(vx: float, vy: float, vyaw: float, height: float) -> bytearray:
+    # what command_hover did before the codec registry
+    packet = PodtpPacket().set_header(PodtpType.COMMAND, PodtpPort.COMMAND_HOVER)
+    size = struct.calcsize('<ffff')
+    packet.data[:size] = struct.pack('<ffff', vx, vy, vyaw, height)
+    packet.length = 1 + size
+    return packet.pack()
+
+def make_packet(message, *values) -> PodtpPacket:
+    packet = PodtpPacket()
+    frame = message.encode(*values)
+    packet.length = frame[2]
+    packet.raw.raw[:packet.length] = frame[3:]
+    return packet
+
+def benchmark(number: int = 100000) -> dict:
+    """
+    Cost per message in nanoseconds.
+    """
+    buffer = bytearray(PODTP_MAX_FRAME_SIZE)
+    distance = make_packet(MSG_LOG_DISTANCE, 0, *range(64))
+    state = make_packet(MSG_LOG_STATE, 0, 1, 2, 3, 4, 5, 6)
+    cases = {
+        'encode hover (legacy)': lambda: legacy_encode_hover(0.1, 0.2, 0.3, 0.4),
+        'encode hover (codec)': lambda: MSG_COMMAND_HOVER.encode_into(buffer, 0, 0.1, 0.2, 0.3, 0.4),
+        'decode distance (legacy)': lambda: struct.unpack('<I64h', distance.data.bytes(0, 132)),
+        'decode distance (codec)': lambda: MSG_LOG_DISTANCE.decode(distance),
+        'decode state (legacy)': lambda: struct.unpack('<I6h', state.data.bytes(0, 16)),
+        'decode state (codec)': lambda: MSG_LOG_STATE.decode(state),
+    }
+    return {name: timeit.timeit(case, number=number) / number * 1e9 for name, case in cases.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description='PODTP message encode/decode benchmark')
+    parser.add_argument('-n', '--number', help='Iterations per case', type=int, default=100000)
+    args = parser.parse_args()
+
+    for name, cost in benchmark(args.number).items():
+        print_t(f'{name:>26}: {cost:8.0f} ns/message')
+
+if __name__ == '__main__':
+    main()
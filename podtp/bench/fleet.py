@@ -0,0 +1,120 @@
+import argparse
+import multiprocessing
+import selectors
+import socket
+import time
+from ..podtp import Podtp
+from ..fleet import PodtpFleet
+from ..podtp_codec import MSG_LOG_DISTANCE, MSG_LOG_STATE
+from ..utils import print_t
+
+def _telemetry_server(count: int, state_rate: float, distance_rate: float, ports, stop):
+    """
+    Stand-in for count drones: accept one PODTP connection per port and send
+    LOG_STATE and LOG_DISTANCE at the given rates. Runs in its own process so
+    its CPU time is not charged to the client.
+    """
+    selector = selectors.DefaultSelector()
+    servers = []
+    for _ in range(count):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        server.setblocking(False)
+        selector.register(server, selectors.EVENT_READ)
+        servers.append(server)
+        ports.append(server.getsockname()[1])
+    clients = []
+    state = bytes(MSG_LOG_STATE.encode(0, 1, 2, 3, 4, 5, 6))
+    distance = bytes(MSG_LOG_DISTANCE.encode(0, *range(64)))
+    next_state = next_distance = time.time()
+    while not stop.is_set():
+        now = time.time()
+        timeout = max(min(next_state, next_distance) - now, 0)
+        for key, _ in selector.select(timeout):
+            if key.fileobj in servers:
+                client, _ = key.fileobj.accept()
+                client.setblocking(False)
+                selector.register(client, selectors.EVENT_READ)
+                clients.append(client)
+            else:
+                try:
+                    if not key.fileobj.recv(4096):
+                        selector.unregister(key.fileobj)
+                        clients.remove(key.fileobj)
+                except OSError:
+                    pass
+        now = time.time()
+        frame = b''
+        if now >= next_state:
+            frame += state
+            next_state += 1 / state_rate
+        if now >= next_distance:
+            frame += distance
+            next_distance += 1 / distance_rate
+        if frame:
+            for client in clients:
+                try:
+                    client.send(frame)
+                except OSError:
+                    pass
+
+def _measure(mode: str, count: int, duration: float, state_rate: float, distance_rate: float) -> float:
+    manager = multiprocessing.Manager()
+    ports = manager.list()
+    stop = multiprocessing.Event()
+    server = multiprocessing.Process(target=_telemetry_server,
+                                     args=(count, state_rate, distance_rate, ports, stop))
+    server.start()
+    while len(ports) < count:
+        time.sleep(0.01)
+    configs = [{'ip': '127.0.0.1', 'port': port, 'stream_port': 0} for port in ports]
+
+    if mode == 'fleet':
+        fleet = PodtpFleet(configs)
+        fleet.connect()
+        drones = fleet.drones
+    else:
+        drones = [Podtp(config) for config in configs]
+        for drone in drones:
+            drone.connect()
+
+    time.sleep(0.5)
+    start = time.process_time()
+    time.sleep(duration)
+    cpu = time.process_time() - start
+    states = sum(drone.sensor_data.seq('state') for drone in drones)
+
+    if mode == 'fleet':
+        fleet.disconnect()
+    else:
+        for drone in drones:
+            drone.disconnect()
+    stop.set()
+    server.join()
+    manager.shutdown()
+    if states == 0:
+        raise RuntimeError(f'{mode}: no telemetry received')
+    return cpu / duration / count * 100
+
+def benchmark(counts=(1, 4, 16, 64), duration: float = 3, state_rate: float = 50, distance_rate: float = 15) -> dict:
+    """
+    Client CPU percent per drone for threaded Podtp instances and one PodtpFleet.
+    """
+    return {mode: {count: _measure(mode, count, duration, state_rate, distance_rate) for count in counts}
+            for mode in ('threads', 'fleet')}
+
+def main():
+    parser = argparse.ArgumentParser(description='Podtp vs PodtpFleet CPU per drone')
+    parser.add_argument('-n', '--counts', help='Fleet sizes', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('-d', '--duration', help='Seconds per measurement', type=float, default=3)
+    args = parser.parse_args()
+
+    results = benchmark(args.counts, args.duration)
+    for mode, per_count in results.items():
+        for count, cpu in per_count.items():
+            print_t(f'{mode:>8} x{count:<3}: {cpu:6.2f}% CPU per drone')
+
+if __name__ == '__main__':
+    main()
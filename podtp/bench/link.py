@@ -0,0 +1,99 @@
+import argparse
+import socket
+import statistics
+import time
+from threading import Thread
+from ..link import WifiLink
+from ..podtp_codec import MSG_LOG_STATE
+from ..podtp_parser import PodtpParser
+from ..utils import print_t
+
+def _local_server() -> tuple[socket.socket, int]:
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    return server, server.getsockname()[1]
+
+def _receive_loop(link: WifiLink, mode: str, running: list, on_data=None, cpu: list = None):
+    start = time.thread_time()
+    while running[0] and link.client_connected:
+        if mode == 'poll':
+            data = link.receive(4096)
+        else:
+            data = link.receive_into()
+        if data is not None and on_data is not None:
+            on_data(data)
+    if cpu is not None:
+        cpu.append(time.thread_time() - start)
+
+def _run(mode: str, duration: float, rate: float) -> dict:
+    """
+    Connect a link to a local server and run one receive thread on it for
+    duration seconds, first idle and then with LOG_STATE packets at rate Hz.
+    """
+    server, port = _local_server()
+    link = WifiLink('127.0.0.1', port)
+    link.connect()
+    peer, _ = server.accept()
+
+    # idle: nothing is sent, any CPU time is spent polling
+    running = [True]
+    cpu = []
+    thread = Thread(target=_receive_loop, args=(link, mode, running, None, cpu))
+    thread.start()
+    time.sleep(duration)
+    running[0] = False
+    link.wakeup()
+    thread.join()
+    idle_cpu = cpu[0] / duration
+
+    # latency: the payload carries the send time in microseconds
+    parser = PodtpParser()
+    latencies = []
+    def on_data(data):
+        now = time.perf_counter()
+        for packet in parser.process(data):
+            sent = MSG_LOG_STATE.decode(packet)[0]
+            latencies.append(now * 1e6 - sent)
+    running[0] = True
+    thread = Thread(target=_receive_loop, args=(link, mode, running, on_data))
+    thread.start()
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        sent = int(time.perf_counter() * 1e6) & 0xFFFFFFFF
+        peer.sendall(MSG_LOG_STATE.encode(sent, 0, 0, 0, 0, 0, 0))
+        time.sleep(1 / rate)
+    time.sleep(0.05)
+    running[0] = False
+    link.wakeup()
+    thread.join()
+
+    link.close()
+    peer.close()
+    server.close()
+    # drop samples where the microsecond counter wrapped
+    latencies = [latency for latency in latencies if latency >= 0]
+    return {
+        'idle_cpu_percent': idle_cpu * 100,
+        'latency_us_median': statistics.median(latencies),
+        'latency_us_p99': statistics.quantiles(latencies, n=100)[98],
+        'packets': len(latencies),
+    }
+
+def benchmark(duration: float = 2, rate: float = 200) -> dict:
+    return {mode: _run(mode, duration, rate) for mode in ('poll', 'blocking')}
+
+def main():
+    parser = argparse.ArgumentParser(description='WifiLink idle CPU and per-packet latency benchmark')
+    parser.add_argument('-d', '--duration', help='Seconds per phase', type=float, default=2)
+    parser.add_argument('-r', '--rate', help='Packets per second in the latency phase', type=float, default=200)
+    args = parser.parse_args()
+
+    for mode, result in benchmark(args.duration, args.rate).items():
+        print_t(f'{mode:>8}: idle CPU {result["idle_cpu_percent"]:5.1f}%, '
+                f'latency median {result["latency_us_median"]:6.0f} us, '
+                f'p99 {result["latency_us_p99"]:6.0f} us ({result["packets"]} packets)')
+
+if __name__ == '__main__':
+    main()
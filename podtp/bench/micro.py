@@ -0,0 +1,74 @@
+import timeit
+import numpy as np
+from ..podtp_packet import PodtpPacket, PodtpType, PodtpPort
+from ..podtp_parser import PodtpParser
+from ..podtp_codec import MSG_COMMAND_HOVER, PODTP_MAX_FRAME_SIZE
+from ..image_packet import ImageParser
+from ..jpeg_decoder import JpegDecoder
+from ..sensor import Sensor
+from ..simulator import DroneSimulator, fragment_jpeg
+from .parser import make_telemetry_stream, split_chunks
+
+def _measure(function, repeat: int = 3) -> float:
+    """
+    Best of repeat runs, in nanoseconds per call.
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number * 1e9
+
+def sample_jpeg() -> bytes:
+    """
+    A 720p frame from the simulator, close in size to what the camera sends.
+    """
+    return DroneSimulator()._jpeg_frames()[0]
+
+def benchmark() -> dict:
+    results = {}
+
+    packets = 2000
+    chunks = split_chunks(make_telemetry_stream(packets), 255)
+    def parse():
+        parser = PodtpParser()
+        for chunk in chunks:
+            parser.process(chunk)
+    results['parser.process'] = (_measure(parse) / packets, 'ns/packet')
+
+    packet = PodtpPacket().set_header(PodtpType.COMMAND, PodtpPort.COMMAND_HOVER)
+    packet.data[:16] = bytes(range(16))
+    packet.length = 17
+    frame = packet.pack()
+    results['packet.pack'] = (_measure(packet.pack), 'ns/packet')
+    results['packet.unpack'] = (_measure(lambda: PodtpPacket().unpack(frame)), 'ns/packet')
+    buffer = bytearray(PODTP_MAX_FRAME_SIZE)
+    results['codec.encode_into'] = (_measure(lambda: MSG_COMMAND_HOVER.encode_into(buffer, 0, 0.1, 0.2, 0.3, 0.4)),
+                                    'ns/packet')
+
+    jpeg = sample_jpeg()
+    fragments = [bytes(fragment) for fragment in fragment_jpeg(jpeg, 0)]
+    def reassemble():
+        parser = ImageParser()
+        for fragment in fragments:
+            parser.assemble(fragment)
+    results['image.reassembly'] = (_measure(reassemble) / 1e3, 'us/frame')
+    results['image.fragments'] = (len(fragments), 'fragments/frame')
+    for backend in JpegDecoder.available():
+        for scale in (1, 4):
+            decoder = JpegDecoder(backend, scale, buffers=2)
+            name = f'image.decode.{backend.value}' + (f'.scale{scale}' if scale > 1 else '')
+            results[name] = (_measure(lambda: decoder(jpeg), repeat=1) / 1e6, 'ms/frame')
+
+    sensor = Sensor()
+    depth = (0,) + tuple(range(64))
+    state = (0, 1, 2, 3, 4, 5, 6)
+    frame = np.zeros((720, 1280, 3), dtype=np.uint8)
+    def set_depth():
+        sensor.depth = depth
+    def set_state():
+        sensor.state = state
+    def set_frame():
+        sensor.frame = frame
+    results['sensor.depth'] = (_measure(set_depth), 'ns/update')
+    results['sensor.state'] = (_measure(set_state), 'ns/update')
+    results['sensor.frame'] = (_measure(set_frame), 'ns/update')
+    return results
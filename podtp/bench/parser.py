@@ -0,0 +1,142 @@
+import argparse
+import queue
+import random
+import struct
+import time
+from enum import Enum
+from ..podtp_packet import PodtpPacket, PodtpPacketPool, PodtpType, PodtpPort, \
+    PODTP_MAX_DATA_LEN, PODTP_START_BYTE_1, PODTP_START_BYTE_2
+from ..podtp_parser import PodtpParser
+from ..utils import print_t
+
+class _RxState(Enum):
+    PODTP_STATE_START_1 = 0
+    PODTP_STATE_START_2 = 1
+    PODTP_STATE_LENGTH = 2
+    PODTP_STATE_RAW_DATA = 3
+
+class LegacyPodtpParser:
+    """
+    The original per-byte state machine, kept as the reference for the benchmark.
+    """
+    def __init__(self):
+        self.rx_state = _RxState.PODTP_STATE_START_1
+        self.length = 0
+        self.packet = None
+        self.packet_queue = queue.Queue()
+
+    def process(self, data):
+        if data is None:
+            return
+        for byte in data:
+            match self.rx_state:
+                case _RxState.PODTP_STATE_START_1:
+                    if byte == PODTP_START_BYTE_1:
+                        self.rx_state = _RxState.PODTP_STATE_START_2
+
+                case _RxState.PODTP_STATE_START_2:
+                    if byte == PODTP_START_BYTE_2:
+                        self.rx_state = _RxState.PODTP_STATE_LENGTH
+                    else:
+                        self.rx_state = _RxState.PODTP_STATE_START_1
+
+                case _RxState.PODTP_STATE_LENGTH:
+                    self.length = byte
+                    self.packet = PodtpPacket()
+                    self.packet.length = 0
+                    if self.length > PODTP_MAX_DATA_LEN or self.length == 0:
+                        self.rx_state = _RxState.PODTP_STATE_START_1
+                    else:
+                        self.rx_state = _RxState.PODTP_STATE_RAW_DATA
+
+                case _RxState.PODTP_STATE_RAW_DATA:
+                    self.packet.raw[self.packet.length] = byte
+                    self.packet.length += 1
+                    if self.packet.length == self.length:
+                        self.rx_state = _RxState.PODTP_STATE_START_1
+                        self.packet_queue.put(self.packet)
+                        self.packet = None
+
+    def get_packet(self):
+        try:
+            return self.packet_queue.get_nowait()
+        except queue.Empty:
+            return None
+
+def make_telemetry_stream(count: int) -> bytes:
+    """
+    Build a byte stream of alternating LOG_DISTANCE (133 bytes) and LOG_STATE packets.
+    """
+    distance = PodtpPacket().set_header(PodtpType.LOG, PodtpPort.LOG_DISTANCE)
+    distance.data[:132] = struct.pack('<I64h', 0, *range(64))
+    distance.length = 133
+    state = PodtpPacket().set_header(PodtpType.LOG, PodtpPort.LOG_STATE)
+    state.data[:16] = struct.pack('<I6h', 0, 1, 2, 3, 4, 5, 6)
+    state.length = 17
+    frames = [distance.pack(), state.pack()]
+    return b''.join(frames[i % 2] for i in range(count))
+
+def split_chunks(stream: bytes, chunk_size: int, jitter: bool = True) -> list[bytes]:
+    """
+    Cut the stream into receive()-sized chunks so frames straddle chunk boundaries.
+    """
+    rng = random.Random(0)
+    chunks = []
+    index = 0
+    while index < len(stream):
+        size = rng.randint(1, chunk_size) if jitter else chunk_size
+        chunks.append(stream[index:index + size])
+        index += size
+    return chunks
+
+def run_legacy_parser(parser: LegacyPodtpParser, chunks: list[bytes]) -> tuple[int, float]:
+    count = 0
+    start = time.perf_counter()
+    for chunk in chunks:
+        parser.process(chunk)
+        while parser.get_packet() is not None:
+            count += 1
+    return count, time.perf_counter() - start
+
+def run_parser(parser: PodtpParser, chunks: list[bytes]) -> tuple[int, float]:
+    count = 0
+    start = time.perf_counter()
+    for chunk in chunks:
+        for _ in parser.process(chunk):
+            count += 1
+    return count, time.perf_counter() - start
+
+def run_pooled_parser(parser: PodtpParser, chunks: list[bytes]) -> tuple[int, float]:
+    count = 0
+    start = time.perf_counter()
+    for chunk in chunks:
+        for packet in parser.process(chunk):
+            count += 1
+            parser.pool.release(packet)
+    return count, time.perf_counter() - start
+
+def benchmark(packets: int = 20000, chunk_size: int = 255) -> dict:
+    chunks = split_chunks(make_telemetry_stream(packets), chunk_size)
+    results = {}
+    for name, run, parser in (('legacy', run_legacy_parser, LegacyPodtpParser()),
+                              ('chunk', run_parser, PodtpParser()),
+                              ('pooled', run_pooled_parser, PodtpParser(PodtpPacketPool()))):
+        count, elapsed = run(parser, chunks)
+        if count != packets:
+            raise RuntimeError(f'{name} parser decoded {count} of {packets} packets')
+        results[name] = count / elapsed
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='PODTP parser throughput benchmark')
+    parser.add_argument('-n', '--packets', help='Number of packets', type=int, default=20000)
+    parser.add_argument('-c', '--chunk', help='Maximum receive chunk size', type=int, default=255)
+    args = parser.parse_args()
+
+    results = benchmark(args.packets, args.chunk)
+    for name, rate in results.items():
+        print_t(f'{name:>8}: {rate:12.0f} packets/s')
+    print_t(f'speedup: {results["chunk"] / results["legacy"]:.1f}x')
+
+if __name__ == '__main__':
+    main()
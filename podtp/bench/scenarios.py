@@ -0,0 +1,76 @@
+import socket
+import statistics
+import time
+from ..podtp import Podtp
+from ..simulator import DroneSimulator
+
+def _free_udp_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+def _connect(simulator: DroneSimulator) -> Podtp:
+    port = simulator.start()
+    podtp = Podtp({'ip': '127.0.0.1', 'port': port, 'stream_port': simulator.stream_port})
+    if not podtp.connect():
+        simulator.stop()
+        raise RuntimeError('Failed to connect to the simulator')
+    return podtp
+
+def command_round_trip(count: int = 200) -> dict:
+    """
+    Latency of acked commands (ctrl_lock) from send to ACK_OK.
+    """
+    simulator = DroneSimulator(state_rate=50, distance_rate=15, frame_rate=0)
+    podtp = _connect(simulator)
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        if not podtp.ctrl_lock(True):
+            raise RuntimeError('Command was not acknowledged')
+        latencies.append((time.perf_counter() - start) * 1e6)
+    podtp.disconnect()
+    simulator.stop()
+    return {
+        'command.rtt_median': (statistics.median(latencies), 'us'),
+        'command.rtt_p99': (statistics.quantiles(latencies, n=100)[98], 'us'),
+    }
+
+def telemetry_throughput(duration: float = 3, rate: float = 2000) -> dict:
+    """
+    LOG_STATE packets per second handled with the simulator sending at rate Hz.
+    """
+    simulator = DroneSimulator(state_rate=rate, distance_rate=rate / 4, frame_rate=0)
+    podtp = _connect(simulator)
+    sensor = podtp.sensor_data
+    time.sleep(0.2)
+    start_seq = sensor.seq('state') + sensor.seq('depth')
+    time.sleep(duration)
+    received = sensor.seq('state') + sensor.seq('depth') - start_seq
+    podtp.disconnect()
+    simulator.stop()
+    return {'telemetry.throughput': (received / duration, 'packets/s')}
+
+def stream_fps(duration: float = 3, frame_rate: float = 30) -> dict:
+    """
+    Decoded 720p frames per second with the simulator sending at frame_rate.
+    """
+    simulator = DroneSimulator(stream_port=_free_udp_port(), frame_rate=frame_rate)
+    podtp = _connect(simulator)
+    podtp.start_stream()
+    sensor = podtp.sensor_data
+    time.sleep(0.5)
+    start_seq = sensor.seq('frame')
+    time.sleep(duration)
+    frames = sensor.seq('frame') - start_seq
+    podtp.stop_stream()
+    podtp.disconnect()
+    simulator.stop()
+    return {'stream.fps': (frames / duration, 'frames/s')}
+
+def benchmark(duration: float = 3) -> dict:
+    results = {}
+    results.update(command_round_trip())
+    results.update(telemetry_throughput(duration))
+    results.update(stream_fps(duration))
+    return results
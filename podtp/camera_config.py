@@ -12,6 +12,16 @@ class CameraConfig:
         FRAMESIZE_XGA = 10     # 1024x768
         FRAMESIZE_HD = 11      # 1280x720
 
+    RESOLUTIONS = {
+        FrameSize.FRAMESIZE_QVGA: (320, 240),
+        FrameSize.FRAMESIZE_CIF: (400, 296),
+        FrameSize.FRAMESIZE_HVGA: (480, 320),
+        FrameSize.FRAMESIZE_VGA: (640, 480),
+        FrameSize.FRAMESIZE_SVGA: (800, 600),
+        FrameSize.FRAMESIZE_XGA: (1024, 768),
+        FrameSize.FRAMESIZE_HD: (1280, 720),
+    }
+
     K = np.array([[454.19405878,   0.,         617.24234876],
                   [  0.,         452.65234296, 299.6066995 ],
                   [  0.,           0.,           1.        ]])
@@ -32,5 +42,8 @@ class CameraConfig:
         self.saturation = saturation
         self.sharpness = sharpness
 
+    def values(self) -> tuple:
+        return (self.on, self.frame_size.value, self.quality, self.brightness, self.contrast, self.saturation, self.sharpness)
+
     def pack(self) -> bytes:
-        return struct.pack('<BBbbbbb', self.on, self.frame_size.value, self.quality, self.brightness, self.contrast, self.saturation, self.sharpness)
\ No newline at end of file
+        return struct.pack('<BBbbbbb', *self.values())
\ No newline at end of file
@@ -0,0 +1,147 @@
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, Optional
+import numpy as np
+
+from .image_packet import IMAGE_SEQ_MASK, IMAGE_SEQ_RESTART, seq_newer
+from .stream_stats import Histogram, DECODE_BOUNDS_MS
+from .utils import print_t
+
+DECODE_WORKERS = 2
+
+def _timed_decode(decode: Callable[[bytes], Optional[np.ndarray]], jpeg: bytes) -> tuple[Optional[np.ndarray], float]:
+    # module level so it pickles for a process pool; the time is measured where the decode runs
+    start = time.perf_counter()
+    frame = decode(jpeg)
+    return frame, (time.perf_counter() - start) * 1000
+
+class DecodePool:
+    """
+    Decode completed JPEGs off the receive thread. submit() never blocks: at
+    most max_in_flight frames are decoding at once and while all slots are busy
+    only the newest waiting JPEG is kept. Decoded frames are published in seq
+    order, a frame finishing after a newer one was published is skipped.
+
+    With workers=0 frames are decoded and published inline by submit().
+    """
+    def __init__(self, decode: Callable[[bytes], Optional[np.ndarray]],
+                 publish: Callable[[int, np.ndarray], None],
+                 workers: int = DECODE_WORKERS, processes: bool = False,
+                 executor: Optional[Executor] = None, max_in_flight: Optional[int] = None) -> None:
+        # decode must be picklable (e.g. a JpegDecoder) when processes is set
+        self.decode = decode
+        self.publish = publish
+        self.workers = workers
+        self.processes = processes
+        # a shared executor is used as is and never shut down here
+        self.shared_executor = executor
+        self.executor = executor
+        self.max_in_flight = max_in_flight or max(workers, 1)
+        self.lock = Lock()
+        self.in_flight = 0
+        self.pending: Optional[tuple[int, bytes]] = None
+        self.last_seq: Optional[int] = None
+        # publish() runs under this lock instead, so a slow consumer never holds up submit()
+        self.publish_lock = Lock()
+        self.published_seq: Optional[int] = None
+
+        self.submitted = 0
+        # JPEGs replaced by a newer one before a worker was free
+        self.dropped = 0
+        # decoded frames older than one already published
+        self.skipped = 0
+        # decoder returned nothing: a corrupt or truncated JPEG
+        self.failed = 0
+        self.decode_time = Histogram(DECODE_BOUNDS_MS)
+
+    def start(self):
+        with self.lock:
+            self.last_seq = None
+            self.published_seq = None
+            if self.executor is not None or self.workers <= 0:
+                return
+            if self.processes:
+                self.executor = ProcessPoolExecutor(self.workers)
+            else:
+                self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='decode')
+
+    def stop(self):
+        """
+        Discard the waiting JPEG and wait for running decodes.
+        """
+        with self.lock:
+            self.pending = None
+            executor = self.executor if self.shared_executor is None else None
+            self.executor = self.shared_executor
+        if executor is not None:
+            executor.shutdown()
+
+    def submit(self, seq: int, jpeg: bytes | memoryview):
+        self.submitted += 1
+        if self.workers <= 0 and self.shared_executor is None:
+            self._finish(seq, *_timed_decode(self.decode, jpeg))
+            return
+        if self.processes:
+            jpeg = bytes(jpeg)
+        with self.lock:
+            executor = self.executor
+            if executor is None:
+                return
+            if self.in_flight >= self.max_in_flight:
+                if self.pending is not None:
+                    self.dropped += 1
+                self.pending = (seq, jpeg)
+                return
+            self.in_flight += 1
+        self._run(executor, seq, jpeg)
+
+    def _run(self, executor: Executor, seq: int, jpeg: bytes | memoryview):
+        try:
+            future = executor.submit(_timed_decode, self.decode, jpeg)
+        except RuntimeError:
+            # the executor shut down under us
+            with self.lock:
+                self.in_flight -= 1
+            return
+        future.add_done_callback(lambda f: self._done(seq, f))
+
+    def _done(self, seq: int, future: Future):
+        try:
+            frame, duration = future.result()
+        except Exception as e:
+            print_t(f'Decode failed: {e}')
+            frame, duration = None, 0.0
+        self._finish(seq, frame, duration)
+        with self.lock:
+            executor = self.executor
+            if self.pending is None or executor is None:
+                self.in_flight -= 1
+                return
+            seq, jpeg = self.pending
+            self.pending = None
+        self._run(executor, seq, jpeg)
+
+    def _finish(self, seq: int, frame: Optional[np.ndarray], duration: float):
+        with self.lock:
+            self.decode_time.observe(duration)
+            if frame is None:
+                self.failed += 1
+                return
+            if self._stale(seq, self.last_seq):
+                self.skipped += 1
+                return
+            self.last_seq = seq
+        with self.publish_lock:
+            # a newer frame may have been published between the two locks
+            if self._stale(seq, self.published_seq):
+                with self.lock:
+                    self.skipped += 1
+                return
+            self.published_seq = seq
+            self.publish(seq, frame)
+
+    @staticmethod
+    def _stale(seq: int, last: Optional[int]) -> bool:
+        return last is not None and not seq_newer(seq, last) \
+            and (last - seq) & IMAGE_SEQ_MASK < IMAGE_SEQ_RESTART
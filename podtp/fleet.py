@@ -0,0 +1,344 @@
+import os
+import selectors
+import socket
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread, current_thread
+from typing import Callable, Optional
+
+from .podtp import Podtp
+from .link import LINK_MAX_WAIT_TIME, WifiLink
+from .decode_pool import DecodePool
+from .session_recorder import SessionRecorder
+from .utils import print_t
+
+STREAM_RECEIVE_BUFFER_SIZE = 65535
+# output a drone's socket has not taken yet, beyond this its link counts as failed
+FLEET_MAX_OUTPUT = 64 * 1024
+
+class FleetDrone(Podtp):
+    """
+    A Podtp handle served by a PodtpFleet. It has the full Podtp command API
+    but no threads or stream link of its own: the fleet's I/O thread reads
+    its data link, receives its stream on a shared socket and writes its send
+    queue through a non-blocking output buffer.
+    """
+    def __init__(self, fleet: 'PodtpFleet', config: dict):
+        if config.get("session_recording"):
+            # one recording per drone, replayable on its own; session_max_bytes applies per drone
+            config = dict(config, session_recording=os.path.join(config["session_recording"],
+                                                                  f'{config["ip"]}_{config.get("port", 80)}'))
+        super().__init__(config)
+        self.fleet = fleet
+        self.ip = config["ip"]
+        self.stream_port = config.get("stream_port", 81)
+        # frames the socket did not take yet, written by the fleet when it is writable; set while empty
+        self.output = bytearray()
+        self.drained = Event()
+        self.drained.set()
+        self.send_queue.on_put = lambda: fleet._mark_dirty(self)
+        self.send_queue.send = lambda data: fleet._write(self, data)
+        # decode on the fleet's shared workers, or inline on the I/O thread without any
+        self.decode_pool = DecodePool(self.frame_decoder, self._publish_frame, fleet.decode_workers,
+                                      executor=fleet.decode_executor)
+        self.stream_stats.decode_pool = self.decode_pool
+
+    def _create_stream_link(self, config: dict) -> Optional[WifiLink]:
+        return None
+
+    def _start_io(self):
+        self.send_queue.start(writer_thread=False)
+        self.fleet._call(self.fleet._add_data_link, self)
+
+    def _stop_io(self):
+        self.send_queue.stop()
+        # what is still queued goes out before the socket leaves the selector
+        self.fleet._call(self.send_queue.flush)
+        if self.fleet.running and not self.drained.wait(LINK_MAX_WAIT_TIME / 1000):
+            print_t(f'{self.ip}: {len(self.output)} bytes not sent before disconnecting')
+        self.fleet._call(self.fleet._remove_data_link, self)
+
+    def _start_stream_io(self) -> bool:
+        self.decode_pool.start()
+        return self.fleet._call(self.fleet._add_stream, self)
+
+    def _stop_stream_io(self):
+        self.fleet._call(self.fleet._remove_stream, self)
+        self.decode_pool.stop()
+
+class PodtpFleet:
+    """
+    Serve many drones from one selectors loop. config is either a Podtp config
+    whose ip_list names the drones (sharing port and stream_port), or a list of
+    per-drone Podtp configs. The stream sockets are shared per local port and
+    datagrams are routed to a drone by their source address.
+    """
+    def __init__(self, config: dict | list[dict], decode_workers: int = 0):
+        if isinstance(config, dict):
+            configs = []
+            for ip in config["ip_list"]:
+                drone_config = {k: v for k, v in config.items() if k not in ('ip_list', 'ip_index')}
+                drone_config["ip"] = ip
+                configs.append(drone_config)
+        else:
+            configs = config
+
+        self.selector = selectors.DefaultSelector()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self.selector.register(self._wakeup_recv, selectors.EVENT_READ, None)
+
+        self.lock = Lock()
+        self.calls = deque()
+        self.dirty: set[FleetDrone] = set()
+        self.stream_sockets: dict[int, socket.socket] = {}
+        # (local stream port, source ip) -> drone
+        self.stream_routes: dict[tuple[int, str], FleetDrone] = {}
+        self.stream_buffer = bytearray(STREAM_RECEIVE_BUFFER_SIZE)
+        self.stream_view = memoryview(self.stream_buffer)
+        self.decode_workers = decode_workers
+        self.decode_executor = ThreadPoolExecutor(decode_workers, thread_name_prefix='decode') \
+            if decode_workers > 0 else None
+
+        self.drones = [FleetDrone(self, drone_config) for drone_config in configs]
+        self.running = False
+        self.thread: Optional[Thread] = None
+        self.next_keep_alive = time.time()
+
+    def __getitem__(self, index: int) -> FleetDrone:
+        return self.drones[index]
+
+    def __len__(self) -> int:
+        return len(self.drones)
+
+    def start(self):
+        self.running = True
+        self.thread = Thread(target=self._io_func)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the I/O thread and release the sockets, the fleet cannot be started again.
+        """
+        self.running = False
+        self.wakeup()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.decode_executor is not None:
+            self.decode_executor.shutdown()
+        for stream_socket in self.stream_sockets.values():
+            stream_socket.close()
+        self.stream_sockets.clear()
+        self.selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+
+    def connect(self, timeout=5) -> list[bool]:
+        """
+        Start the I/O thread if needed and connect every drone.
+        """
+        if not self.running:
+            self.start()
+        return [drone.connect(timeout) for drone in self.drones]
+
+    def disconnect(self):
+        for drone in self.drones:
+            if getattr(drone, 'connected', False):
+                drone.disconnect()
+        self.stop()
+
+    def wakeup(self):
+        try:
+            self._wakeup_send.send(b'\x00')
+        except OSError:
+            # full, or closed by stop()
+            pass
+
+    def _mark_dirty(self, drone: FleetDrone):
+        with self.lock:
+            if drone in self.dirty:
+                return
+            self.dirty.add(drone)
+        self.wakeup()
+
+    def _call(self, function: Callable, *args):
+        """
+        Run function on the I/O thread, the selector is not thread safe.
+        """
+        if not self.running or current_thread() is self.thread:
+            return function(*args)
+        done = Event()
+        result = []
+        with self.lock:
+            self.calls.append((function, args, result, done))
+        self.wakeup()
+        done.wait()
+        return result[0]
+
+    def _run_calls(self):
+        while True:
+            with self.lock:
+                if not self.calls:
+                    return
+                function, args, result, done = self.calls.popleft()
+            result.append(function(*args))
+            done.set()
+
+    def _add_data_link(self, drone: FleetDrone):
+        # never block the I/O thread on one drone, partial sends wait in drone.output
+        drone.data_link.client_socket.setblocking(False)
+        drone.output.clear()
+        drone.drained.set()
+        self.selector.register(drone.data_link.client_socket, selectors.EVENT_READ, drone)
+        self.next_keep_alive = time.time()
+
+    def _remove_data_link(self, drone: FleetDrone):
+        try:
+            self.selector.unregister(drone.data_link.client_socket)
+        except (KeyError, ValueError):
+            pass
+        with self.lock:
+            self.dirty.discard(drone)
+        drone.output.clear()
+        drone.drained.set()
+
+    def _write(self, drone: FleetDrone, data: bytes) -> bool:
+        """
+        SendQueue.send of a drone, on the I/O thread: send what the socket takes
+        right away and buffer the rest until it is writable.
+        """
+        link = drone.data_link
+        if not link.client_connected:
+            print_t(f'Failed to send packet: Not connected to {link.server_ip}:{link.server_port}')
+            return False
+        if drone.output:
+            # keep the order, the buffered bytes go first
+            drone.output += data
+        else:
+            try:
+                sent = link.client_socket.send(data)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except OSError as e:
+                print_t(f'Failed to send packet: {e}')
+                self._fail_data_link(drone)
+                return False
+            if sent == len(data):
+                return True
+            drone.output += memoryview(data)[sent:]
+            drone.drained.clear()
+            self.selector.modify(link.client_socket, selectors.EVENT_READ | selectors.EVENT_WRITE, drone)
+        if len(drone.output) > FLEET_MAX_OUTPUT:
+            print_t(f'Failed to send packet: {drone.ip} has not taken {len(drone.output)} bytes')
+            self._fail_data_link(drone)
+            return False
+        return True
+
+    def _write_output(self, drone: FleetDrone):
+        link = drone.data_link
+        try:
+            sent = link.client_socket.send(drone.output)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            print_t(f'Failed to send packet: {e}')
+            self._fail_data_link(drone)
+            return
+        del drone.output[:sent]
+        if drone.output:
+            return
+        self.selector.modify(link.client_socket, selectors.EVENT_READ, drone)
+        drone.drained.set()
+        # frames queued (and setpoints coalesced) meanwhile
+        drone.send_queue.flush()
+
+    def _fail_data_link(self, drone: FleetDrone):
+        self._remove_data_link(drone)
+        drone.data_link.disconnect()
+
+    def _add_stream(self, drone: FleetDrone) -> bool:
+        stream_socket = self.stream_sockets.get(drone.stream_port)
+        if stream_socket is None:
+            stream_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                stream_socket.bind(('', drone.stream_port))
+            except OSError as e:
+                print_t(f'Failed to bind stream port {drone.stream_port}: {e}')
+                stream_socket.close()
+                return False
+            stream_socket.setblocking(False)
+            self.stream_sockets[drone.stream_port] = stream_socket
+            self.selector.register(stream_socket, selectors.EVENT_READ, drone.stream_port)
+        self.stream_routes[(drone.stream_port, drone.ip)] = drone
+        return True
+
+    def _remove_stream(self, drone: FleetDrone):
+        self.stream_routes.pop((drone.stream_port, drone.ip), None)
+
+    def _io_func(self):
+        while self.running:
+            timeout = max(self.next_keep_alive - time.time(), 0)
+            for key, events in self.selector.select(timeout):
+                if key.data is None:
+                    try:
+                        while self._wakeup_recv.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif isinstance(key.data, int):
+                    self._read_stream(key.fileobj, key.data)
+                else:
+                    if events & selectors.EVENT_WRITE:
+                        self._write_output(key.data)
+                    if events & selectors.EVENT_READ and key.data.data_link.client_connected:
+                        self._read_data(key.data)
+            self._run_calls()
+            self._flush()
+
+    def _read_data(self, drone: FleetDrone):
+        data = drone.data_link.read_available()
+        if data is None:
+            if not drone.data_link.client_connected:
+                self._remove_data_link(drone)
+            return
+        for packet in drone.packet_parser.process(data):
+            drone._handle_packet(packet)
+
+    def _read_stream(self, stream_socket: socket.socket, port: int):
+        # drain the socket, several fragments usually wait after one wakeup
+        while True:
+            try:
+                size, addr = stream_socket.recvfrom_into(self.stream_buffer)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                print_t(f'Error receiving stream data: {e}')
+                return
+            drone = self.stream_routes.get((port, addr[0]))
+            if drone is None or not drone.stream_on:
+                continue
+            if drone.session_recorder is not None:
+                drone.session_recorder.append(SessionRecorder.Channel.STREAM, self.stream_view[:size])
+            drone._handle_stream_data(self.stream_view[:size])
+
+    def _flush(self):
+        with self.lock:
+            dirty = self.dirty
+            self.dirty = set()
+        for drone in dirty:
+            # a drone with buffered output is flushed once the buffer drains
+            if not drone.output:
+                drone.send_queue.flush()
+        now = time.time()
+        if now < self.next_keep_alive:
+            return
+        # keep-alives: flush sends one where due, then sleep until the next is due
+        next_keep_alive = now + 1
+        for drone in self.drones:
+            if drone.send_queue.running and drone.send_queue.keep_alive_enabled() and not drone.output:
+                drone.send_queue.flush()
+                next_keep_alive = min(next_keep_alive, now + max(drone.send_queue.keep_alive_delay(), 0.001))
+        self.next_keep_alive = next_keep_alive
@@ -0,0 +1,191 @@
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional
+import numpy as np
+
+FRAME_RING_MAGIC = 0x50445452 # 'PDTR'
+FRAME_RING_SLOTS = 4
+FRAME_RING_ALIGN = 64
+
+# block layout: header, one metadata record per slot, then the slots themselves
+HEADER_DTYPE = np.dtype([('magic', '<u4'), ('slots', '<u4'), ('slot_size', '<u8'), ('count', '<u8')])
+META_DTYPE = np.dtype([
+    # odd while the writer is filling the slot
+    ('version', '<u8'),
+    # position of the frame in the ring's history, 1 for the first frame
+    ('count', '<u8'),
+    ('seq', '<u4'),
+    ('height', '<u4'),
+    ('width', '<u4'),
+    ('channels', '<u4'),
+    ('started', '<f8'),
+    ('received', '<f8'),
+    ('decoded', '<f8'),
+])
+
+# blocks whose close() found views still alive; kept so they are never unmapped under a view
+_unclosed: list[SharedMemory] = []
+
+def _aligned(size: int) -> int:
+    return (size + FRAME_RING_ALIGN - 1) // FRAME_RING_ALIGN * FRAME_RING_ALIGN
+
+class FrameRing:
+    """
+    Decoded frames in a multiprocessing.shared_memory block: a ring of
+    preallocated slots with seq and timestamp metadata. One process writes,
+    any local process can attach by name and read.
+
+    view() returns arrays backed by the shared memory. A slot is rewritten
+    after slots - 1 newer frames, read() is the safe way to keep one.
+    """
+    class Frame:
+        __slots__ = ('image', 'count', 'seq', 'started', 'received', 'decoded')
+
+        def __init__(self, image: np.ndarray, meta) -> None:
+            self.image = image
+            self.count = int(meta['count'])
+            self.seq = int(meta['seq'])
+            self.started = float(meta['started'])
+            self.received = float(meta['received'])
+            self.decoded = float(meta['decoded'])
+
+        def __repr__(self):
+            return f"FrameRing.Frame(count={self.count}, seq={self.seq}, shape={self.image.shape})"
+
+    def __init__(self, shm: SharedMemory, owner: bool) -> None:
+        self.shm = shm
+        self.owner = owner
+        self.name = shm.name
+        # frombuffer holds a buffer export, so the block cannot be unmapped while any view is alive
+        self.header = np.frombuffer(shm.buf, dtype=HEADER_DTYPE, count=1).reshape(())
+        if self.header['magic'] != FRAME_RING_MAGIC:
+            raise ValueError(f'{shm.name} is not a frame ring')
+        self.slots = int(self.header['slots'])
+        self.slot_size = int(self.header['slot_size'])
+        meta_offset = _aligned(HEADER_DTYPE.itemsize)
+        self.meta = np.frombuffer(shm.buf, dtype=META_DTYPE, count=self.slots, offset=meta_offset)
+        data_offset = _aligned(meta_offset + META_DTYPE.itemsize * self.slots)
+        self.data = np.frombuffer(shm.buf, dtype=np.uint8, count=self.slots * self.slot_size,
+                                  offset=data_offset).reshape((self.slots, self.slot_size))
+
+    @classmethod
+    def create(cls, shape: tuple[int, ...], slots: int = FRAME_RING_SLOTS, name: Optional[str] = None) -> 'FrameRing':
+        """
+        A new ring whose slots hold frames of up to shape (height, width, channels).
+        """
+        slot_size = _aligned(int(np.prod(shape)))
+        meta_offset = _aligned(HEADER_DTYPE.itemsize)
+        size = _aligned(meta_offset + META_DTYPE.itemsize * slots) + slot_size * slots
+        shm = SharedMemory(name, create=True, size=size)
+        header = np.frombuffer(shm.buf, dtype=HEADER_DTYPE, count=1).reshape(())
+        header['slots'] = slots
+        header['slot_size'] = slot_size
+        header['count'] = 0
+        header['magic'] = FRAME_RING_MAGIC
+        del header
+        return cls(shm, True)
+
+    @classmethod
+    def attach(cls, name: str, track: bool = False) -> 'FrameRing':
+        """
+        Attach to an existing ring. Unless track is set, this process's
+        resource tracker must not unlink the block when the process exits.
+        """
+        shm = SharedMemory(name)
+        if not track:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, False)
+
+    def close(self):
+        """
+        Unmap the block, the owner also removes its name. While views handed
+        out before are alive the block stays mapped.
+        """
+        self.header = self.meta = self.data = None
+        try:
+            self.shm.close()
+        except BufferError:
+            _unclosed.append(self.shm)
+        if self.owner:
+            self.shm.unlink()
+
+    @property
+    def count(self) -> int:
+        """
+        Frames written so far.
+        """
+        return int(self.header['count'])
+
+    def write(self, image: np.ndarray, seq: int, started: float = 0, received: float = 0) -> int:
+        """
+        Copy a frame into the next slot and return its count, 0 if it does not fit.
+        """
+        if image.nbytes > self.slot_size:
+            return 0
+        count = int(self.header['count']) + 1
+        meta = self.meta[count % self.slots]
+        meta['version'] += 1
+        self.data[count % self.slots, :image.nbytes].reshape(image.shape)[...] = image
+        meta['count'] = count
+        meta['seq'] = seq
+        meta['height'], meta['width'] = image.shape[:2]
+        meta['channels'] = image.shape[2] if image.ndim > 2 else 1
+        meta['started'] = started
+        meta['received'] = received
+        meta['decoded'] = time.time()
+        meta['version'] += 1
+        self.header['count'] = count
+        return count
+
+    def view(self, count: Optional[int] = None) -> Optional['FrameRing.Frame']:
+        """
+        The frame with the given count (default: the latest) backed by shared
+        memory, None if it was overwritten or is being written.
+        """
+        if count is None:
+            count = int(self.header['count'])
+        if count <= 0:
+            return None
+        meta = self.meta[count % self.slots]
+        version = int(meta['version'])
+        if version & 1 or int(meta['count']) != count:
+            return None
+        height, width, channels = int(meta['height']), int(meta['width']), int(meta['channels'])
+        image = self.data[count % self.slots, :height * width * channels]
+        image = image.reshape((height, width, channels) if channels > 1 else (height, width))
+        return FrameRing.Frame(image, meta)
+
+    def read(self, count: Optional[int] = None) -> Optional['FrameRing.Frame']:
+        """
+        Like view() but the image is copied and checked against concurrent rewrites.
+        """
+        while True:
+            latest = int(self.header['count']) if count is None else count
+            if latest <= 0:
+                return None
+            version = int(self.meta['version'][latest % self.slots])
+            frame = self.view(latest)
+            if frame is None:
+                if count is not None:
+                    return None
+                continue
+            frame.image = frame.image.copy()
+            if int(self.meta['version'][latest % self.slots]) == version:
+                return frame
+            if count is not None:
+                return None
+
+    def wait(self, after_count: int, timeout: Optional[float] = None, interval: float = 0.002) -> Optional[int]:
+        """
+        Poll until a frame after after_count was written and return the
+        latest count, None on timeout. Meant for processes that attached.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            count = int(self.header['count'])
+            if count > after_count:
+                return count
+            if deadline is not None and time.time() >= deadline:
+                return None
+            time.sleep(interval)
@@ -1,9 +1,19 @@
 from PIL import Image
-import io, time
+import io, struct, time
+from typing import Optional
 
 IMAGE_PACKET_SIZE = 1024
 IMAGE_HEADER_SIZE = 8
 IMAGE_PAYLOAD_SIZE = IMAGE_PACKET_SIZE - IMAGE_HEADER_SIZE
+# seq, index, total, size
+IMAGE_HEADER = struct.Struct('<HHHH')
+IMAGE_SEQ_MASK = 0xFFFF
+IMAGE_SEQ_HALF = 0x8000
+# frames in flight at once, a frame takes ~70 fragments at 720p
+REASSEMBLY_WINDOW = 4
+REASSEMBLY_TIMEOUT = 1.0
+# a seq this far behind the last completed one means the drone restarted
+IMAGE_SEQ_RESTART = 64
 
 class ImagePacket:
     class Header:
@@ -77,43 +87,199 @@ class ImagePacket:
     def __repr__(self):
         return f"ImagePacket(seq={self.header.seq}, index={self.header.index}, total={self.header.total}, size={self.header.size})"
     
+def seq_newer(a: int, b: int) -> bool:
+    """
+    True if 16-bit sequence number a comes after b, across wraparound.
+    """
+    return 0 < ((a - b) & IMAGE_SEQ_MASK) < IMAGE_SEQ_HALF
+
+class JpegFrame:
+    """
+    A reassembled frame as the camera sent it: still compressed and upside
+    down. started is when its first fragment arrived, received when the last
+    one did (time.time()).
+    """
+    __slots__ = ('seq', 'jpeg', 'started', 'received')
+
+    def __init__(self, seq: int, jpeg: bytes | memoryview, started: float, received: float) -> None:
+        self.seq = seq
+        self.jpeg = jpeg
+        self.started = started
+        self.received = received
+
+    def __repr__(self):
+        return f"JpegFrame(seq={self.seq}, size={len(self.jpeg)}, latency={self.received - self.started:.3f})"
+
+class ImageFrame:
+    """
+    Reassembly state of one seq. Fragments are written straight into buffer at
+    index * IMAGE_PAYLOAD_SIZE, every fragment but the last is a full payload.
+    """
+    __slots__ = ('seq', 'total', 'buffer', 'received', 'count', 'size', 'timestamp')
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self.received = bytearray()
+        self.reset(0, 0)
+
+    def reset(self, seq: int, total: int) -> 'ImageFrame':
+        # an evicted frame's buffer is reused when it is large enough
+        self.seq = seq
+        self.total = total
+        if len(self.buffer) < total * IMAGE_PAYLOAD_SIZE:
+            self.buffer = bytearray(total * IMAGE_PAYLOAD_SIZE)
+        if len(self.received) < total:
+            self.received = bytearray(total)
+        else:
+            self.received[:total] = bytes(total)
+        self.count = 0
+        self.size = 0
+        self.timestamp = time.time()
+        return self
+
 class ImageParser:
-    def __init__(self):
-        self.image_packets = {}
+    """
+    Reassemble JPEG frames from image fragments. At most window frames are in
+    flight: a new seq evicts the oldest partial frame when the window is full,
+    completing a frame evicts every older partial one, and fragments of frames
+    at or before the last completed seq are dropped. Sequence numbers are
+    compared modulo 2^16 so the window keeps working after wraparound.
+    """
+    def __init__(self, window: int = REASSEMBLY_WINDOW, timeout: float = REASSEMBLY_TIMEOUT):
+        self.window = window
+        self.timeout = timeout
+        self.image_packets: dict[int, ImageFrame] = {}
+        self.spare: list[ImageFrame] = []
+        self.last_seq: Optional[int] = None
         self.image = None
+        # first fragment time of the last completed frame
+        self.image_started = 0.0
         self.last_cleanup = time.time()
 
-    def process(self, packet: ImagePacket) -> tuple[int, Image.Image | None]:
-        seq = packet.header.seq
-        index = packet.header.index
-        total = packet.header.total
-        size = packet.header.size
-        data = packet.data
+        self.fragments = 0
+        # fragments never received of frames that were evicted
+        self.missing_fragments = 0
+        self.completed = 0
+        # partial frames dropped because a newer frame completed first
+        self.evicted_stale = 0
+        # partial frames dropped to make room in the window
+        self.evicted_overflow = 0
+        # partial frames dropped by cleanup() after timeout seconds
+        self.evicted_timeout = 0
+        self.late_fragments = 0
+        self.duplicate_fragments = 0
+        self.invalid_fragments = 0
 
-        if seq not in self.image_packets:
-            self.image_packets[seq] = ([None] * total, time.time())
-        
-        packet_buffer, _ = self.image_packets[seq]
-        packet_buffer[index] = data.bytes(0, size)
-
-        if None not in packet_buffer:
-            self.image = b''.join(packet_buffer)
-            del packet_buffer
-            try:
-                img = Image.open(io.BytesIO(self.image)).rotate(180)
-                return seq, img
-            except Exception as e:
+    def process(self, packet: ImagePacket | bytes | memoryview) -> tuple[int, Image.Image | None]:
+        seq, jpeg = self.assemble(packet)
+        if jpeg is None:
+            return seq, None
+        return seq, self.decode(jpeg)
+
+    def assemble(self, packet: ImagePacket | bytes | memoryview) -> tuple[int, memoryview | None]:
+        """
+        Add a fragment and return the complete JPEG once all fragments of seq arrived.
+        packet may be the raw datagram, it is only read during the call. The
+        returned view owns its buffer, the parser does not touch it again.
+        """
+        self.fragments += 1
+        data = memoryview(packet.buffer if isinstance(packet, ImagePacket) else packet)
+        if len(data) < IMAGE_HEADER_SIZE:
+            self.invalid_fragments += 1
+            return -1, None
+        seq, index, total, size = IMAGE_HEADER.unpack_from(data, 0)
+        if index >= total or size > IMAGE_PAYLOAD_SIZE or len(data) < IMAGE_HEADER_SIZE + size:
+            self.invalid_fragments += 1
+            return seq, None
+
+        frame = self.image_packets.get(seq)
+        if frame is None or frame.total != total:
+            if frame is None and self.last_seq is not None and not seq_newer(seq, self.last_seq):
+                if (self.last_seq - seq) & IMAGE_SEQ_MASK < IMAGE_SEQ_RESTART:
+                    self.late_fragments += 1
+                    return seq, None
+                # far behind the last frame: the drone restarted its counter
+                self.last_seq = None
+            frame = self._new_frame(seq, total)
+            if frame is None:
+                self.late_fragments += 1
                 return seq, None
+        if frame.received[index]:
+            self.duplicate_fragments += 1
+            return seq, None
+
+        offset = index * IMAGE_PAYLOAD_SIZE
+        frame.buffer[offset:offset + size] = data[IMAGE_HEADER_SIZE:IMAGE_HEADER_SIZE + size]
+        frame.received[index] = 1
+        frame.count += 1
+        if index == total - 1:
+            frame.size = offset + size
+
+        if frame.count == total:
+            return seq, self._complete(frame)
         return seq, None
+
+    def _new_frame(self, seq: int, total: int) -> Optional[ImageFrame]:
+        # None if the window is full of frames newer than seq
+        self.cleanup()
+        old = self.image_packets.pop(seq, None)
+        if old is not None:
+            # same seq with a different fragment count, a leftover from the last wrap
+            self.evicted_stale += 1
+            self._evict(old)
+        while len(self.image_packets) >= self.window:
+            oldest = None
+            for s in self.image_packets:
+                if oldest is None or seq_newer(oldest, s):
+                    oldest = s
+            if not seq_newer(seq, oldest):
+                return None
+            self._evict(self.image_packets.pop(oldest))
+            self.evicted_overflow += 1
+        frame = (self.spare.pop() if self.spare else ImageFrame()).reset(seq, total)
+        del self.spare[self.window:]
+        self.image_packets[seq] = frame
+        return frame
+
+    def _evict(self, frame: ImageFrame):
+        self.missing_fragments += frame.total - frame.count
+        self.spare.append(frame)
+
+    def _complete(self, frame: ImageFrame) -> memoryview:
+        del self.image_packets[frame.seq]
+        for seq in [s for s in self.image_packets if seq_newer(frame.seq, s)]:
+            self._evict(self.image_packets.pop(seq))
+            self.evicted_stale += 1
+        self.last_seq = frame.seq
+        self.completed += 1
+        # the caller keeps the buffer, the frame object is recycled empty
+        self.image = memoryview(frame.buffer)[:frame.size]
+        self.image_started = frame.timestamp
+        frame.buffer = bytearray()
+        self.spare.append(frame)
+        del self.spare[self.window:]
+        return self.image
+
+    def decode(self, jpeg: bytes | memoryview) -> Image.Image | None:
+        try:
+            return Image.open(io.BytesIO(jpeg)).rotate(180)
+        except Exception as e:
+            return None
     
     def cleanup(self):
+        """
+        Drop partial frames that have waited longer than timeout.
+        """
         current_time = time.time()
         if current_time - self.last_cleanup < 1:
             return
+        self.last_cleanup = current_time
         to_remove = []
-        for seq, (packet_buffer, timestamp) in self.image_packets.items():
-            if current_time - timestamp > 3:
+        for seq, frame in self.image_packets.items():
+            if current_time - frame.timestamp > self.timeout:
                 to_remove.append(seq)
         
         for seq in to_remove:
-            del self.image_packets[seq]
\ No newline at end of file
+            self._evict(self.image_packets.pop(seq))
+            self.evicted_timeout += 1
+        del self.spare[self.window:]
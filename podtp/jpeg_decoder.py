@@ -0,0 +1,163 @@
+import io
+from enum import Enum
+from threading import Lock
+from typing import Optional
+import numpy as np
+from PIL import Image
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    import turbojpeg
+except ImportError:
+    turbojpeg = None
+
+class JpegDecoder:
+    """
+    Decode stream JPEGs to upright arrays. The camera is mounted upside down,
+    the 180 degree turn is done as a flip while the pixels are copied out of
+    the decoder. scale 2, 4 or 8 decodes at reduced resolution in the DCT
+    domain, which is also much faster.
+
+    With buffers > 0 frames are written into a ring of that many reused
+    arrays: a frame stays valid until buffers more frames were decoded.
+    Instances pickle by configuration, so they work in a process pool.
+    """
+    class Backend(Enum):
+        AUTO = 'auto'
+        PIL = 'pil'
+        OPENCV = 'opencv'
+        TURBOJPEG = 'turbojpeg'
+
+    class PixelFormat(Enum):
+        RGB = 'rgb'
+        BGR = 'bgr'
+
+    SCALES = (1, 2, 4, 8)
+
+    def __init__(self, backend: 'JpegDecoder.Backend | str' = Backend.AUTO, scale: int = 1,
+                 pixel_format: 'JpegDecoder.PixelFormat | str' = PixelFormat.RGB, buffers: int = 0) -> None:
+        if scale not in JpegDecoder.SCALES:
+            raise ValueError(f'scale must be one of {JpegDecoder.SCALES}, got {scale}')
+        backend = JpegDecoder.Backend(backend)
+        if backend == JpegDecoder.Backend.AUTO:
+            backend = JpegDecoder.available()[0]
+        elif backend not in JpegDecoder.available():
+            raise ImportError(f'JPEG decode backend {backend.value} is not installed')
+        self.backend = backend
+        self.scale = scale
+        self.pixel_format = JpegDecoder.PixelFormat(pixel_format)
+        self.buffers = buffers
+        # why the last corrupt frame failed to decode
+        self.last_error: Optional[str] = None
+        self._ring: list[Optional[np.ndarray]] = [None] * buffers
+        self._next = 0
+        self._lock = Lock()
+        self._decode = {
+            JpegDecoder.Backend.PIL: self._decode_pil,
+            JpegDecoder.Backend.OPENCV: self._decode_opencv,
+            JpegDecoder.Backend.TURBOJPEG: self._decode_turbojpeg,
+        }[backend]
+        self._turbojpeg = turbojpeg.TurboJPEG() if backend == JpegDecoder.Backend.TURBOJPEG else None
+
+    @staticmethod
+    def available() -> list['JpegDecoder.Backend']:
+        """
+        Installed backends, fastest first.
+        """
+        backends = []
+        if turbojpeg is not None:
+            try:
+                turbojpeg.TurboJPEG()
+                backends.append(JpegDecoder.Backend.TURBOJPEG)
+            except Exception:
+                # the binding is there but libturbojpeg is not
+                pass
+        if cv2 is not None:
+            backends.append(JpegDecoder.Backend.OPENCV)
+        backends.append(JpegDecoder.Backend.PIL)
+        return backends
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'JpegDecoder':
+        return cls(config.get("decode_backend", JpegDecoder.Backend.AUTO), config.get("decode_scale", 1),
+                   config.get("pixel_format", JpegDecoder.PixelFormat.RGB), config.get("frame_buffers", 0))
+
+    def __getstate__(self) -> dict:
+        return {'backend': self.backend, 'scale': self.scale,
+                'pixel_format': self.pixel_format, 'buffers': self.buffers}
+
+    def __setstate__(self, state: dict):
+        self.__init__(**state)
+
+    def __call__(self, jpeg: bytes | memoryview) -> Optional[np.ndarray]:
+        """
+        Decode one frame, None if the JPEG is corrupt.
+        """
+        try:
+            return self._decode(jpeg)
+        except Exception as e:
+            self.last_error = f'{type(e).__name__}: {e}'
+            return None
+
+    def _output(self, shape: tuple) -> Optional[np.ndarray]:
+        if self.buffers <= 0:
+            return None
+        with self._lock:
+            index = self._next
+            self._next = (index + 1) % self.buffers
+            out = self._ring[index]
+            if out is None or out.shape != shape:
+                # first frame or the camera resolution changed
+                out = self._ring[index] = np.empty(shape, dtype=np.uint8)
+        return out
+
+    def _reverse(self, image: np.ndarray) -> np.ndarray:
+        # reversing rows, columns and channels is one flat reverse copy: the frame
+        # turns 180 degrees and RGB becomes BGR (or back)
+        out = self._output(image.shape)
+        if out is None:
+            return np.ascontiguousarray(image[::-1, ::-1, ::-1])
+        np.copyto(out, image[::-1, ::-1, ::-1])
+        return out
+
+    def _decode_pil(self, jpeg: bytes | memoryview) -> np.ndarray:
+        image = Image.open(io.BytesIO(jpeg))
+        if self.scale > 1:
+            image.draft('RGB', (image.width // self.scale, image.height // self.scale))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        if self.pixel_format == JpegDecoder.PixelFormat.BGR:
+            return self._reverse(np.asarray(image))
+        if cv2 is not None:
+            array = np.asarray(image)
+            return cv2.flip(array, -1, dst=self._output(array.shape))
+        # a strided numpy flip that keeps the channel order is several times slower than PIL's
+        array = np.asarray(image.transpose(Image.Transpose.ROTATE_180))
+        out = self._output(array.shape)
+        if out is None:
+            # asarray of a PIL image is read-only
+            return array.copy()
+        np.copyto(out, array)
+        return out
+
+    def _decode_opencv(self, jpeg: bytes | memoryview) -> np.ndarray:
+        flags = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}[self.scale]
+        image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), flags)
+        if image is None:
+            raise ValueError('corrupt JPEG')
+        if self.pixel_format == JpegDecoder.PixelFormat.RGB:
+            return self._reverse(image)
+        out = self._output(image.shape)
+        return cv2.flip(image, -1, dst=image if out is None else out)
+
+    def _decode_turbojpeg(self, jpeg: bytes | memoryview) -> np.ndarray:
+        # decode in the opposite channel order, _reverse swaps it back
+        pixel_format = turbojpeg.TJPF_RGB if self.pixel_format == JpegDecoder.PixelFormat.BGR else turbojpeg.TJPF_BGR
+        image = self._turbojpeg.decode(bytes(jpeg), pixel_format=pixel_format,
+                                       scaling_factor=(1, self.scale) if self.scale > 1 else None)
+        return self._reverse(image)
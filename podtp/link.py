@@ -2,12 +2,15 @@ import socket
 import select
 from enum import Enum
 from typing import Optional
+from .udp_batch import UdpBatchReceiver, set_receive_buffer
 from .utils import print_t
 
 LINK_MAX_WAIT_TIME = 5000
+LINK_RECEIVE_BUFFER_SIZE = 65535
 
 class WifiLink:
-    def __init__(self, server_ip: str, server_port: int, use_udp = False):
+    def __init__(self, server_ip: str, server_port: int, use_udp = False, buffer_size = LINK_RECEIVE_BUFFER_SIZE,
+                 tcp_nodelay = False, receive_buffer: Optional[int] = None, batch_size = 0):
         self.server_ip = server_ip
         self.server_port = server_port
         if server_ip == '255.255.255.255' or server_ip == '0.0.0.0':
@@ -21,8 +24,43 @@ class WifiLink:
             self.use_udp = False
             self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if tcp_nodelay:
+                self.client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             self.client_socket.settimeout(LINK_MAX_WAIT_TIME / 1000)
         self.client_connected = False
+        # receive_into() reads into this buffer and returns views of it
+        self.buffer = bytearray(buffer_size)
+        self.buffer_view = memoryview(self.buffer)
+        # wakeup() writes here so a blocked receive_into() returns right away
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        # kernel receive buffer in bytes, the system default unless receive_buffer is given
+        self.receive_buffer = None
+        if receive_buffer:
+            self.receive_buffer = set_receive_buffer(self.client_socket, receive_buffer)
+            if self.receive_buffer < receive_buffer:
+                print_t(f'Receive buffer limited to {self.receive_buffer} bytes, raise net.core.rmem_max for more')
+        # a SessionRecorder that gets everything received, see record()
+        self.recorder = None
+        self.record_channel = 0
+        # receive_batch() drains up to batch_size datagrams per wakeup
+        self.batch = UdpBatchReceiver(self.client_socket, batch_size) if self.use_udp and batch_size > 1 else None
+
+    @property
+    def kernel_drops(self) -> Optional[int]:
+        """
+        Datagrams the kernel dropped for a full receive buffer as reported with
+        the received datagrams, None unless batched receive on Linux.
+        """
+        return self.batch.drops if self.batch is not None else None
+
+    def record(self, recorder, channel: int):
+        """
+        Append every received chunk or datagram to recorder (a SessionRecorder) as channel, None to stop.
+        """
+        self.recorder = recorder
+        self.record_channel = channel
 
     def connect(self, timeout=5) -> bool:
         try:
@@ -44,11 +82,25 @@ class WifiLink:
         self.client_connected = False
         print_t(f'Disconnected from {self.server_ip}:{self.server_port}')
 
+    def close(self):
+        """
+        Release the socket and the wakeup pair, the link cannot be used afterwards.
+        """
+        if self.client_connected:
+            self.disconnect()
+        self.client_socket.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+
     def send(self, data: bytearray) -> bool:
         if not self.client_connected:
             print_t(f'Failed to send packet: Not connected to {self.server_ip}:{self.server_port}')
             return False
-        self.client_socket.send(data)
+        try:
+            self.client_socket.sendall(data)
+        except OSError as e:
+            print_t(f'Failed to send packet: {e}')
+            return False
         return True
 
     def receive(self, length=4096, timeout=0.001) -> Optional[bytes]:
@@ -81,9 +133,104 @@ class WifiLink:
                 self.disconnect()  # Ensure the connection is marked as closed
                 return None
 
+            if self.recorder is not None:
+                self.recorder.append(self.record_channel, data)
             return data
 
         except (socket.timeout, ConnectionResetError, OSError) as e:
             print_t(f"Error receiving data: {e}")
             self.disconnect()  # Handle connection errors gracefully
-            return None
\ No newline at end of file
+            return None
+
+    def wakeup(self):
+        """
+        Interrupt a receive_into() blocked in another thread.
+        """
+        try:
+            self._wakeup_send.send(b'\x00')
+        except BlockingIOError:
+            pass
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_recv.recv(64):
+                pass
+        except BlockingIOError:
+            pass
+
+    def receive_into(self, timeout: Optional[float] = None) -> Optional[memoryview]:
+        """
+        Block until data is received, wakeup() is called or the timeout expires.
+        The data is read into the preallocated link buffer without allocating.
+        :param timeout: The number of seconds to wait for data, None to wait indefinitely.
+        :return: A view of the received data, valid until the next call, or None.
+        """
+        if not self._wait_readable(timeout):
+            return None
+        return self.read_available()
+
+    def receive_batch(self, timeout: Optional[float] = None) -> list[memoryview]:
+        """
+        Like receive_into() but return every datagram waiting after the wakeup,
+        up to batch_size, read with one recvmmsg call where available.
+        :return: Views of the datagrams, valid until the next call; empty on timeout.
+        """
+        if not self._wait_readable(timeout):
+            return []
+        if self.batch is None:
+            data = self.read_available()
+            return [] if data is None else [data]
+        try:
+            datagrams = self.batch.receive()
+        except OSError as e:
+            print_t(f"Error receiving data: {e}")
+            self.disconnect()
+            return []
+        if self.recorder is not None:
+            for data in datagrams:
+                self.recorder.append(self.record_channel, data)
+        return datagrams
+
+    def _wait_readable(self, timeout: Optional[float]) -> bool:
+        if not self.client_connected:
+            print_t(f'Failed to receive packet: Not connected to {self.server_ip}:{self.server_port}')
+            return False
+
+        try:
+            readable, _, _ = select.select([self.client_socket, self._wakeup_recv], [], [], timeout)
+            if self._wakeup_recv in readable:
+                self._drain_wakeup()
+                return False
+            return bool(readable)
+        except (socket.timeout, ConnectionResetError, OSError) as e:
+            print_t(f"Error receiving data: {e}")
+            self.disconnect()
+            return False
+
+    def read_available(self) -> Optional[memoryview]:
+        """
+        Read data the socket already has, for callers that run their own
+        select/selectors loop. Same buffer semantics as receive_into().
+        """
+        try:
+            if self.use_udp:
+                size, addr = self.client_socket.recvfrom_into(self.buffer)
+                if size == 0:
+                    return None
+            else:
+                size = self.client_socket.recv_into(self.buffer)
+                if size == 0:
+                    print_t("Connection closed by the server.")
+                    self.disconnect()
+                    return None
+
+            if self.recorder is not None:
+                self.recorder.append(self.record_channel, self.buffer_view[:size])
+            return self.buffer_view[:size]
+
+        except (BlockingIOError, InterruptedError):
+            return None
+        except (socket.timeout, ConnectionResetError, OSError) as e:
+            print_t(f"Error receiving data: {e}")
+            self.disconnect()
+            return None
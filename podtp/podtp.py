@@ -1,8 +1,7 @@
 import queue
-import struct
 import time
-from typing import Optional
-from threading import Thread, Lock
+from typing import Callable, Optional
+from threading import Thread
 import numpy as np
 from numpy.typing import NDArray
 import logging
@@ -14,44 +13,111 @@ logging.basicConfig(
     filemode="w",  # Overwrite the file each time
 )
 
-from .podtp_packet import PODTP_MAX_DATA_LEN, PodtpPacket, PodtpType, PodtpPort
+from .podtp_packet import PodtpPacket, PodtpPacketPool, PodtpType, PodtpPort, header_byte
 from .link import WifiLink
 from .utils import print_t
 from .podtp_parser import PodtpParser
+from .podtp_codec import PodtpMessage, \
+    MSG_COMMAND_RPYT, MSG_COMMAND_TAKEOFF, MSG_COMMAND_LAND, MSG_COMMAND_HOVER, \
+    MSG_COMMAND_POSITION, MSG_COMMAND_VELOCITY, MSG_LOG_DISTANCE, MSG_LOG_STATE, \
+    MSG_CTRL_LOCK, MSG_CTRL_KEEP_ALIVE, MSG_CTRL_RESET_ESTIMATOR, MSG_CTRL_OBSTACLE_AVOIDANCE, \
+    MSG_ESP32_ECHO, MSG_ESP32_ENABLE_STM32, MSG_ESP32_CONFIG_CAMERA, MSG_ESP32_ENABLE_STREAM
+from .send_queue import SendQueue, SendPriority
 from .camera_config import CameraConfig
 from .sensor import Sensor
-from .image_packet import ImagePacket, ImageParser
+from .image_packet import ImageParser, JpegFrame
+from .jpeg_decoder import JpegDecoder
+from .undistort import Undistorter, UndistortingDecoder
+from .decode_pool import DecodePool, DECODE_WORKERS
+from .frame_ring import FrameRing
+from .stream_process import StreamProcess
+from .stream_stats import StreamStats
+from .quality_controller import QualityController
+from .session_recorder import SessionRecorder, SESSION_MAX_BYTES
+from .udp_batch import BATCH_SIZE, STREAM_RECEIVE_BUFFER
 
 COMMAND_TIMEOUT_MS = 450
+# read enough per call to drain several PODTP frames from one TCP segment
+PODTP_RECEIVE_SIZE = 4096
+
+# messages that jump the send queue, and continuous setpoints of which only the latest is sent
+MESSAGE_PRIORITY = {
+    MSG_COMMAND_LAND: SendPriority.SAFETY,
+    MSG_CTRL_LOCK: SendPriority.SAFETY,
+    MSG_COMMAND_RPYT: SendPriority.SETPOINT,
+    MSG_COMMAND_HOVER: SendPriority.SETPOINT,
+    MSG_COMMAND_VELOCITY: SendPriority.SETPOINT,
+}
 
 class Podtp:
     def __init__(self, config: dict):
         if 'ip_index' in config:
             config["ip"] = config["ip_list"][config["ip_index"]]
-        self.data_link = WifiLink(config["ip"], config.get("port", 80))
-        self.packet_parser = PodtpParser()
+        self.data_link = WifiLink(config["ip"], config.get("port", 80), buffer_size=PODTP_RECEIVE_SIZE,
+                                  tcp_nodelay=config.get("tcp_nodelay", True))
+        self.packet_pool = PodtpPacketPool()
+        self.packet_parser = PodtpParser(self.packet_pool)
         self.packet_queue = {}
-        self.last_packet_time_lock = Lock()
-        self.last_packet_time = time.time()
         self.keep_alive = True
+        # all outgoing frames go through one writer thread, which also sends keep-alives
+        self.send_queue = SendQueue(self.data_link, bytes(MSG_CTRL_KEEP_ALIVE.encode()),
+                                    COMMAND_TIMEOUT_MS / 1000, lambda: self.keep_alive)
         for type in PodtpType:
             self.packet_queue[type.value] = queue.Queue()
+        self._build_dispatch_table()
 
-        self.stream_link = WifiLink(config["ip"], config.get("stream_port", 81), True)
+        self.stream_link = self._create_stream_link(config)
         self.image_parser = ImageParser()
+        # reassembly stays on the stream thread, decoding runs in the pool
+        self.jpeg_decoder = JpegDecoder.from_config(config)
+        # optional fisheye undistortion, applied on the decode workers after decoding
+        self.undistorter = Undistorter.from_config(config)
+        self.frame_decoder = self.jpeg_decoder if self.undistorter is None \
+            else UndistortingDecoder(self.jpeg_decoder, self.undistorter)
+        self.decode_pool = DecodePool(self.frame_decoder, self._publish_frame,
+                                      config.get("decode_workers", DECODE_WORKERS),
+                                      config.get("decode_processes", False))
+        self.stream_stats = StreamStats(self.image_parser, self.decode_pool, self.stream_link)
+        # with decode_frames off only sensor_data.jpeg is updated
+        self.decode_frames = config.get("decode_frames", True)
+        # receive and decode in a separate process, frames arrive through a shared memory ring;
+        # only decoded frames cross it, sensor_data.jpeg is not updated in this mode
+        self.stream_process = None
+        if config.get("stream_process", False):
+            if not self.decode_frames:
+                raise ValueError('stream_process delivers decoded frames only, it needs decode_frames on')
+            self.stream_process = StreamProcess(config, self._ring_frame, self._ring_stopped)
+        self.camera_config = CameraConfig()
+        # steps frame size and quality to hold target_fps on a congested link
+        self.quality_controller = QualityController(self.stream_health, self._config_camera, self.camera_config,
+                                                    config.get("target_fps", 15)) if config.get("adaptive_quality", False) else None
         self.stream_on = False
         self.sensor_data = Sensor()
+        # raw capture of both links for replay, see SessionRecorder; a stream process records the stream itself
+        self.session_recorder = None
+        if config.get("session_recording"):
+            self.session_recorder = SessionRecorder(config["session_recording"],
+                                                    max_bytes=config.get("session_max_bytes", SESSION_MAX_BYTES))
+            self.data_link.record(self.session_recorder, SessionRecorder.Channel.DATA)
+            if self.stream_link is not None:
+                self.stream_link.record(self.session_recorder, SessionRecorder.Channel.STREAM)
+
+    def _create_stream_link(self, config: dict) -> Optional[WifiLink]:
+        return WifiLink(config["ip"], config.get("stream_port", 81), True,
+                        receive_buffer=config.get("stream_receive_buffer", STREAM_RECEIVE_BUFFER),
+                        batch_size=config.get("stream_batch_size", BATCH_SIZE))
 
     def connect(self, timeout=5) -> bool:
         """
         Connect to the ESP32.
         """
+        if self.session_recorder is not None:
+            self.session_recorder.start()
         self.connected = self.data_link.connect(timeout)
         if self.connected:
-            self.packet_thread = Thread(target=self._receive_packets_func)
-            self.packet_thread.start()
-            self.keep_alive_thread = Thread(target=self._keep_alive_func)
-            self.keep_alive_thread.start()
+            self._start_io()
+        elif self.session_recorder is not None:
+            self.session_recorder.stop()
         return self.connected
 
     def disconnect(self):
@@ -59,79 +125,166 @@ class Podtp:
         self.stop_stream()
         self.connected = False
         self.keep_alive = False
+        self._stop_io()
+        self.data_link.close()
+        if self.stream_link is not None:
+            self.stream_link.close()
+        if self.session_recorder is not None:
+            self.session_recorder.stop()
+
+    def _start_io(self):
+        self.packet_thread = Thread(target=self._receive_packets_func)
+        self.packet_thread.start()
+        self.send_queue.start()
+
+    def _stop_io(self):
+        self.data_link.wakeup()
         self.packet_thread.join()
-        self.keep_alive_thread.join()
-        self.data_link.disconnect()
+        self.send_queue.stop()
 
     def start_stream(self):
-        self._config_camera(CameraConfig())
+        self._config_camera(self.camera_config)
         time.sleep(0.5) # wait for the esp32 to configure the camera and close the previous TCP link
         self._enable_stream()
-        self.stream_on = self.stream_link.connect()
-        if self.stream_on:
-            self.stream_thread = Thread(target=self._stream_func)
-            self.stream_thread.start()
+        self.stream_on = self._start_stream_io()
+        if self.stream_on and self.quality_controller is not None:
+            self.quality_controller.start()
+
+    def _start_stream_io(self) -> bool:
+        if self.stream_process is not None:
+            return self.stream_process.start()
+        if not self.stream_link.connect():
+            return False
+        self.decode_pool.start()
+        # the thread runs while stream_on is set
+        self.stream_on = True
+        self.stream_thread = Thread(target=self._stream_func)
+        self.stream_thread.start()
+        return True
+
+    def _stop_stream_io(self):
+        if self.stream_process is not None:
+            self.stream_process.stop()
+            return
+        self.stream_link.wakeup()
+        self.stream_thread.join()
+        self.decode_pool.stop()
+
+    def stream_health(self) -> dict:
+        """
+        Loss, eviction, latency, decode time, frame rate and socket drop
+        counters of the stream, see StreamStats.snapshot().
+        """
+        if self.stream_process is not None:
+            # reassembly and decode run in the worker, it reports once a second
+            health = dict(self.stream_process.stats)
+            health['frames_delivered'] = self.stream_stats.delivered
+            health['fps'] = self.stream_stats.fps()
+            return health
+        return self.stream_stats.snapshot()
 
     def _enable_stream(self, enable = True):
-        packet = PodtpPacket().set_header(PodtpType.ESP32, PodtpPort.ESP32_ENABLE_STREAM)
-        packet.length = 2
-        packet.data[0] = 1 if enable else 0
-        self._send_packet(packet)
+        self._send_message(MSG_ESP32_ENABLE_STREAM, 1 if enable else 0)
 
     def _config_camera(self, config: CameraConfig):
-        packet = PodtpPacket().set_header(PodtpType.ESP32, PodtpPort.ESP32_CONFIG_CAMERA)
-        config_bytes = config.pack()
-        packet.length = 1 + len(config_bytes)
-        packet.data[:len(config_bytes)] = config_bytes
-        self._send_packet(packet)
+        self._send_message(MSG_ESP32_CONFIG_CAMERA, *config.values())
 
     def stop_stream(self):
         if not self.stream_on:
             return
         self.stream_on = False
-        self.stream_thread.join()
+        if self.quality_controller is not None:
+            self.quality_controller.stop()
+        self._stop_stream_io()
         self._enable_stream(False)
 
-    def _keep_alive_func(self):
-        while self.connected:
-            if self.keep_alive:
-                send_packet = False
-                with self.last_packet_time_lock:
-                    if time.time() - self.last_packet_time > COMMAND_TIMEOUT_MS / 1000:
-                        self.last_packet_time = time.time()
-                        send_packet = True
-                if send_packet:
-                    packet = PodtpPacket().set_header(PodtpType.CTRL, PodtpPort.CTRL_KEEP_ALIVE)
-                    self._send_packet(packet)
-            time.sleep(0.05)
-
     def _receive_packets_func(self):
-        while self.connected:
-            self.packet_parser.process(self.data_link.receive(PODTP_MAX_DATA_LEN + 1))
-            packet = self.packet_parser.get_packet()
-            if packet is None:
-                continue
-
-            if packet.header.type == PodtpType.LOG:
-                if packet.header.port == PodtpPort.LOG_STRING:
-                    logging.debug(f'Log: {packet.data[:packet.length - 1].decode()}'.strip('\n'))
-                    print_t(f'Log: {packet.data[:packet.length - 1].decode()}', end='')
-                elif packet.header.port == PodtpPort.LOG_DISTANCE:
-                    self.sensor_data.depth = struct.unpack('<I64h', packet.data.bytes(0, 132))
-                elif packet.header.port == PodtpPort.LOG_STATE:
-                    self.sensor_data.state = struct.unpack('<I6h', packet.data.bytes(0, 16))
-                    # print_t(f'State: {self.sensor_data.state.timestamp}: {self.sensor_data.state.data}')
-            else:
-                self.packet_queue[packet.header.type].put(packet)
+        # blocks in receive_into until data arrives or disconnect() wakes the link up
+        while self.connected and self.data_link.client_connected:
+            for packet in self.packet_parser.process(self.data_link.receive_into()):
+                self._handle_packet(packet)
+
+    def _build_dispatch_table(self):
+        """
+        Both tables are indexed directly by the raw header byte. handlers holds
+        the callbacks for each (type, port), sinks decides where the packet goes
+        afterwards: LOG packets are consumed here and recycled, every other type
+        is queued for _get_packet, unknown types are dropped.
+        """
+        self.handlers: list[tuple[Callable[[PodtpPacket], None], ...]] = [()] * 256
+        self.sinks: list[Callable[[PodtpPacket], None]] = [self.packet_pool.release] * 256
+        for header in range(256):
+            packet_queue = self.packet_queue.get(header >> 4)
+            if packet_queue is not None and header >> 4 != PodtpType.LOG:
+                self.sinks[header] = packet_queue.put
+        self.subscribe(PodtpType.LOG, PodtpPort.LOG_STRING, self._handle_log_string)
+        self.subscribe(PodtpType.LOG, PodtpPort.LOG_DISTANCE, self._handle_log_distance)
+        self.subscribe(PodtpType.LOG, PodtpPort.LOG_STATE, self._handle_log_state)
+
+    def subscribe(self, type: PodtpType, port: PodtpPort, callback: Callable[[PodtpPacket], None]):
+        """
+        Call callback(packet) on the receive thread for every packet of (type, port).
+        The packet may be recycled once the callback returns, copy what you keep.
+        """
+        for ack in (0, 1):
+            header = header_byte(type, port, ack)
+            self.handlers[header] = self.handlers[header] + (callback,)
+
+    def unsubscribe(self, type: PodtpType, port: PodtpPort, callback: Callable[[PodtpPacket], None]):
+        for ack in (0, 1):
+            header = header_byte(type, port, ack)
+            self.handlers[header] = tuple(c for c in self.handlers[header] if c != callback)
+
+    def _handle_packet(self, packet: PodtpPacket):
+        header = packet.raw.raw[0]
+        for callback in self.handlers[header]:
+            # a failing subscriber must not take the receive loop down with it
+            try:
+                callback(packet)
+            except Exception as e:
+                print_t(f'Packet callback {getattr(callback, "__qualname__", callback)} failed: {e!r}')
+        self.sinks[header](packet)
+
+    def _handle_log_string(self, packet: PodtpPacket):
+        logging.debug(f'Log: {packet.data[:packet.length - 1].decode()}'.strip('\n'))
+        print_t(f'Log: {packet.data[:packet.length - 1].decode()}', end='')
+
+    def _handle_log_distance(self, packet: PodtpPacket):
+        self.sensor_data.depth = MSG_LOG_DISTANCE.decode(packet)
+
+    def _handle_log_state(self, packet: PodtpPacket):
+        self.sensor_data.state = MSG_LOG_STATE.decode(packet)
+        # print_t(f'State: {self.sensor_data.state.timestamp}: {self.sensor_data.state.data}')
 
     def _stream_func(self):
-        while self.stream_on:
-            data = self.stream_link.receive(65535, 0.5)
-            if data is None:
-                continue
-            _, image = self.image_parser.process(ImagePacket(data))
-            if image is not None:
-                self.sensor_data.frame = np.array(image)
+        while self.stream_on and self.stream_link.client_connected:
+            for data in self.stream_link.receive_batch():
+                self._handle_stream_data(data)
+
+    def _handle_stream_data(self, data):
+        seq, jpeg = self.image_parser.assemble(data)
+        if jpeg is None:
+            return
+        frame = JpegFrame(seq, jpeg, self.image_parser.image_started, time.time())
+        self.stream_stats.frame_completed(frame.started, frame.received)
+        self.sensor_data.jpeg = frame
+        if self.decode_frames:
+            self.decode_pool.submit(seq, jpeg)
+        else:
+            self.stream_stats.frame_delivered()
+
+    def _publish_frame(self, seq: int, frame: np.ndarray):
+        self.stream_stats.frame_delivered()
+        self.sensor_data.frame = frame
+
+    def _ring_frame(self, frame: FrameRing.Frame):
+        # a view of the shared ring slot, valid until the ring wraps around to it
+        self.stream_stats.frame_delivered()
+        self.sensor_data.frame = frame.image
+
+    def _ring_stopped(self):
+        # the ring is about to close, keep the last frame as a copy
+        self.sensor_data.detach_frame()
 
     def _get_packet(self, type: PodtpType, timeout = 1) -> Optional[PodtpPacket]:
         try:
@@ -140,29 +293,40 @@ class Podtp:
             return None
     
     def _send_packet(self, packet: PodtpPacket, timeout = 2) -> bool:
-        with self.last_packet_time_lock:
-            self.last_packet_time = time.time()
-        self.data_link.send(packet.pack())
+        if not self.send_queue.put(bytes(packet.pack())):
+            return False
         if packet.header.ack:
-            packet = self._get_packet(PodtpType.ACK, timeout)
-            if not packet or packet.header.port != PodtpPort.ACK_OK:
-                return False
+            return self._wait_ack(timeout)
         return True
-        
+
+    def _send_message(self, message: PodtpMessage, *values, payload: bytes = b'', timeout = 2) -> bool:
+        """
+        Encode a registered message and hand it to the writer with its priority.
+        True means queued, not sent: the writer sends asynchronously and stops the
+        queue if the link fails, after which this returns False. Messages with
+        an ack still wait for it and return whether it was ACK_OK.
+        """
+        frame = bytes(message.encode(*values, payload=payload))
+        if not self.send_queue.put(frame, MESSAGE_PRIORITY.get(message, SendPriority.COMMAND)):
+            return False
+        if message.ack:
+            return self._wait_ack(timeout)
+        return True
+
+    def _wait_ack(self, timeout) -> bool:
+        packet = self._get_packet(PodtpType.ACK, timeout)
+        if not packet or packet.header.port != PodtpPort.ACK_OK:
+            return False
+        return True
+
     def stm32_enable(self, enable: bool):
-        packet = PodtpPacket().set_header(PodtpType.ESP32, PodtpPort.ESP32_ENABLE_STM32)
-        packet.length = 2
-        packet.data[0] = 1 if enable else 0
-        self._send_packet(packet)
+        self._send_message(MSG_ESP32_ENABLE_STM32, 1 if enable else 0)
 
     def esp32_echo(self, message: str = 'Hello, ESP32!'):
         """
         Send a message to the ESP32 and wait for a response.
         """
-        packet = PodtpPacket().set_header(PodtpType.ESP32, PodtpPort.ESP32_ECHO)
-        packet.length = len(message) + 1
-        packet.data[:len(message)] = message.encode()
-        self._send_packet(packet)
+        self._send_message(MSG_ESP32_ECHO, payload=message.encode())
         packet = self._get_packet(PodtpType.ESP32)
         if packet:
             print_t(f'Echo: {packet.data[:packet.length - 1].decode()}')
@@ -173,85 +337,54 @@ class Podtp:
         """
         Send a takeoff command to the drone.
         """
-        packet = PodtpPacket().set_header(PodtpType.COMMAND, PodtpPort.COMMAND_TAKEOFF)
-        return self._send_packet(packet)
+        return self._send_message(MSG_COMMAND_TAKEOFF)
     
     def command_land(self) -> bool:
         """
         Send a land command to the drone.
         """
-        packet = PodtpPacket().set_header(PodtpType.COMMAND, PodtpPort.COMMAND_LAND)
-        return self._send_packet(packet)
+        return self._send_message(MSG_COMMAND_LAND)
 
     def ctrl_lock(self, lock: bool) -> bool:
         """
         Lock or unlock the drone.
         """
-        packet = PodtpPacket().set_header(PodtpType.CTRL,
-                                          PodtpPort.CTRL_LOCK,
-                                          ack=True)
-        packet.length = 2
-        packet.data[0] = 1 if lock else 0
-        return self._send_packet(packet)
+        return self._send_message(MSG_CTRL_LOCK, 1 if lock else 0)
     
     def ctrl_obstacle_avoidance(self, mode: int) -> bool:
         """
         Enable or disable obstacle avoidance.
         mode = 0: disable, 1: stop, 2: avoid
         """
-        packet = PodtpPacket().set_header(PodtpType.CTRL,
-                                          PodtpPort.CTRL_OBSTACLE_AVOIDANCE,
-                                          ack=True)
-        packet.length = 2
-        packet.data[0] = mode
-        return self._send_packet(packet)
+        return self._send_message(MSG_CTRL_OBSTACLE_AVOIDANCE, mode)
 
     def command_setpoint(self, roll: float, pitch: float, yaw: float, thrust: float) -> bool:
         """
         Send a setpoint command to the drone. roll, pitch, yaw, thrust are in radians.
         """
-        packet = PodtpPacket().set_header(PodtpType.COMMAND, PodtpPort.COMMAND_RPYT)
-        size = struct.calcsize('<ffff')
-        packet.data[:size] = struct.pack('<ffff', roll, pitch, yaw, thrust)
-        packet.length = 1 + size
-        return self._send_packet(packet)
+        return self._send_message(MSG_COMMAND_RPYT, roll, pitch, yaw, thrust)
 
     def command_hover(self, vx: float, vy: float, vyaw: float, height: float) -> bool:
         """
         Send a hover command to the drone. vx, vy are in m/s,  vyaw is in rad/s, height is in m.
         """
-        packet = PodtpPacket().set_header(PodtpType.COMMAND, PodtpPort.COMMAND_HOVER)
-        size = struct.calcsize('<ffff')
-        packet.data[:size] = struct.pack('<ffff', vx, vy, vyaw, height)
-        packet.length = 1 + size
-        return self._send_packet(packet)
+        return self._send_message(MSG_COMMAND_HOVER, vx, vy, vyaw, height)
     
     def command_velocity(self, vx: float, vy: float, vyaw: float, vz: float) -> bool:
         """
         Send a velocity command to the drone. vx, vy are in m/s,  vyaw is in rad/s, vz is in m/s.
         """
-        packet = PodtpPacket().set_header(PodtpType.COMMAND, PodtpPort.COMMAND_VELOCITY)
-        size = struct.calcsize('<ffff')
-        packet.data[:size] = struct.pack('<ffff', vx, vy, vyaw, vz)
-        packet.length = 1 + size
-        return self._send_packet(packet)
+        return self._send_message(MSG_COMMAND_VELOCITY, vx, vy, vyaw, vz)
     
     def command_position(self, x: float, y: float, z: float, yaw: float) -> bool:
         """
         Send a delta position command to the drone. x, y, z are in m, yaw is in degrees.
         """
-        packet = PodtpPacket().set_header(PodtpType.COMMAND, PodtpPort.COMMAND_POSITION)
-        size = struct.calcsize('<ffff')
-        packet.data[:size] = struct.pack('<ffff', x, y, z, yaw)
-        packet.length = 1 + size
-        return self._send_packet(packet)
+        return self._send_message(MSG_COMMAND_POSITION, x, y, z, yaw)
     
     def reset_estimator(self, starting_height=0) -> bool:
         """
         Reset the estimator with the given starting height (cm).
         """
-        packet = PodtpPacket().set_header(PodtpType.CTRL, PodtpPort.CTRL_RESET_ESTIMATOR, ack=True)
-        packet.length = 2
         assert starting_height < 100 and starting_height >= 0, "Height must be between 0 and 100 (cm)"
-        packet.data[0] = starting_height
-        return self._send_packet(packet)
\ No newline at end of file
+        return self._send_message(MSG_CTRL_RESET_ESTIMATOR, starting_height)
\ No newline at end of file
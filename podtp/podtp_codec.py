@@ -0,0 +1,107 @@
+import struct
+from .podtp_packet import PodtpPacket, PodtpType, PodtpPort, header_byte, \
+    PODTP_MAX_DATA_LEN, PODTP_START_BYTE_1, PODTP_START_BYTE_2
+
+# sync (2 bytes) + length (1 byte) + header (1 byte)
+PODTP_FRAME_PREFIX_SIZE = 4
+PODTP_MAX_FRAME_SIZE = 3 + PODTP_MAX_DATA_LEN + 1
+
+class PodtpMessage:
+    """
+    A (type, port) message with a precompiled struct for its fixed fields.
+    Messages with a variable part (strings, firmware chunks) carry it as
+    trailing payload bytes after the fixed fields.
+    """
+    __slots__ = ('type', 'port', 'ack', 'struct', 'header', 'prefix', 'frame_size')
+
+    def __init__(self, type: PodtpType, port: PodtpPort, format: str = '<', ack: bool = False) -> None:
+        self.type = type.value
+        self.port = port.value
+        self.ack = ack
+        self.struct = struct.Struct(format)
+        self.header = header_byte(self.type, self.port, int(ack))
+        length = 1 + self.struct.size
+        self.prefix = bytes([PODTP_START_BYTE_1, PODTP_START_BYTE_2, length, self.header])
+        self.frame_size = PODTP_FRAME_PREFIX_SIZE + self.struct.size
+
+    @property
+    def max_payload(self) -> int:
+        return PODTP_MAX_DATA_LEN - 1 - self.struct.size
+
+    def encode_into(self, buffer: bytearray, offset: int, *values, payload: bytes = b'') -> int:
+        """
+        Write a complete frame into buffer at offset and return its size.
+        """
+        end = offset + self.frame_size
+        buffer[offset:offset + PODTP_FRAME_PREFIX_SIZE] = self.prefix
+        self.struct.pack_into(buffer, offset + PODTP_FRAME_PREFIX_SIZE, *values)
+        if payload:
+            size = len(payload)
+            if size > self.max_payload:
+                raise ValueError(f'Payload of {size} bytes exceeds {self.max_payload}')
+            buffer[offset + 2] = 1 + self.struct.size + size
+            buffer[end:end + size] = payload
+            end += size
+        return end - offset
+
+    def encode(self, *values, payload: bytes = b'') -> bytearray:
+        buffer = bytearray(self.frame_size + len(payload))
+        self.encode_into(buffer, 0, *values, payload=payload)
+        return buffer
+
+    def decode(self, packet: PodtpPacket) -> tuple:
+        return self.struct.unpack_from(packet.raw.raw, 1)
+
+    def decode_payload(self, packet: PodtpPacket) -> memoryview:
+        """
+        The variable part of a received message, after the fixed fields.
+        """
+        return packet.payload[self.struct.size:]
+
+    def __repr__(self):
+        return f'PodtpMessage(type={self.type}, port={self.port}, format={self.struct.format!r}, ack={self.ack})'
+
+# (type, port) -> PodtpMessage, both as plain ints since PodtpPort values repeat across types
+MESSAGES: dict[tuple[int, int], PodtpMessage] = {}
+
+def register(type: PodtpType, port: PodtpPort, format: str = '<', ack: bool = False) -> PodtpMessage:
+    message = PodtpMessage(type, port, format, ack)
+    MESSAGES[(message.type, message.port)] = message
+    return message
+
+def lookup(type: int, port: int) -> PodtpMessage | None:
+    return MESSAGES.get((type, port))
+
+# ACK
+MSG_ACK_ERROR = register(PodtpType.ACK, PodtpPort.ACK_ERROR)
+MSG_ACK_OK = register(PodtpType.ACK, PodtpPort.ACK_OK)
+
+# COMMAND
+MSG_COMMAND_RPYT = register(PodtpType.COMMAND, PodtpPort.COMMAND_RPYT, '<ffff')
+MSG_COMMAND_TAKEOFF = register(PodtpType.COMMAND, PodtpPort.COMMAND_TAKEOFF)
+MSG_COMMAND_LAND = register(PodtpType.COMMAND, PodtpPort.COMMAND_LAND)
+MSG_COMMAND_HOVER = register(PodtpType.COMMAND, PodtpPort.COMMAND_HOVER, '<ffff')
+MSG_COMMAND_POSITION = register(PodtpType.COMMAND, PodtpPort.COMMAND_POSITION, '<ffff')
+MSG_COMMAND_VELOCITY = register(PodtpType.COMMAND, PodtpPort.COMMAND_VELOCITY, '<ffff')
+
+# LOG
+MSG_LOG_STRING = register(PodtpType.LOG, PodtpPort.LOG_STRING)
+MSG_LOG_DISTANCE = register(PodtpType.LOG, PodtpPort.LOG_DISTANCE, '<I64h')
+MSG_LOG_STATE = register(PodtpType.LOG, PodtpPort.LOG_STATE, '<I6h')
+
+# CTRL
+MSG_CTRL_LOCK = register(PodtpType.CTRL, PodtpPort.CTRL_LOCK, '<B', ack=True)
+MSG_CTRL_KEEP_ALIVE = register(PodtpType.CTRL, PodtpPort.CTRL_KEEP_ALIVE)
+MSG_CTRL_RESET_ESTIMATOR = register(PodtpType.CTRL, PodtpPort.CTRL_RESET_ESTIMATOR, '<B', ack=True)
+MSG_CTRL_OBSTACLE_AVOIDANCE = register(PodtpType.CTRL, PodtpPort.CTRL_OBSTACLE_AVOIDANCE, '<B', ack=True)
+
+# ESP32
+MSG_ESP32_ECHO = register(PodtpType.ESP32, PodtpPort.ESP32_ECHO)
+MSG_ESP32_START_STM32_BOOTLOADER = register(PodtpType.ESP32, PodtpPort.ESP32_START_STM32_BOOTLOADER, '<B')
+MSG_ESP32_ENABLE_STM32 = register(PodtpType.ESP32, PodtpPort.ESP32_ENABLE_STM32, '<B')
+MSG_ESP32_CONFIG_CAMERA = register(PodtpType.ESP32, PodtpPort.ESP32_CONFIG_CAMERA, '<BBbbbbb')
+MSG_ESP32_ENABLE_STREAM = register(PodtpType.ESP32, PodtpPort.ESP32_ENABLE_STREAM, '<B')
+
+# BOOT_LOADER
+MSG_BOOT_LOADER_LOAD_BUFFER = register(PodtpType.BOOT_LOADER, PodtpPort.BOOT_LOADER_LOAD_BUFFER, '<HH', ack=True)
+MSG_BOOT_LOADER_WRITE_FLASH = register(PodtpType.BOOT_LOADER, PodtpPort.BOOT_LOADER_WRITE_FLASH, '<HHH', ack=True)
@@ -1,23 +1,20 @@
-from enum import Enum
+from collections import deque
+from enum import IntEnum
 
 PODTP_MAX_DATA_LEN = 254
 
 PODTP_START_BYTE_1 = 0xAD
 PODTP_START_BYTE_2 = 0x6E
 
-class PodtpType(Enum):
+class PodtpType(IntEnum):
     ACK = 0x1
     COMMAND = 0x2
     LOG = 0x3
     CTRL = 0x4
     ESP32 = 0xE
     BOOT_LOADER = 0xF
-    def __eq__(self, __value: object) -> bool:
-        if isinstance(__value, int):
-            __value = PodtpType(__value)
-        return super().__eq__(__value)
 
-class PodtpPort(Enum):
+class PodtpPort(IntEnum):
     # ACK
     ACK_ERROR = 0x0
     ACK_OK = 0x1
@@ -52,11 +49,6 @@ class PodtpPort(Enum):
     BOOT_LOADER_LOAD_BUFFER = 0x1
     BOOT_LOADER_WRITE_FLASH = 0x2
 
-    def __eq__(self, __value: object) -> bool:
-        if isinstance(__value, int):
-            __value = PodtpPort(__value)
-        return super().__eq__(__value)
-
 PACKET_TYPE_NAMES = {
     PodtpType.ACK.value: 'ACK',
     PodtpType.COMMAND.value: 'COMMAND',
@@ -65,7 +57,15 @@ PACKET_TYPE_NAMES = {
     PodtpType.BOOT_LOADER.value: 'BOOT_LOADER'
 }
 
+def header_byte(type: int, port: int, ack: int = 0) -> int:
+    """
+    The packed header byte: type in bits 7-4, ack in bit 3, port in bits 2-0.
+    """
+    return ((type & 0x0F) << 4) | ((ack & 0x01) << 3) | (port & 0x07)
+
 class RawPacket:
+    __slots__ = ('length', 'raw')
+
     def __init__(self, length = 1) -> None:
         if length > PODTP_MAX_DATA_LEN + 1 or length < 1:
             raise ValueError("Length must be between 1 and PODTP_MAX_DATA_LEN + 1")
@@ -83,10 +83,12 @@ class RawPacket:
 
     def unpack(self, buffer):
         self.length = buffer[0]
-        self.data = buffer[1:]
+        self.raw[:self.length] = buffer[1:1 + self.length]
 
 class PodtpPacket:
     class Header:
+        __slots__ = ('buffer',)
+
         def __init__(self, buffer: bytearray) -> None:
             self.buffer = buffer
 
@@ -119,6 +121,8 @@ class PodtpPacket:
             self.buffer[0] = (self.buffer[0] & 0xF7) | ((val & 0x01) << 3)
 
     class Data:
+        __slots__ = ('buffer',)
+
         def __init__(self, buffer: bytearray) -> None:
             self.buffer = buffer
 
@@ -141,12 +145,22 @@ class PodtpPacket:
         def bytes(self, start: int, stop: int):
             return self.buffer[start + 1:stop + 1]
 
+    __slots__ = ('length', 'raw', 'header', 'data')
+
     def __init__(self) -> None:
         self.length = 0
         self.raw = RawPacket()
-        self.header = PodtpPacket.Header(self.raw)
+        # the header only touches byte 0, index the bytearray directly
+        self.header = PodtpPacket.Header(self.raw.raw)
         self.data = PodtpPacket.Data(self.raw)
 
+    @property
+    def payload(self) -> memoryview:
+        """
+        Zero-copy view of the data bytes. Only valid until the packet is reused.
+        """
+        return memoryview(self.raw.raw)[1:self.length]
+
     def set_header(self, type: int | PodtpType, port: int | PodtpPort, ack: int = 0) -> 'PodtpPacket':
         self.header.type = type
         self.header.port = port
@@ -170,4 +184,31 @@ class PodtpPacket:
         return True
 
     def __repr__(self):
-        return f'PodtpPacket(length={self.length}, type={PACKET_TYPE_NAMES[self.header.type]}, port={self.header.port})'
\ No newline at end of file
+        return f'PodtpPacket(length={self.length}, type={PACKET_TYPE_NAMES[self.header.type]}, port={self.header.port})'
+
+class PodtpPacketPool:
+    """
+    Free list of packets so the receive path can recycle them instead of
+    allocating a new PodtpPacket for every frame.
+    """
+    __slots__ = ('free', 'capacity')
+
+    def __init__(self, capacity: int = 64) -> None:
+        self.free = deque()
+        self.capacity = capacity
+
+    def acquire(self) -> PodtpPacket:
+        try:
+            packet = self.free.pop()
+        except IndexError:
+            return PodtpPacket()
+        packet.length = 0
+        packet.raw.raw[0] = 0
+        return packet
+
+    def release(self, packet: PodtpPacket) -> None:
+        """
+        Return a packet to the pool. The caller must not use it afterwards.
+        """
+        if len(self.free) < self.capacity:
+            self.free.append(packet)
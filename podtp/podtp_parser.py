@@ -1,56 +1,58 @@
-import queue
 from typing import Optional
-from enum import Enum
-from .podtp_packet import PodtpPacket, \
+from .podtp_packet import PodtpPacket, PodtpPacketPool, \
     PODTP_MAX_DATA_LEN, PODTP_START_BYTE_1, PODTP_START_BYTE_2
 
-class RxState(Enum):
-    PODTP_STATE_START_1 = 0
-    PODTP_STATE_START_2 = 1
-    PODTP_STATE_LENGTH = 2
-    PODTP_STATE_RAW_DATA = 3
+PODTP_SYNC = bytes([PODTP_START_BYTE_1, PODTP_START_BYTE_2])
+# sync (2 bytes) + length (1 byte)
+PODTP_FRAME_HEADER_SIZE = 3
 
 class PodtpParser:
-    def __init__(self):
-        self.rx_state = RxState.PODTP_STATE_START_1
-        self.length = 0
-        self.packet = None
-        self.packet_queue = queue.Queue()
+    def __init__(self, pool: Optional[PodtpPacketPool] = None):
+        # bytes of a partial frame carried over from the previous chunk
+        self.buffer = bytearray()
+        self.pool = pool
 
-    def process(self, data: Optional[bytes]) -> Optional[PodtpPacket]:
-        if data is None:
-            return
-        for byte in data:
-            match self.rx_state:
-                case RxState.PODTP_STATE_START_1:
-                    if byte == PODTP_START_BYTE_1:
-                        self.rx_state = RxState.PODTP_STATE_START_2
-
-                case RxState.PODTP_STATE_START_2:
-                    if byte == PODTP_START_BYTE_2:
-                        self.rx_state = RxState.PODTP_STATE_LENGTH
-                    else:
-                        self.rx_state = RxState.PODTP_STATE_START_1
-
-                case RxState.PODTP_STATE_LENGTH:
-                    self.length = byte
-                    self.packet = PodtpPacket()
-                    self.packet.length = 0
-                    if self.length > PODTP_MAX_DATA_LEN or self.length == 0:
-                        self.rx_state = RxState.PODTP_STATE_START_1
-                    else:
-                        self.rx_state = RxState.PODTP_STATE_RAW_DATA
-                        
-                case RxState.PODTP_STATE_RAW_DATA:
-                    self.packet.raw[self.packet.length] = byte
-                    self.packet.length += 1
-                    if self.packet.length == self.length:
-                        self.rx_state = RxState.PODTP_STATE_START_1
-                        self.packet_queue.put(self.packet)
-                        self.packet = None
-
-    def get_packet(self) -> Optional[PodtpPacket]:
-        try:
-            return self.packet_queue.get_nowait()
-        except queue.Empty:
-            return None
\ No newline at end of file
+    def process(self, data: Optional[bytes]) -> list[PodtpPacket]:
+        """
+        Frame a received chunk and return every packet it completes, in order.
+        The sync sequence is located with bytearray.find and whole payloads are
+        sliced at once; an incomplete frame at the end of the chunk is kept and
+        completed by the next call.
+        """
+        packets = []
+        if not data:
+            return packets
+        buffer = self.buffer
+        buffer += data
+        end = len(buffer)
+        pos = 0
+        pool = self.pool
+        # payloads are copied out through a view, so slicing does not allocate a copy
+        view = memoryview(buffer)
+        while True:
+            start = buffer.find(PODTP_SYNC, pos)
+            if start < 0:
+                # keep a trailing first sync byte, the second may be in the next chunk;
+                # not one that ended a payload already consumed
+                pos = end - 1 if end - 1 >= pos and buffer[end - 1] == PODTP_START_BYTE_1 else end
+                break
+            if start + PODTP_FRAME_HEADER_SIZE > end:
+                pos = start
+                break
+            length = buffer[start + 2]
+            if length == 0 or length > PODTP_MAX_DATA_LEN:
+                pos = start + PODTP_FRAME_HEADER_SIZE
+                continue
+            payload_start = start + PODTP_FRAME_HEADER_SIZE
+            payload_end = payload_start + length
+            if payload_end > end:
+                pos = start
+                break
+            packet = pool.acquire() if pool is not None else PodtpPacket()
+            packet.length = length
+            packet.raw.raw[:length] = view[payload_start:payload_end]
+            packets.append(packet)
+            pos = payload_end
+        view.release()
+        del buffer[:pos]
+        return packets
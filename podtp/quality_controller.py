@@ -0,0 +1,149 @@
+import time
+from threading import Event, Thread
+from typing import Callable, Optional
+
+from .camera_config import CameraConfig
+from .utils import print_t
+
+FrameSize = CameraConfig.FrameSize
+
+# best to worst; ESP32 quality runs from 0 (best) to 63, frames shrink faster with size than with quality
+QUALITY_LADDER = (
+    (FrameSize.FRAMESIZE_HD, 7),
+    (FrameSize.FRAMESIZE_HD, 12),
+    (FrameSize.FRAMESIZE_XGA, 12),
+    (FrameSize.FRAMESIZE_SVGA, 12),
+    (FrameSize.FRAMESIZE_VGA, 12),
+    (FrameSize.FRAMESIZE_VGA, 20),
+    (FrameSize.FRAMESIZE_HVGA, 20),
+    (FrameSize.FRAMESIZE_QVGA, 20),
+)
+QUALITY_INTERVAL = 1.0
+# seconds after a change before the stream is judged again, the camera restarts on every change
+QUALITY_SETTLE_TIME = 2.0
+# failed upgrades stretch the wait before the next one up to this factor
+QUALITY_MAX_BACKOFF = 16
+
+class QualityController:
+    """
+    Keep the stream at target_fps by stepping frame size and quality along
+    QUALITY_LADDER. Every interval the delivered frame rate and the fragment
+    loss since the last check are computed from the stream health counters.
+
+    Hysteresis: stepping down takes degrade_after bad intervals in a row,
+    stepping up upgrade_after good ones, and an upgrade that has to be undone
+    right away doubles the wait before the next try, one that holds resets it.
+    Every change is printed and kept in changes with its reason.
+    """
+    def __init__(self, health: Callable[[], dict], apply: Callable[[CameraConfig], None],
+                 camera_config: Optional[CameraConfig] = None, target_fps: float = 15,
+                 max_loss: float = 0.05, interval: float = QUALITY_INTERVAL,
+                 degrade_after: int = 2, upgrade_after: int = 5) -> None:
+        self.health = health
+        self.apply = apply
+        self.camera_config = camera_config or CameraConfig()
+        self.target_fps = target_fps
+        # fragment loss above max_loss counts as congestion, below a fifth of it as a clear link
+        self.max_loss = max_loss
+        self.interval = interval
+        self.degrade_after = degrade_after
+        self.upgrade_after = upgrade_after
+        self.step = self._nearest_step(self.camera_config)
+        self.upgrade_wait = upgrade_after
+        self.bad = 0
+        self.good = 0
+        self.last_change = 0.0
+        self.last_upgrade = 0.0
+        self.last_sample: Optional[tuple[float, int, int, int]] = None
+        # (time, frame size, quality, reason) of every change
+        self.changes: list[tuple[float, FrameSize, int, str]] = []
+        self.stop_event = Event()
+        self.thread: Optional[Thread] = None
+
+    @staticmethod
+    def _nearest_step(config: CameraConfig) -> int:
+        width, height = CameraConfig.RESOLUTIONS[config.frame_size]
+        def distance(step: tuple[FrameSize, int]) -> tuple[int, int]:
+            step_width, step_height = CameraConfig.RESOLUTIONS[step[0]]
+            return abs(step_width * step_height - width * height), abs(step[1] - config.quality)
+        return min(range(len(QUALITY_LADDER)), key=lambda i: distance(QUALITY_LADDER[i]))
+
+    def start(self):
+        self.stop_event.clear()
+        self.last_sample = None
+        self.last_change = time.time()
+        self.thread = Thread(target=self._control_func, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _control_func(self):
+        while not self.stop_event.wait(self.interval):
+            self.update(self.health())
+
+    def update(self, health: dict, now: Optional[float] = None) -> Optional[str]:
+        """
+        Judge the interval since the previous call and change the camera
+        configuration if needed. Returns the reason of a change, else None.
+        """
+        now = time.time() if now is None else now
+        sample = (now, health.get('frames_delivered', 0), health.get('fragments_received', 0),
+                  health.get('fragments_missing', 0))
+        previous, self.last_sample = self.last_sample, sample
+        if previous is None or now - self.last_change < QUALITY_SETTLE_TIME:
+            return None
+        elapsed = now - previous[0]
+        if elapsed <= 0:
+            return None
+        fps = (sample[1] - previous[1]) / elapsed
+        received, missing = sample[2] - previous[2], sample[3] - previous[3]
+        loss = missing / (received + missing) if received + missing else 0.0
+
+        if fps < self.target_fps * 0.9 or loss > self.max_loss:
+            self.bad += 1
+            self.good = 0
+        elif fps >= self.target_fps * 0.95 and loss < self.max_loss / 5:
+            self.good += 1
+            self.bad = 0
+        else:
+            self.bad = self.good = 0
+
+        # an upgrade counts as failed if it is undone within this window, else as held
+        upgrade_window = self.upgrade_wait * self.interval + QUALITY_SETTLE_TIME
+        if self.last_upgrade and now - self.last_upgrade >= upgrade_window:
+            self.upgrade_wait = self.upgrade_after
+            self.last_upgrade = 0.0
+
+        if self.bad >= self.degrade_after and self.step < len(QUALITY_LADDER) - 1:
+            if self.last_upgrade:
+                # the last step up did not hold, wait longer before the next one; once per upgrade
+                self.upgrade_wait = min(self.upgrade_wait * 2, self.upgrade_after * QUALITY_MAX_BACKOFF)
+                self.last_upgrade = 0.0
+            return self._change(self.step + 1, now, f'{fps:.1f} fps, {loss:.1%} fragment loss')
+        if self.good >= self.upgrade_wait and self.step > 0:
+            if self.last_upgrade:
+                # the previous step up lasted until this one
+                self.upgrade_wait = self.upgrade_after
+            self.last_upgrade = now
+            return self._change(self.step - 1, now, f'{fps:.1f} fps, {loss:.1%} fragment loss '
+                                                    f'for {self.good} intervals')
+        return None
+
+    def _change(self, step: int, now: float, reason: str) -> str:
+        direction = 'down' if step > self.step else 'up'
+        frame_size, quality = QUALITY_LADDER[step]
+        self.step = step
+        self.camera_config.frame_size = frame_size
+        self.camera_config.quality = quality
+        self.apply(self.camera_config)
+        self.bad = self.good = 0
+        self.last_change = now
+        reason = f'{direction}: {reason} (target {self.target_fps:g} fps)'
+        self.changes.append((now, frame_size, quality, reason))
+        width, height = CameraConfig.RESOLUTIONS[frame_size]
+        print_t(f'Camera {width}x{height} quality {quality}, {reason}')
+        return reason
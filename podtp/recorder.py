@@ -0,0 +1,197 @@
+import os
+import queue
+import struct
+from enum import Enum
+from threading import Thread
+from typing import BinaryIO, Optional
+
+from .image_packet import JpegFrame
+from .utils import print_t
+
+RECORDER_QUEUE_SIZE = 64
+# RIFF sizes are 32 bit, an AVI 1.0 file must stay below 1 GB to be read everywhere
+AVI_MAX_SIZE = 1 << 30
+AVIF_HASINDEX = 0x10
+AVIIF_KEYFRAME = 0x10
+
+def jpeg_size(jpeg: bytes | memoryview) -> tuple[int, int]:
+    """
+    (width, height) from the SOF marker of a JPEG, (0, 0) if there is none.
+    """
+    data = memoryview(jpeg)
+    offset = 2
+    while offset + 9 <= len(data):
+        if data[offset] != 0xFF:
+            return 0, 0
+        marker = data[offset + 1]
+        length = (data[offset + 2] << 8) | data[offset + 3]
+        # SOF0..SOF15 without DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack_from('>HH', data, offset + 5)
+            return width, height
+        offset += 2 + length
+    return 0, 0
+
+class JpegRecorder:
+    """
+    Write stream frames to disk as received, without decoding or re-encoding.
+    put() only queues the frame, a writer thread does the I/O; when the queue
+    is full the frame is dropped so the caller never waits for the disk.
+
+    The frames are stored as the camera sent them, upside down. Formats:
+    MJPEG concatenates the JPEGs (ffplay -f mjpeg), AVI wraps them in an MJPG
+    AVI at the given fps, FILES writes one .jpg per frame into a directory.
+    With timestamps a <path>.csv lists seq and receive times of every frame.
+    """
+    class Format(Enum):
+        MJPEG = 'mjpeg'
+        AVI = 'avi'
+        FILES = 'files'
+
+    def __init__(self, path: str, format: Optional['JpegRecorder.Format | str'] = None, fps: float = 15,
+                 queue_size: int = RECORDER_QUEUE_SIZE, timestamps: bool = True) -> None:
+        if format is None:
+            extension = os.path.splitext(path)[1].lower()
+            format = {'.avi': JpegRecorder.Format.AVI, '.mjpeg': JpegRecorder.Format.MJPEG,
+                      '.mjpg': JpegRecorder.Format.MJPEG}.get(extension, JpegRecorder.Format.FILES)
+        self.path = path
+        self.format = JpegRecorder.Format(format)
+        self.fps = fps
+        self.timestamps = timestamps
+        self.queue: queue.Queue[Optional[JpegFrame]] = queue.Queue(queue_size)
+        self.thread: Optional[Thread] = None
+        self.file: Optional[BinaryIO] = None
+        self.timestamp_file = None
+        self.written = 0
+        # frames that found the queue full
+        self.dropped = 0
+        self.bytes_written = 0
+        # AVI bookkeeping: idx1 entries and the offsets of the sizes patched on close
+        self.avi_index = bytearray()
+        self.avi_movi_offset = 0
+        self.avi_max_frame = 0
+
+    def start(self):
+        if self.format == JpegRecorder.Format.FILES:
+            os.makedirs(self.path, exist_ok=True)
+        else:
+            self.file = open(self.path, 'wb')
+        if self.timestamps:
+            timestamp_path = os.path.join(self.path, 'timestamps.csv') \
+                if self.format == JpegRecorder.Format.FILES else self.path + '.csv'
+            self.timestamp_file = open(timestamp_path, 'w')
+            self.timestamp_file.write('index,seq,started,received,size\n')
+        self.thread = Thread(target=self._writer_func)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Write the frames still queued and close the files.
+        """
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        if self.format == JpegRecorder.Format.AVI and self.written > 0:
+            self._finish_avi()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.timestamp_file is not None:
+            self.timestamp_file.close()
+            self.timestamp_file = None
+
+    def put(self, frame: JpegFrame, seq: Optional[int] = None) -> bool:
+        """
+        Queue a frame, has the signature of a Sensor.subscribe('jpeg', ...) callback.
+        """
+        if self.thread is None:
+            return False
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _writer_func(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                return
+            try:
+                self._write(frame)
+            except OSError as e:
+                print_t(f'Recording to {self.path} failed: {e}')
+                self.dropped += 1
+
+    def _write(self, frame: JpegFrame):
+        if self.format == JpegRecorder.Format.FILES:
+            with open(os.path.join(self.path, f'{self.written:06d}.jpg'), 'wb') as file:
+                file.write(frame.jpeg)
+        elif self.format == JpegRecorder.Format.MJPEG:
+            self.file.write(frame.jpeg)
+        else:
+            if not self._write_avi(frame.jpeg):
+                self.dropped += 1
+                return
+        if self.timestamp_file is not None:
+            self.timestamp_file.write(f'{self.written},{frame.seq},{frame.started:.6f},'
+                                      f'{frame.received:.6f},{len(frame.jpeg)}\n')
+        self.written += 1
+        self.bytes_written += len(frame.jpeg)
+
+    def _write_avi(self, jpeg: bytes | memoryview) -> bool:
+        if self.written == 0:
+            self._write_avi_header(*jpeg_size(jpeg))
+        size = len(jpeg)
+        if self.file.tell() + size + len(self.avi_index) + 32 > AVI_MAX_SIZE:
+            return False
+        offset = self.file.tell() - self.avi_movi_offset
+        self.file.write(struct.pack('<4sI', b'00dc', size))
+        self.file.write(jpeg)
+        if size & 1:
+            self.file.write(b'\x00')
+        self.avi_index += struct.pack('<4sIII', b'00dc', AVIIF_KEYFRAME, offset, size)
+        self.avi_max_frame = max(self.avi_max_frame, size)
+        return True
+
+    def _write_avi_header(self, width: int, height: int):
+        # sizes and counts are written as 0 here and patched by _finish_avi
+        rate = max(int(round(self.fps)), 1)
+        avih = struct.pack('<IIIIIIIIII16x', int(1e6 / rate), 0, 0, AVIF_HASINDEX, 0, 0, 1, 0, width, height)
+        strh = struct.pack('<4s4sIHHIIIIIIIIhhhh', b'vids', b'MJPG', 0, 0, 0, 0, 1, rate, 0, 0, 0,
+                           0xFFFFFFFF, 0, 0, 0, width, height)
+        strf = struct.pack('<IiiHH4sIiiII', 40, width, height, 1, 24, b'MJPG', width * height * 3, 0, 0, 0, 0)
+        strl = b'strl' + struct.pack('<4sI', b'strh', len(strh)) + strh + struct.pack('<4sI', b'strf', len(strf)) + strf
+        hdrl = b'hdrl' + struct.pack('<4sI', b'avih', len(avih)) + avih + struct.pack('<4sI', b'LIST', len(strl)) + strl
+        self.file.write(struct.pack('<4sI4s', b'RIFF', 0, b'AVI '))
+        self.file.write(struct.pack('<4sI', b'LIST', len(hdrl)) + hdrl)
+        self.file.write(struct.pack('<4sI', b'LIST', 0))
+        # idx1 offsets count from the 'movi' fourcc
+        self.avi_movi_offset = self.file.tell()
+        self.file.write(b'movi')
+
+    def _finish_avi(self):
+        movi_end = self.file.tell()
+        self.file.write(struct.pack('<4sI', b'idx1', len(self.avi_index)))
+        self.file.write(self.avi_index)
+        end = self.file.tell()
+        # RIFF size
+        self.file.seek(4)
+        self.file.write(struct.pack('<I', end - 8))
+        # avih: dwMaxBytesPerSec, then dwTotalFrames and dwSuggestedBufferSize
+        self.file.seek(32 + 4)
+        self.file.write(struct.pack('<I', self.avi_max_frame * max(int(round(self.fps)), 1)))
+        self.file.seek(32 + 16)
+        self.file.write(struct.pack('<I', self.written))
+        self.file.seek(32 + 28)
+        self.file.write(struct.pack('<I', self.avi_max_frame))
+        # strh: dwLength and dwSuggestedBufferSize
+        self.file.seek(32 + 56 + 12 + 8 + 32)
+        self.file.write(struct.pack('<II', self.written, self.avi_max_frame))
+        # movi LIST size
+        self.file.seek(self.avi_movi_offset - 4)
+        self.file.write(struct.pack('<I', movi_end - self.avi_movi_offset))
+        self.file.seek(end)
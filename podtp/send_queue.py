@@ -0,0 +1,143 @@
+import time
+from collections import deque
+from enum import IntEnum
+from threading import Condition, Thread
+from typing import Callable, Optional
+from .link import WifiLink
+from .utils import print_t
+
+class SendPriority(IntEnum):
+    # land/lock: sent before anything else, pending setpoints are discarded
+    SAFETY = 0
+    COMMAND = 1
+    # continuous setpoints: only the latest one waiting is sent
+    SETPOINT = 2
+
+class SendQueue:
+    """
+    Single writer for a link. Callers enqueue encoded frames from any thread;
+    the writer thread sends everything pending in priority order with one
+    send call and emits keep-alive frames when the link has been idle.
+    """
+    def __init__(self, link: WifiLink, keep_alive_frame: bytes, keep_alive_interval: float,
+                 keep_alive_enabled: Callable[[], bool] = lambda: True,
+                 on_put: Optional[Callable[[], None]] = None) -> None:
+        self.link = link
+        # where flush() writes, an external I/O loop may replace it with its own buffered send
+        self.send: Callable[[bytes], bool] = link.send
+        self.keep_alive_frame = keep_alive_frame
+        self.keep_alive_interval = keep_alive_interval
+        self.keep_alive_enabled = keep_alive_enabled
+        # called after every put, lets an external I/O loop know there is work
+        self.on_put = on_put
+        self.cond = Condition()
+        self.queues = {SendPriority.SAFETY: deque(), SendPriority.COMMAND: deque()}
+        self.setpoint: Optional[bytes] = None
+        self.running = False
+        self.thread: Optional[Thread] = None
+        self.last_send_time = time.time()
+        # setpoints replaced by a newer one before they were sent
+        self.coalesced = 0
+        # frames dropped because the link failed, see flush()
+        self.failed = 0
+
+    def start(self, writer_thread: bool = True):
+        """
+        Without a writer thread the owner must call flush() itself.
+        """
+        self.running = True
+        self.last_send_time = time.time()
+        if writer_thread:
+            self.thread = Thread(target=self._writer_func)
+            self.thread.start()
+
+    def stop(self):
+        """
+        Send whatever is still pending and stop the writer.
+        """
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def put(self, frame: bytes, priority: SendPriority = SendPriority.COMMAND) -> bool:
+        with self.cond:
+            if not self.running:
+                return False
+            if priority == SendPriority.SETPOINT:
+                if self.setpoint is not None:
+                    self.coalesced += 1
+                self.setpoint = frame
+            else:
+                if priority == SendPriority.SAFETY and self.setpoint is not None:
+                    # a stale setpoint must not follow a land or lock
+                    self.setpoint = None
+                    self.coalesced += 1
+                self.queues[priority].append(frame)
+            self.cond.notify()
+        if self.on_put is not None:
+            self.on_put()
+        return True
+
+    def _pending(self) -> bool:
+        return bool(self.queues[SendPriority.SAFETY] or self.queues[SendPriority.COMMAND]
+                    or self.setpoint is not None)
+
+    def _take(self) -> list[bytes]:
+        frames = list(self.queues[SendPriority.SAFETY])
+        frames.extend(self.queues[SendPriority.COMMAND])
+        self.queues[SendPriority.SAFETY].clear()
+        self.queues[SendPriority.COMMAND].clear()
+        if self.setpoint is not None:
+            frames.append(self.setpoint)
+            self.setpoint = None
+        return frames
+
+    def keep_alive_delay(self) -> float:
+        """
+        Seconds until a keep-alive is due.
+        """
+        return self.last_send_time + self.keep_alive_interval - time.time()
+
+    def flush(self) -> bool:
+        """
+        Send everything pending, or a keep-alive if one is due. A failed
+        send stops the queue: pending frames are dropped and put() returns False.
+        """
+        with self.cond:
+            frames = self._take()
+            if not frames:
+                if not self.running or not self.keep_alive_enabled() or self.keep_alive_delay() > 0:
+                    return False
+                frames = [self.keep_alive_frame]
+        # small frames go out together in a single send
+        if not self.send(frames[0] if len(frames) == 1 else b''.join(frames)):
+            self._fail(len(frames))
+            return False
+        self.last_send_time = time.time()
+        return True
+
+    def _fail(self, lost: int):
+        # the link is gone: stop taking frames so senders see put() fail instead of queueing forever
+        with self.cond:
+            self.running = False
+            lost += len(self.queues[SendPriority.SAFETY]) + len(self.queues[SendPriority.COMMAND])
+            lost += self.setpoint is not None
+            self._take()
+            self.cond.notify()
+        self.failed += lost
+        print_t(f'Send queue stopped: link send failed, {lost} frames dropped')
+
+    def _writer_func(self):
+        while True:
+            with self.cond:
+                while self.running and not self._pending():
+                    remaining = self.keep_alive_delay()
+                    if remaining <= 0 and self.keep_alive_enabled():
+                        break
+                    self.cond.wait(remaining if remaining > 0 else self.keep_alive_interval)
+                if not self.running and not self._pending():
+                    return
+            self.flush()
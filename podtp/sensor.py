@@ -1,8 +1,17 @@
 import numpy as np
-from threading import Lock
+from enum import Enum
+from threading import Condition, Lock
+from typing import Callable, Optional
 from PIL import Image
+from .utils import print_t
 
 class Sensor:
+    class Channel(Enum):
+        DEPTH = 'depth'
+        FRAME = 'frame'
+        STATE = 'state'
+        JPEG = 'jpeg'
+
     class State:
         def __init__(self) -> None:
             self.data = np.zeros(6, dtype=np.int16)
@@ -20,35 +29,123 @@ class Sensor:
         self.lock_frame = Lock()
         self._state = Sensor.State()
         self.lock_state = Lock()
+        # the last frame still compressed, a JpegFrame
+        self._jpeg = None
+        self.lock_jpeg = Lock()
+
+        # per channel update count, bumped and notified under the channel lock
+        self._seq = {channel: 0 for channel in Sensor.Channel}
+        self._updated = {
+            Sensor.Channel.DEPTH: Condition(self.lock_depth),
+            Sensor.Channel.FRAME: Condition(self.lock_frame),
+            Sensor.Channel.STATE: Condition(self.lock_state),
+            Sensor.Channel.JPEG: Condition(self.lock_jpeg),
+        }
+        self._callbacks = {channel: () for channel in Sensor.Channel}
+
+    def seq(self, channel: 'Sensor.Channel | str') -> int:
+        """
+        Number of updates the channel has received so far.
+        """
+        channel = Sensor.Channel(channel)
+        with self._updated[channel]:
+            return self._seq[channel]
+
+    def wait_for_update(self, channel: 'Sensor.Channel | str', after_seq: Optional[int] = None,
+                        timeout: Optional[float] = None) -> Optional[int]:
+        """
+        Block until the channel's sequence number is past after_seq (default: the
+        current one) and return the new sequence number, or None on timeout.
+        """
+        channel = Sensor.Channel(channel)
+        updated = self._updated[channel]
+        with updated:
+            if after_seq is None:
+                after_seq = self._seq[channel]
+            if not updated.wait_for(lambda: self._seq[channel] > after_seq, timeout):
+                return None
+            return self._seq[channel]
+
+    def subscribe(self, channel: 'Sensor.Channel | str', callback: Callable[[object, int], None]):
+        """
+        Call callback(value, seq) on the producing thread after every update.
+        """
+        channel = Sensor.Channel(channel)
+        self._callbacks[channel] = self._callbacks[channel] + (callback,)
+
+    def unsubscribe(self, channel: 'Sensor.Channel | str', callback: Callable[[object, int], None]):
+        channel = Sensor.Channel(channel)
+        self._callbacks[channel] = tuple(c for c in self._callbacks[channel] if c != callback)
+
+    def _run_callbacks(self, channel: 'Sensor.Channel', value, seq: int):
+        for callback in self._callbacks[channel]:
+            # the producer is a receive thread, one failing subscriber must not stop it
+            try:
+                callback(value, seq)
+            except Exception as e:
+                print_t(f'{channel.value} callback {getattr(callback, "__qualname__", callback)} failed: {e!r}')
+
+    def _notify(self, channel: 'Sensor.Channel') -> int:
+        # caller holds the channel lock
+        self._seq[channel] += 1
+        self._updated[channel].notify_all()
+        return self._seq[channel]
 
     @property
     def depth(self):
         with self.lock_depth:
             return self._depth
-        
+
     @depth.setter
     def depth(self, value):
         with self.lock_depth:
             self._depth.timestamp = value[0]
             self._depth.data = np.array(value[1:], dtype=np.int16).reshape((8, 8))
+            seq = self._notify(Sensor.Channel.DEPTH)
+        self._run_callbacks(Sensor.Channel.DEPTH, self._depth, seq)
 
     @property
     def frame(self):
         with self.lock_frame:
             return self._frame
-        
+
     @frame.setter
     def frame(self, value):
         with self.lock_frame:
             self._frame = value
+            seq = self._notify(Sensor.Channel.FRAME)
+        self._run_callbacks(Sensor.Channel.FRAME, value, seq)
+
+    def detach_frame(self):
+        """
+        Replace the frame with a copy of itself, for a frame that views memory
+        about to be released. Not an update: no seq change, no callbacks.
+        """
+        with self.lock_frame:
+            if self._frame is not None:
+                self._frame = self._frame.copy()
 
     @property
     def state(self):
         with self.lock_state:
             return self._state
-    
+
     @state.setter
     def state(self, value):
         with self.lock_state:
             self._state.timestamp = value[0]
-            self._state.data = np.array(value[1:], dtype=np.int16)
\ No newline at end of file
+            self._state.data = np.array(value[1:], dtype=np.int16)
+            seq = self._notify(Sensor.Channel.STATE)
+        self._run_callbacks(Sensor.Channel.STATE, self._state, seq)
+
+    @property
+    def jpeg(self):
+        with self.lock_jpeg:
+            return self._jpeg
+
+    @jpeg.setter
+    def jpeg(self, value):
+        with self.lock_jpeg:
+            self._jpeg = value
+            seq = self._notify(Sensor.Channel.JPEG)
+        self._run_callbacks(Sensor.Channel.JPEG, value, seq)
@@ -0,0 +1,371 @@
+import argparse
+import glob
+import mmap
+import os
+import struct
+import time
+import uuid
+from enum import IntEnum
+from threading import Event, Lock, Thread
+from typing import Iterator, Optional
+
+from .image_packet import ImageParser
+from .podtp_packet import PodtpPacketPool
+from .podtp_parser import PodtpParser
+from .utils import print_t
+
+SESSION_MAGIC = b'PDSR'
+SESSION_VERSION = 1
+# magic, version, wall clock and monotonic time of the segment start, session id
+SEGMENT_HEADER = struct.Struct('<4sIdQ16s')
+SEGMENT_HEADER_SIZE = 64
+# monotonic timestamp in ns, payload length, channel; a zero channel marks the end
+RECORD_HEADER = struct.Struct('<QIB3x')
+# monotonic timestamp in ns and offset of a record in the segment
+INDEX_ENTRY = struct.Struct('<QQ')
+# one index entry per this many bytes of records
+INDEX_STRIDE = 64 * 1024
+SEGMENT_SIZE = 64 << 20
+SESSION_MAX_BYTES = 1 << 30
+SESSION_FLUSH_INTERVAL = 1.0
+# a segment of another session touched this recently belongs to a live recorder; well above the flush interval
+SESSION_LIVE_TIMEOUT = 10.0
+
+class SessionRecorder:
+    """
+    Always-on capture of everything a WifiLink receives: TCP chunks and UDP
+    datagrams are appended with a monotonic timestamp to memory-mapped,
+    preallocated segment files, one copy into the map per record and no
+    system call. A background thread syncs the segments and writes their
+    index (.idx, one (timestamp, offset) entry per INDEX_STRIDE bytes).
+
+    Every start() begins a session with a unique id, in the segment names
+    (with the pid) and headers. Segments rotate at segment_size; the oldest
+    are deleted once the directory holds more than max_bytes, except those
+    of other recorders still writing: the flush thread touches the current
+    segment, and another session's segment touched within
+    SESSION_LIVE_TIMEOUT is left alone. A record's header is written after
+    its payload, so a crash loses at most the records being written.
+    """
+    class Channel(IntEnum):
+        DATA = 1
+        STREAM = 2
+
+    def __init__(self, directory: str, segment_size: int = SEGMENT_SIZE, max_bytes: int = SESSION_MAX_BYTES,
+                 flush_interval: float = SESSION_FLUSH_INTERVAL) -> None:
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.lock = Lock()
+        self.file = None
+        self.map: Optional[mmap.mmap] = None
+        self.path: Optional[str] = None
+        self.offset = 0
+        self.index = bytearray()
+        self.index_written = 0
+        self.next_index = 0
+        self.session_id = b''
+        self.session_name = ''
+        self.session_segments = 0
+        self.segments = 0
+        self.records = 0
+        self.bytes = 0
+        # records larger than a whole segment
+        self.dropped = 0
+        self.stop_event = Event()
+        self.thread: Optional[Thread] = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        session_id = uuid.uuid4()
+        with self.lock:
+            self.session_id = session_id.bytes
+            self.session_name = f'session-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{session_id.hex[:8]}'
+            self.session_segments = 0
+            self._open_segment()
+        self.stop_event.clear()
+        self.thread = Thread(target=self._flush_func, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            self._close_segment()
+
+    def append(self, channel: int, data: bytes | memoryview):
+        size = len(data)
+        timestamp = time.monotonic_ns()
+        with self.lock:
+            if self.map is None:
+                return
+            end = self.offset + RECORD_HEADER.size + size
+            if end + RECORD_HEADER.size > self.segment_size:
+                if SEGMENT_HEADER_SIZE + RECORD_HEADER.size * 2 + size > self.segment_size:
+                    self.dropped += 1
+                    return
+                self._close_segment()
+                self._open_segment()
+                end = self.offset + RECORD_HEADER.size + size
+            offset = self.offset
+            if offset >= self.next_index:
+                self.index += INDEX_ENTRY.pack(timestamp, offset)
+                self.next_index = offset + INDEX_STRIDE
+            self.map[offset + RECORD_HEADER.size:end] = data
+            RECORD_HEADER.pack_into(self.map, offset, timestamp, size, channel)
+            self.offset = end
+            self.records += 1
+            self.bytes += size
+
+    def _open_segment(self):
+        self.segments += 1
+        self.session_segments += 1
+        self.path = os.path.join(self.directory, f'{self.session_name}-{self.session_segments:04d}.pdsr')
+        # exclusive: never take over a segment another recorder is writing
+        self.file = open(self.path, 'x+b')
+        self.file.truncate(self.segment_size)
+        self.map = mmap.mmap(self.file.fileno(), self.segment_size)
+        SEGMENT_HEADER.pack_into(self.map, 0, SESSION_MAGIC, SESSION_VERSION, time.time(), time.monotonic_ns(),
+                                 self.session_id)
+        self.offset = SEGMENT_HEADER_SIZE
+        self.index = bytearray()
+        self.index_written = 0
+        self.next_index = 0
+        self._enforce_limit()
+
+    def _close_segment(self):
+        if self.map is None:
+            return
+        self._write_index()
+        self.map.flush()
+        self.map.close()
+        self.map = None
+        # give back the preallocated space the segment did not use
+        self.file.truncate(self.offset)
+        self.file.close()
+        self.file = None
+
+    def _write_index(self):
+        if self.index_written == len(self.index):
+            return
+        with open(self.path[:-len('.pdsr')] + '.idx', 'ab') as file:
+            file.write(self.index[self.index_written:])
+        self.index_written = len(self.index)
+
+    def _enforce_limit(self):
+        # live segments count with their full preallocated size
+        segments = []
+        for path in sorted(glob.glob(os.path.join(self.directory, 'session-*.pdsr'))):
+            try:
+                segments.append((path, os.stat(path)))
+            except OSError:
+                # deleted by another recorder meanwhile
+                pass
+        total = sum(stat.st_size for _, stat in segments)
+        own = os.path.join(self.directory, self.session_name + '-')
+        now = time.time()
+        for path, stat in segments:
+            if total <= self.max_bytes or path == self.path:
+                break
+            if not path.startswith(own) and now - stat.st_mtime < SESSION_LIVE_TIMEOUT:
+                continue
+            total -= stat.st_size
+            for file in (path, path[:-len('.pdsr')] + '.idx'):
+                try:
+                    os.remove(file)
+                except OSError:
+                    pass
+
+    def _flush_func(self):
+        while not self.stop_event.wait(self.flush_interval):
+            with self.lock:
+                if self.map is None:
+                    continue
+                self._write_index()
+                path = self.path
+                # a duplicate descriptor stays valid if the segment rotates meanwhile
+                fd = os.dup(self.file.fileno())
+            # fsync also writes back pages dirtied through the map, appends go on meanwhile
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            # mark the segment live for other recorders' _enforce_limit
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+class SessionReplay:
+    """
+    Read a recording back: records() yields (timestamp_ns, channel, data)
+    across every segment in order, replay() feeds them through PodtpParser
+    and ImageParser at recorded speed, scaled by speed, or as fast as
+    possible with speed None. A directory may hold several sessions, see
+    sessions(); each is replayed on its own with fresh parsers.
+    """
+    def __init__(self, path: str) -> None:
+        if os.path.isdir(path):
+            self.paths = sorted(glob.glob(os.path.join(path, 'session-*.pdsr')))
+        else:
+            self.paths = [path]
+
+    def sessions(self) -> list[list[str]]:
+        """
+        The segment paths grouped by recording session, in order. A new
+        session starts where the session id changes or the monotonic start
+        time goes back (a reboot in between).
+        """
+        sessions = []
+        previous = None
+        for path in self.paths:
+            header = self._header(path)
+            if header is None:
+                continue
+            if previous is None or header[0] != previous[0] or header[1] < previous[1]:
+                sessions.append([])
+            sessions[-1].append(path)
+            previous = header
+        return sessions
+
+    @staticmethod
+    def _header(path: str) -> Optional[tuple[bytes, int]]:
+        # (session id, monotonic start) of a segment
+        try:
+            with open(path, 'rb') as file:
+                data = file.read(SEGMENT_HEADER.size)
+        except OSError:
+            return None
+        if len(data) < SEGMENT_HEADER.size:
+            return None
+        magic, version, _, monotonic, session_id = SEGMENT_HEADER.unpack(data)
+        if magic != SESSION_MAGIC or version != SESSION_VERSION:
+            print_t(f'{path} is not a session recording')
+            return None
+        return session_id, monotonic
+
+    def records(self, start_ns: int = 0, paths: Optional[list[str]] = None) -> Iterator[tuple[int, int, memoryview]]:
+        """
+        Records from start_ns on, of paths (default: every segment); the data
+        views are valid until the next record.
+        """
+        for path in self.paths if paths is None else paths:
+            with open(path, 'rb') as file:
+                size = os.fstat(file.fileno()).st_size
+                if size < SEGMENT_HEADER_SIZE:
+                    continue
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as map:
+                    magic, version, _, _, _ = SEGMENT_HEADER.unpack_from(map, 0)
+                    if magic != SESSION_MAGIC or version != SESSION_VERSION:
+                        print_t(f'{path} is not a session recording')
+                        continue
+                    view = memoryview(map)
+                    try:
+                        yield from self._segment_records(path, view, size, start_ns)
+                    finally:
+                        view.release()
+
+    def _segment_records(self, path: str, view: memoryview, size: int, start_ns: int):
+        offset = self._seek(path, start_ns) if start_ns else SEGMENT_HEADER_SIZE
+        while offset + RECORD_HEADER.size <= size:
+            timestamp, length, channel = RECORD_HEADER.unpack_from(view, offset)
+            end = offset + RECORD_HEADER.size + length
+            if channel == 0 or end > size:
+                # end of the segment, or a record that was being written
+                return
+            if timestamp >= start_ns:
+                data = view[offset + RECORD_HEADER.size:end]
+                try:
+                    yield timestamp, channel, data
+                finally:
+                    # the segment can only be unmapped once no view of it is left
+                    data.release()
+            offset = end
+
+    def _seek(self, path: str, start_ns: int) -> int:
+        # the last index entry before start_ns, the records are scanned from there
+        offset = SEGMENT_HEADER_SIZE
+        try:
+            with open(path[:-len('.pdsr')] + '.idx', 'rb') as file:
+                index = file.read()
+        except OSError:
+            return offset
+        for timestamp, entry in INDEX_ENTRY.iter_unpack(index[:len(index) // INDEX_ENTRY.size * INDEX_ENTRY.size]):
+            if timestamp > start_ns:
+                break
+            offset = entry
+        return offset
+
+    def replay(self, speed: Optional[float] = 1.0, on_packet=None, on_frame=None) -> dict:
+        """
+        Feed each session to fresh parsers, calling on_packet(packet) for
+        every PODTP packet and on_frame(seq, jpeg) for every completed image.
+        Packets go back to the pool after on_packet returns.
+        """
+        totals = {'sessions': 0, 'records': 0, 'packets': 0, 'frames': 0, 'recorded_seconds': 0.0}
+        fragments_missing = 0
+        started = time.monotonic_ns()
+        for paths in self.sessions():
+            totals['sessions'] += 1
+            counts, missing = self._replay_session(paths, speed, on_packet, on_frame)
+            for name, value in counts.items():
+                totals[name] += value
+            fragments_missing += missing
+        elapsed = (time.monotonic_ns() - started) / 1e9
+        return {
+            **totals,
+            'elapsed_seconds': elapsed,
+            'packets_per_second': totals['packets'] / elapsed if elapsed else 0.0,
+            'frames_per_second': totals['frames'] / elapsed if elapsed else 0.0,
+            'fragments_missing': fragments_missing,
+        }
+
+    def _replay_session(self, paths: list[str], speed: Optional[float], on_packet, on_frame) -> tuple[dict, int]:
+        pool = PodtpPacketPool()
+        packet_parser = PodtpParser(pool)
+        image_parser = ImageParser()
+        packets = frames = records = 0
+        first = None
+        started = time.monotonic_ns()
+        last = 0
+        for timestamp, channel, data in self.records(paths=paths):
+            if first is None:
+                first = timestamp
+            last = timestamp
+            if speed:
+                delay = (timestamp - first) / speed - (time.monotonic_ns() - started)
+                if delay > 0:
+                    time.sleep(delay / 1e9)
+            records += 1
+            if channel == SessionRecorder.Channel.DATA:
+                for packet in packet_parser.process(data):
+                    packets += 1
+                    if on_packet is not None:
+                        on_packet(packet)
+                    pool.release(packet)
+            elif channel == SessionRecorder.Channel.STREAM:
+                seq, jpeg = image_parser.assemble(data)
+                if jpeg is not None:
+                    frames += 1
+                    if on_frame is not None:
+                        on_frame(seq, jpeg)
+        return {
+            'records': records,
+            'packets': packets,
+            'frames': frames,
+            'recorded_seconds': (last - first) / 1e9 if first is not None else 0.0,
+        }, image_parser.missing_fragments
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a PODTP session recording')
+    parser.add_argument('path', help='Recording directory or segment file')
+    parser.add_argument('--speed', help='Playback speed, 0 for as fast as possible', type=float, default=1.0)
+    args = parser.parse_args()
+    for name, value in SessionReplay(args.path).replay(args.speed or None).items():
+        print_t(f'{name}: {value:.3f}' if isinstance(value, float) else f'{name}: {value}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+import argparse
+import io
+import math
+import random
+import selectors
+import socket
+import struct
+import time
+from collections import deque
+from threading import Thread
+from typing import Optional
+import numpy as np
+from PIL import Image
+
+from .podtp_packet import PodtpPacket, PodtpType, PodtpPort
+from .podtp_parser import PodtpParser
+from .podtp_codec import lookup, MSG_ACK_ERROR, MSG_ACK_OK, MSG_LOG_STRING, MSG_LOG_DISTANCE, MSG_LOG_STATE, \
+    MSG_ESP32_ECHO, MSG_ESP32_CONFIG_CAMERA
+from .camera_config import CameraConfig
+from .image_packet import IMAGE_HEADER, IMAGE_HEADER_SIZE, IMAGE_PAYLOAD_SIZE
+from .utils import print_t
+
+# the bootloader stages firmware in RAM pages before writing them to flash
+BOOT_BUFFER_PAGE_COUNT = 10
+BOOT_PAGE_SIZE = 1024
+# telemetry waiting for a client that does not read, beyond this new frames are dropped
+SIMULATOR_MAX_OUTPUT = 1 << 20
+
+def fragment_jpeg(jpeg: bytes, seq: int) -> list[bytearray]:
+    """
+    Split a JPEG into image fragments the way the ESP32 streams it.
+    """
+    seq &= 0xFFFF
+    total = (len(jpeg) + IMAGE_PAYLOAD_SIZE - 1) // IMAGE_PAYLOAD_SIZE
+    fragments = []
+    for index in range(total):
+        payload = jpeg[index * IMAGE_PAYLOAD_SIZE:(index + 1) * IMAGE_PAYLOAD_SIZE]
+        fragment = bytearray(IMAGE_HEADER_SIZE + len(payload))
+        IMAGE_HEADER.pack_into(fragment, 0, seq, index, total, len(payload))
+        fragment[IMAGE_HEADER_SIZE:] = payload
+        fragments.append(fragment)
+    return fragments
+
+class DroneSimulator:
+    """
+    Stand-in for an ESP32/STM32 drone on localhost. It accepts one PODTP
+    connection at a time, emits LOG_STATE, LOG_DISTANCE and LOG_STRING at the
+    configured rates, ACKs commands that request it, answers echo, emulates the
+    bootloader LOAD_BUFFER/WRITE_FLASH flow and, once the stream is enabled,
+    sends JPEG frames as IMAGE_PACKET_SIZE UDP fragments to the client's
+    stream port with optional loss and reordering.
+
+    Each instance runs one thread; give instances different ports to run many.
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, stream_port: int = 81,
+                 state_rate: float = 50, distance_rate: float = 15, string_rate: float = 0,
+                 frame_rate: float = 15, loss: float = 0, reorder: float = 0,
+                 frames: Optional[list[bytes]] = None, seed: int = 0) -> None:
+        self.host = host
+        self.port = port
+        self.stream_port = stream_port
+        self.state_rate = state_rate
+        self.distance_rate = distance_rate
+        self.string_rate = string_rate
+        self.frame_rate = frame_rate
+        # probability that a fragment is dropped / swapped with the next one
+        self.loss = loss
+        self.reorder = reorder
+        self.random = random.Random(seed)
+
+        self.camera_config = CameraConfig()
+        self._frames = frames
+        self._frame_cache: dict[tuple[int, int], list[bytes]] = {}
+        self.frame_seq = 0
+        self.stream_enabled = False
+
+        self.boot_buffer = bytearray(BOOT_BUFFER_PAGE_COUNT * BOOT_PAGE_SIZE)
+        self.flash: dict[int, bytes] = {}
+        self.bootloader = False
+        self.commands = deque(maxlen=1024)
+
+        self.selector = selectors.DefaultSelector()
+        self.server: Optional[socket.socket] = None
+        self.client: Optional[socket.socket] = None
+        self.client_ip = host
+        # bytes the non-blocking client socket has not taken yet, written on EVENT_WRITE
+        self.output = bytearray()
+        # whole frames not queued because the client stopped reading
+        self.dropped = 0
+        self.stream_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.parser = PodtpParser()
+        self.running = False
+        self.thread: Optional[Thread] = None
+
+    def start(self) -> int:
+        """
+        Start serving and return the bound TCP port.
+        """
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((self.host, self.port))
+        self.server.listen(1)
+        self.server.setblocking(False)
+        self.port = self.server.getsockname()[1]
+        self.selector.register(self.server, selectors.EVENT_READ)
+        self.running = True
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self._close_client()
+        self.selector.unregister(self.server)
+        self.server.close()
+        self.stream_socket.close()
+
+    def _close_client(self):
+        if self.client is None:
+            return
+        self.selector.unregister(self.client)
+        self.client.close()
+        self.client = None
+        self.output.clear()
+        self.stream_enabled = False
+        self.parser = PodtpParser()
+
+    def _send(self, frame: bytes):
+        if self.client is None:
+            return
+        if self.output:
+            # keep the order behind what is waiting; whole frames only, never half of one
+            if len(self.output) + len(frame) > SIMULATOR_MAX_OUTPUT:
+                self.dropped += 1
+                return
+            self.output += frame
+            return
+        try:
+            sent = self.client.send(frame)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self._close_client()
+            return
+        if sent < len(frame):
+            self.output += memoryview(frame)[sent:]
+            self.selector.modify(self.client, selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+    def _write_output(self):
+        try:
+            sent = self.client.send(self.output)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self._close_client()
+            return
+        del self.output[:sent]
+        if not self.output:
+            self.selector.modify(self.client, selectors.EVENT_READ)
+
+    def _run(self):
+        tasks = [(task, 1 / rate) for task, rate in ((self._send_state, self.state_rate),
+                                                     (self._send_distance, self.distance_rate),
+                                                     (self._send_string, self.string_rate),
+                                                     (self._send_frame, self.frame_rate)) if rate > 0]
+        deadlines = [time.time()] * len(tasks)
+        while self.running:
+            timeout = min([0.1] + [deadline - time.time() for deadline in deadlines])
+            for key, events in self.selector.select(max(timeout, 0)):
+                if key.fileobj is self.server:
+                    self._accept()
+                    continue
+                if events & selectors.EVENT_WRITE and key.fileobj is self.client:
+                    self._write_output()
+                if events & selectors.EVENT_READ and key.fileobj is self.client:
+                    self._receive()
+            now = time.time()
+            for i, (task, period) in enumerate(tasks):
+                if now >= deadlines[i]:
+                    if self.client is not None:
+                        task()
+                    # skip missed periods instead of bursting to catch up
+                    deadlines[i] = max(deadlines[i] + period, now)
+
+    def _accept(self):
+        client, addr = self.server.accept()
+        if self.client is not None:
+            # the ESP32 serves a single client, the newest one wins
+            self._close_client()
+        client.setblocking(False)
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.client = client
+        self.client_ip = addr[0]
+        self.selector.register(client, selectors.EVENT_READ)
+
+    def _receive(self):
+        try:
+            data = self.client.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._close_client()
+            return
+        for packet in self.parser.process(data):
+            self._handle(packet)
+
+    def _handle(self, packet: PodtpPacket):
+        type = packet.header.type
+        port = packet.header.port
+        message = lookup(type, port)
+        self.commands.append((time.time(), type, port, bytes(packet.payload)))
+        try:
+            self._execute(packet, message)
+        except (ValueError, IndexError, struct.error) as e:
+            # a bad command must not take the simulator down, the client gets a NACK if it asked for an ack
+            print_t(f'Rejected command type {type} port {port}: {e}')
+            if packet.header.ack:
+                self._send(MSG_ACK_ERROR.encode())
+            return
+        if packet.header.ack:
+            self._send(MSG_ACK_OK.encode())
+
+    def _execute(self, packet: PodtpPacket, message):
+        """
+        Apply a command, ValueError if its values are out of range.
+        """
+        type = packet.header.type
+        port = packet.header.port
+        if type == PodtpType.ESP32:
+            if port == PodtpPort.ESP32_ECHO:
+                self._send(MSG_ESP32_ECHO.encode(payload=bytes(packet.payload)))
+            elif port == PodtpPort.ESP32_ENABLE_STREAM:
+                self.stream_enabled = bool(packet.payload[0])
+            elif port == PodtpPort.ESP32_CONFIG_CAMERA:
+                on, frame_size, quality, *_ = MSG_ESP32_CONFIG_CAMERA.decode(packet)
+                frame_size = CameraConfig.FrameSize(frame_size)
+                if not 0 <= quality <= 63:
+                    raise ValueError(f'quality {quality} is not in 0..63')
+                self.camera_config.frame_size = frame_size
+                self.camera_config.quality = quality
+            elif port == PodtpPort.ESP32_START_STM32_BOOTLOADER:
+                self.bootloader = bool(packet.payload[0])
+        elif type == PodtpType.BOOT_LOADER and message is not None:
+            if port == PodtpPort.BOOT_LOADER_LOAD_BUFFER:
+                page, offset = message.decode(packet)
+                chunk = message.decode_payload(packet)
+                start = page * BOOT_PAGE_SIZE + offset
+                if start + len(chunk) > len(self.boot_buffer):
+                    raise ValueError(f'page {page} offset {offset} size {len(chunk)} is outside the buffer')
+                self.boot_buffer[start:start + len(chunk)] = chunk
+            elif port == PodtpPort.BOOT_LOADER_WRITE_FLASH:
+                buffer_page, flash_page, pages = message.decode(packet)
+                if buffer_page + pages > BOOT_BUFFER_PAGE_COUNT:
+                    raise ValueError(f'buffer pages {buffer_page}..{buffer_page + pages} are outside the buffer')
+                for i in range(pages):
+                    start = (buffer_page + i) * BOOT_PAGE_SIZE
+                    self.flash[flash_page + i] = bytes(self.boot_buffer[start:start + BOOT_PAGE_SIZE])
+
+    def firmware(self, start_page: int) -> bytes:
+        """
+        Contents written to flash from start_page on, for checking uploads.
+        """
+        data = bytearray()
+        page = start_page
+        while page in self.flash:
+            data += self.flash[page]
+            page += 1
+        return bytes(data)
+
+    def _send_state(self):
+        t = time.time()
+        self._send(MSG_LOG_STATE.encode(int(t * 1000) & 0xFFFFFFFF,
+                                        int(100 * math.sin(t)), int(100 * math.cos(t)), 0, 0, 0, 500))
+
+    def _send_distance(self):
+        t = time.time()
+        depth = [int(1000 + 500 * math.sin(t + i / 8)) for i in range(64)]
+        self._send(MSG_LOG_DISTANCE.encode(int(t * 1000) & 0xFFFFFFFF, *depth))
+
+    def _send_string(self):
+        self._send(MSG_LOG_STRING.encode(payload=f'sim {time.time():.3f}\n'.encode()))
+
+    def _jpeg_frames(self) -> list[bytes]:
+        if self._frames:
+            return self._frames
+        key = (self.camera_config.frame_size.value, self.camera_config.quality)
+        frames = self._frame_cache.get(key)
+        if frames is None:
+            width, height = CameraConfig.RESOLUTIONS[self.camera_config.frame_size]
+            # ESP32 quality runs from 0 (best) to 63
+            quality = max(5, 95 - self.camera_config.quality)
+            rng = np.random.default_rng(key)
+            x = np.linspace(0, 255, width, dtype=np.float32)
+            frames = []
+            for i in range(4):
+                base = (x[None, :] + np.linspace(0, 255, height, dtype=np.float32)[:, None] + i * 32) % 256
+                # 8x8 blocks of noise keep the JPEG near the size the ESP32 produces
+                noise = rng.integers(0, 8, (height // 8 + 1, width // 8 + 1), dtype=np.uint8)
+                noise = noise.repeat(8, axis=0).repeat(8, axis=1)[:height, :width]
+                pixels = np.stack([base, base[::-1], base[:, ::-1]], axis=2).astype(np.uint8) + noise[..., None]
+                output = io.BytesIO()
+                Image.fromarray(pixels).save(output, format='JPEG', quality=quality)
+                frames.append(output.getvalue())
+            self._frame_cache[key] = frames
+        return frames
+
+    def _send_frame(self):
+        if not self.stream_enabled:
+            return
+        frames = self._jpeg_frames()
+        jpeg = frames[self.frame_seq % len(frames)]
+        fragments = fragment_jpeg(jpeg, self.frame_seq)
+        self.frame_seq += 1
+        if self.loss:
+            fragments = [fragment for fragment in fragments if self.random.random() >= self.loss]
+        if self.reorder:
+            for i in range(len(fragments) - 1):
+                if self.random.random() < self.reorder:
+                    fragments[i], fragments[i + 1] = fragments[i + 1], fragments[i]
+        for fragment in fragments:
+            try:
+                self.stream_socket.sendto(fragment, (self.client_ip, self.stream_port))
+            except OSError:
+                pass
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate PODTP drones on localhost')
+    parser.add_argument('-n', '--count', help='Number of drones', type=int, default=1)
+    parser.add_argument('-p', '--port', help='TCP port of the first drone, 0 for any', type=int, default=8080)
+    parser.add_argument('-s', '--stream-port', help='UDP stream port of the first drone', type=int, default=8180)
+    parser.add_argument('--state-rate', type=float, default=50)
+    parser.add_argument('--distance-rate', type=float, default=15)
+    parser.add_argument('--string-rate', type=float, default=0)
+    parser.add_argument('--frame-rate', type=float, default=15)
+    parser.add_argument('--loss', help='Fragment loss probability', type=float, default=0)
+    parser.add_argument('--reorder', help='Fragment reorder probability', type=float, default=0)
+    args = parser.parse_args()
+
+    simulators = []
+    for i in range(args.count):
+        simulator = DroneSimulator(port=args.port + i if args.port else 0,
+                                   stream_port=args.stream_port + i,
+                                   state_rate=args.state_rate, distance_rate=args.distance_rate,
+                                   string_rate=args.string_rate, frame_rate=args.frame_rate,
+                                   loss=args.loss, reorder=args.reorder, seed=i)
+        port = simulator.start()
+        print_t(f'Drone {i}: PODTP on 127.0.0.1:{port}, stream to port {simulator.stream_port}')
+        simulators.append(simulator)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    for simulator in simulators:
+        simulator.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import multiprocessing
+import os
+import time
+from threading import Lock, Thread
+from typing import Callable, Optional
+
+from .camera_config import CameraConfig
+from .decode_pool import DecodePool, DECODE_WORKERS
+from .frame_ring import FrameRing, FRAME_RING_SLOTS
+from .image_packet import ImageParser
+from .jpeg_decoder import JpegDecoder
+from .undistort import Undistorter, UndistortingDecoder
+from .link import WifiLink
+from .session_recorder import SessionRecorder, SESSION_MAX_BYTES
+from .stream_stats import StreamStats
+from .udp_batch import BATCH_SIZE, STREAM_RECEIVE_BUFFER
+from .utils import print_t
+
+STREAM_PROCESS_START_TIMEOUT = 10
+# how often the worker checks whether it should stop
+STREAM_PROCESS_POLL_INTERVAL = 0.1
+STREAM_PROCESS_STATS_INTERVAL = 1.0
+
+def _stream_worker(config: dict, ring_name: str, conn, stop):
+    """
+    Worker process body: receive, reassemble and decode the stream, write the
+    frames into the ring and send each frame's count to the parent. With
+    session_recording the datagrams are recorded here, as a session of their
+    own next to the parent's.
+    """
+    ring = FrameRing.attach(ring_name, track=True)
+    link = WifiLink(config["ip"], config.get("stream_port", 81), True,
+                    receive_buffer=config.get("stream_receive_buffer", STREAM_RECEIVE_BUFFER),
+                    batch_size=config.get("stream_batch_size", BATCH_SIZE))
+    if not link.connect():
+        link.close()
+        conn.send(False)
+        return
+    recorder = None
+    if config.get("session_recording"):
+        recorder = SessionRecorder(config["session_recording"],
+                                   max_bytes=config.get("session_max_bytes", SESSION_MAX_BYTES))
+        recorder.start()
+        link.record(recorder, SessionRecorder.Channel.STREAM)
+    conn.send(True)
+    # the decode workers publish and the loop below sends stats, a Connection is not thread safe
+    send_lock = Lock()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    image_parser = ImageParser()
+    # (started, received) per seq until its frame is decoded
+    times = {}
+
+    def publish(seq: int, frame):
+        count = ring.write(frame, seq, *times.pop(seq, (0, 0)))
+        if count > 0:
+            send(count)
+        else:
+            print_t(f'Frame {frame.shape} does not fit the frame ring')
+
+    decoder = JpegDecoder.from_config(config)
+    undistorter = Undistorter.from_config(config)
+    if undistorter is not None:
+        decoder = UndistortingDecoder(decoder, undistorter)
+    decode_pool = DecodePool(decoder, publish, config.get("decode_workers", DECODE_WORKERS))
+    decode_pool.start()
+    stats = StreamStats(image_parser, decode_pool, link)
+    next_stats = time.time()
+    try:
+        while not stop.is_set():
+            if time.time() >= next_stats:
+                next_stats += STREAM_PROCESS_STATS_INTERVAL
+                send(stats.snapshot())
+            for data in link.receive_batch(STREAM_PROCESS_POLL_INTERVAL):
+                seq, jpeg = image_parser.assemble(data)
+                if jpeg is not None:
+                    if len(times) > FRAME_RING_SLOTS * 4:
+                        # frames the decode pool dropped never come back for theirs
+                        times.clear()
+                    times[seq] = (image_parser.image_started, time.time())
+                    stats.frame_completed(*times[seq])
+                    decode_pool.submit(seq, jpeg)
+    finally:
+        decode_pool.stop()
+        send(None)
+        link.close()
+        if recorder is not None:
+            recorder.stop()
+        ring.close()
+
+class StreamProcess:
+    """
+    Run UDP receive, reassembly and decode of the stream in a separate
+    process so decoding never competes for the GIL with the command and
+    keep-alive threads. Frames land in a FrameRing that other local processes
+    can attach to by name; on_frame(ring.view()) is called on a thread of this
+    process for every frame. on_stop runs after the last on_frame and before
+    the ring closes, the place to let go of views.
+    """
+    def __init__(self, config: dict, on_frame: Callable[[FrameRing.Frame], None],
+                 on_stop: Optional[Callable[[], None]] = None) -> None:
+        self.config = {k: v for k, v in config.items() if isinstance(v, (str, int, float, bool, list, tuple))}
+        self.on_frame = on_frame
+        self.on_stop = on_stop
+        self.ring_name = config.get("frame_ring_name")
+        self.ring_slots = config.get("frame_ring_slots", FRAME_RING_SLOTS)
+        self.ring: Optional[FrameRing] = None
+        # spawn: forking a process that runs the packet and writer threads is not safe
+        self.context = multiprocessing.get_context('spawn')
+        self.process = None
+        self.conn = None
+        self.stop_event = None
+        self.thread: Optional[Thread] = None
+        # the worker's last StreamStats.snapshot()
+        self.stats: dict = {}
+
+    def start(self) -> bool:
+        scale = self.config.get("decode_scale", 1)
+        width, height = max(CameraConfig.RESOLUTIONS.values())
+        self.ring = FrameRing.create((height // scale, width // scale, 3), self.ring_slots,
+                                     self.ring_name or f'podtp_{os.getpid()}_{id(self):x}')
+        self.conn, child_conn = self.context.Pipe(duplex=False)
+        self.stop_event = self.context.Event()
+        self.process = self.context.Process(target=_stream_worker, daemon=True,
+                                            args=(self.config, self.ring.name, child_conn, self.stop_event))
+        self.process.start()
+        child_conn.close()
+        if not self.conn.poll(STREAM_PROCESS_START_TIMEOUT) or not self.conn.recv():
+            print_t('Stream process failed to start')
+            self.stop()
+            return False
+        self.thread = Thread(target=self._listen_func)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        if self.stop_event is not None:
+            self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.process is not None:
+            self.process.join(STREAM_PROCESS_START_TIMEOUT)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if self.ring is not None:
+            if self.on_stop is not None:
+                self.on_stop()
+            self.ring.close()
+            self.ring = None
+
+    def _listen_func(self):
+        while True:
+            try:
+                count = self.conn.recv()
+            except EOFError:
+                return
+            if count is None:
+                return
+            if isinstance(count, dict):
+                self.stats = count
+                continue
+            # the worker may be several frames ahead, only hand out the newest
+            if count != self.ring.count:
+                continue
+            frame = self.ring.view(count)
+            if frame is not None:
+                self.on_frame(frame)
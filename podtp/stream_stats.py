@@ -0,0 +1,145 @@
+import os
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import Optional
+
+# upper bucket bounds in milliseconds, the last bucket takes everything above
+LATENCY_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+DECODE_BOUNDS_MS = (1, 2, 3, 5, 8, 12, 20, 33, 50, 100)
+# delivered frames kept to compute the frame rate
+FPS_WINDOW = 32
+
+class Histogram:
+    """
+    Fixed-bucket histogram of durations in milliseconds, one bisect per sample.
+    """
+    def __init__(self, bounds: tuple[float, ...]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p: float) -> float:
+        """
+        Upper bound of the bucket holding the p-th percentile (max for the last bucket).
+        """
+        if self.count == 0:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+            'buckets': dict(zip([f'<={b}' for b in self.bounds] + [f'>{self.bounds[-1]}'], self.counts)),
+        }
+
+def udp_socket_drops(fd: int) -> Optional[int]:
+    """
+    Datagrams the kernel dropped for the socket because its receive buffer
+    was full, from /proc/net/udp. None where that is not available.
+    """
+    try:
+        inode = str(os.fstat(fd).st_ino)
+    except OSError:
+        return None
+    for table in ('/proc/net/udp', '/proc/net/udp6'):
+        try:
+            with open(table) as file:
+                next(file)
+                for line in file:
+                    fields = line.split()
+                    # ... uid timeout inode ref pointer drops
+                    if len(fields) >= 13 and fields[9] == inode:
+                        return int(fields[12])
+        except OSError:
+            continue
+    return None
+
+class StreamStats:
+    """
+    Live health of the video stream. Reassembly and decode keep their own
+    counters, this adds per-frame latency, decode time and delivery rate and
+    gathers everything in snapshot(). Updates are a few integer operations
+    per frame, so it stays on.
+    """
+    def __init__(self, image_parser, decode_pool, link=None) -> None:
+        self.image_parser = image_parser
+        self.decode_pool = decode_pool
+        self.link = link
+        # first to last fragment of every completed frame
+        self.reassembly_latency = Histogram(LATENCY_BOUNDS_MS)
+        self.delivered = 0
+        self.delivery_times = deque(maxlen=FPS_WINDOW)
+        self.started = time.time()
+
+    def frame_completed(self, started: float, received: float):
+        self.reassembly_latency.observe((received - started) * 1000)
+
+    def frame_delivered(self):
+        self.delivered += 1
+        self.delivery_times.append(time.time())
+
+    def fps(self) -> float:
+        """
+        Delivered frames per second over the last FPS_WINDOW frames, 0 once
+        nothing was delivered for a second.
+        """
+        if len(self.delivery_times) < 2 or time.time() - self.delivery_times[-1] > 1:
+            return 0.0
+        return (len(self.delivery_times) - 1) / (self.delivery_times[-1] - self.delivery_times[0])
+
+    def snapshot(self) -> dict:
+        parser = self.image_parser
+        pool = self.decode_pool
+        return {
+            'uptime': time.time() - self.started,
+            'fragments_received': parser.fragments,
+            'fragments_missing': parser.missing_fragments,
+            'fragments_late': parser.late_fragments,
+            'fragments_duplicate': parser.duplicate_fragments,
+            'fragments_invalid': parser.invalid_fragments,
+            'frames_completed': parser.completed,
+            'frames_evicted': parser.evicted_stale + parser.evicted_overflow + parser.evicted_timeout,
+            'frames_evicted_stale': parser.evicted_stale,
+            'frames_evicted_overflow': parser.evicted_overflow,
+            'frames_evicted_timeout': parser.evicted_timeout,
+            'frames_decode_dropped': pool.dropped,
+            'frames_decode_skipped': pool.skipped,
+            'frames_corrupt': pool.failed,
+            'last_decode_error': getattr(pool.decode, 'last_error', None),
+            'frames_delivered': self.delivered,
+            'fps': self.fps(),
+            'reassembly_latency_ms': self.reassembly_latency.summary(),
+            'decode_ms': pool.decode_time.summary(),
+            'socket_drops': self.socket_drops(),
+            'socket_receive_buffer': self.link.receive_buffer if self.link is not None else None,
+        }
+
+    def socket_drops(self) -> Optional[int]:
+        if self.link is None or not self.link.client_connected:
+            return None
+        # batched receive gets the count with the datagrams, no need to scan /proc
+        drops = self.link.kernel_drops
+        if drops is not None:
+            return drops
+        return udp_socket_drops(self.link.client_socket.fileno())
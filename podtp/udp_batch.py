@@ -0,0 +1,170 @@
+import ctypes
+import errno
+import socket
+import struct
+import sys
+from typing import Optional
+
+# Linux only: ask for the socket's drop count as ancillary data on every datagram
+SO_RXQ_OVFL = 40
+# Linux only: like SO_RCVBUF but not capped by net.core.rmem_max, needs CAP_NET_ADMIN
+SO_RCVBUFFORCE = getattr(socket, 'SO_RCVBUFFORCE', 33)
+# for recvmmsg, which only exists on Linux
+MSG_DONTWAIT = 0x40
+# room for one image fragment with its PODTP framing
+BATCH_DATAGRAM_SIZE = 2048
+BATCH_SIZE = 64
+# a few 720p frames of fragments; the kernel accounts ~2 KB of buffer per 1 KB datagram
+STREAM_RECEIVE_BUFFER = 4 << 20
+
+class _iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(_iovec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _msghdr), ('msg_len', ctypes.c_uint)]
+
+def _load_recvmmsg():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        recvmmsg = libc.recvmmsg
+    except (OSError, AttributeError):
+        return None
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    recvmmsg.restype = ctypes.c_int
+    return recvmmsg
+
+_recvmmsg = _load_recvmmsg()
+
+def set_receive_buffer(sock: socket.socket, size: int) -> int:
+    """
+    Ask for a receive buffer of size bytes and return what the kernel granted.
+    Without privileges Linux caps the size at net.core.rmem_max.
+    """
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, size)
+    except OSError:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+    granted = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    # Linux reports twice the requested size, the extra half is its bookkeeping
+    if sys.platform.startswith('linux'):
+        granted //= 2
+    return granted
+
+class UdpBatchReceiver:
+    """
+    Drain up to count datagrams from a UDP socket per call into preallocated
+    buffers: one recvmmsg system call on Linux, a non-blocking recv_into
+    loop elsewhere. Where the kernel supports SO_RXQ_OVFL, drops holds the
+    number of datagrams it dropped because the receive buffer was full.
+    """
+    def __init__(self, sock: socket.socket, count: int = BATCH_SIZE, size: int = BATCH_DATAGRAM_SIZE) -> None:
+        self.sock = sock
+        self.count = count
+        self.size = size
+        self.buffer = bytearray(count * size)
+        self.buffer_view = memoryview(self.buffer)
+        self.drops: Optional[int] = None
+        if sys.platform.startswith('linux'):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+                self.drops = 0
+            except OSError:
+                pass
+        self.control_size = socket.CMSG_SPACE(4) if self.drops is not None else 0
+        self.control = bytearray(count * self.control_size)
+        self.use_recvmmsg = _recvmmsg is not None
+        if self.use_recvmmsg:
+            self._setup_recvmmsg()
+        # Windows has no MSG_DONTWAIT, the socket itself has to be non-blocking there
+        self.loop_flags = getattr(socket, 'MSG_DONTWAIT', 0)
+        if not self.use_recvmmsg and not self.loop_flags:
+            sock.setblocking(False)
+
+    def _setup_recvmmsg(self):
+        # the ctypes arrays share memory with the bytearrays, nothing is copied per call
+        self._buffer_c = (ctypes.c_char * len(self.buffer)).from_buffer(self.buffer)
+        self._iovecs = (_iovec * self.count)()
+        self._messages = (_mmsghdr * self.count)()
+        base = ctypes.addressof(self._buffer_c)
+        if self.control_size:
+            self._control_c = (ctypes.c_char * len(self.control)).from_buffer(self.control)
+            control_base = ctypes.addressof(self._control_c)
+        for i in range(self.count):
+            self._iovecs[i].iov_base = base + i * self.size
+            self._iovecs[i].iov_len = self.size
+            header = self._messages[i].msg_hdr
+            header.msg_iov = ctypes.pointer(self._iovecs[i])
+            header.msg_iovlen = 1
+            if self.control_size:
+                header.msg_control = control_base + i * self.control_size
+        self._cmsg_header = socket.CMSG_LEN(0)
+        self._cmsg_format = struct.Struct('@Nii')
+
+    def receive(self) -> list[memoryview]:
+        """
+        Datagrams waiting right now, possibly none. The views are valid until the next call.
+        """
+        if self.use_recvmmsg:
+            return self._receive_recvmmsg()
+        return self._receive_loop()
+
+    def _receive_recvmmsg(self) -> list[memoryview]:
+        messages = self._messages
+        for i in range(self.count):
+            # the kernel overwrites these with what it filled in
+            messages[i].msg_hdr.msg_controllen = self.control_size
+            messages[i].msg_hdr.msg_flags = 0
+        received = _recvmmsg(self.sock.fileno(), messages, self.count, MSG_DONTWAIT, None)
+        if received < 0:
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EINTR):
+                return []
+            raise OSError(error, 'recvmmsg failed')
+        views = []
+        for i in range(received):
+            offset = i * self.size
+            views.append(self.buffer_view[offset:offset + messages[i].msg_len])
+        if self.control_size and received:
+            self._read_drops(received - 1, messages[received - 1].msg_hdr.msg_controllen)
+        return views
+
+    def _read_drops(self, index: int, length: int):
+        # the counter is cumulative, the newest datagram has the latest value
+        offset = index * self.control_size
+        if length < self._cmsg_header + 4:
+            return
+        _, level, type = self._cmsg_format.unpack_from(self.control, offset)
+        if level == socket.SOL_SOCKET and type == SO_RXQ_OVFL:
+            self.drops = struct.unpack_from('@I', self.control, offset + self._cmsg_header)[0]
+
+    def _receive_loop(self) -> list[memoryview]:
+        views = []
+        for i in range(self.count):
+            offset = i * self.size
+            try:
+                if self.control_size:
+                    size, ancdata, _, _ = self.sock.recvmsg_into([self.buffer_view[offset:offset + self.size]],
+                                                                 self.control_size, self.loop_flags)
+                    for level, type, data in ancdata:
+                        if level == socket.SOL_SOCKET and type == SO_RXQ_OVFL and len(data) >= 4:
+                            self.drops = struct.unpack_from('@I', data)[0]
+                else:
+                    size = self.sock.recv_into(self.buffer_view[offset:offset + self.size],
+                                               self.size, self.loop_flags)
+            except (BlockingIOError, InterruptedError):
+                break
+            views.append(self.buffer_view[offset:offset + size])
+        return views
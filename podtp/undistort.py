@@ -0,0 +1,171 @@
+import hashlib
+import os
+from threading import Lock
+from typing import Optional
+import numpy as np
+
+from .camera_config import CameraConfig
+from .jpeg_decoder import JpegDecoder
+from .utils import print_t
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# CameraConfig.K and D were calibrated on FRAMESIZE_HD frames
+CALIBRATION_SIZE = (1280, 720)
+# fresh arrays by default, as JpegDecoder; reuse is opt-in with undistort_buffers
+UNDISTORT_BUFFERS = 0
+UNDISTORT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'podtp')
+
+# maps shared by every Undistorter in the process, keyed by Undistorter._key()
+_maps: dict[str, tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+_maps_lock = Lock()
+
+class Undistorter:
+    """
+    Fisheye undistortion for stream frames. The remap tables are built once
+    per (K, D, frame size, balance) and cached in memory and, with a
+    cache_dir, on disk; each frame is then a single fixed-point (CV_16SC2)
+    cv2.remap, into a ring of reused buffers with buffers > 0 (JpegDecoder's
+    semantics).
+
+    K and D belong to calibration_size and are scaled to the size of the
+    frames, so decode_scale and smaller frames of the same aspect ratio work
+    unchanged; other aspect ratios (4:3 against the 16:9 HD calibration) only
+    approximate and get a warning.
+    """
+    def __init__(self, K: np.ndarray = CameraConfig.K, D: np.ndarray = CameraConfig.D, balance: float = 0.0,
+                 calibration_size: tuple[int, int] = CALIBRATION_SIZE, cache_dir: Optional[str] = None,
+                 buffers: int = UNDISTORT_BUFFERS) -> None:
+        if cv2 is None:
+            raise ImportError('undistortion needs opencv-python')
+        self.K = np.asarray(K, dtype=np.float64)
+        self.D = np.asarray(D, dtype=np.float64).reshape(4, 1)
+        self.balance = balance
+        self.calibration_size = tuple(calibration_size)
+        self.cache_dir = cache_dir
+        self.buffers = buffers
+        self._ring: list[Optional[np.ndarray]] = [None] * buffers
+        self._next = 0
+        self._lock = Lock()
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional['Undistorter']:
+        """
+        None unless the config turns undistortion on.
+        """
+        if not config.get("undistort", False):
+            return None
+        return cls(config.get("camera_K", CameraConfig.K), config.get("camera_D", CameraConfig.D),
+                   config.get("undistort_balance", 0.0), config.get("calibration_size", CALIBRATION_SIZE),
+                   config.get("undistort_cache", UNDISTORT_CACHE_DIR),
+                   config.get("undistort_buffers", UNDISTORT_BUFFERS))
+
+    def __getstate__(self) -> dict:
+        return {'K': self.K, 'D': self.D, 'balance': self.balance, 'calibration_size': self.calibration_size,
+                'cache_dir': self.cache_dir, 'buffers': self.buffers}
+
+    def __setstate__(self, state: dict):
+        self.__init__(**state)
+
+    def __call__(self, frame: np.ndarray) -> np.ndarray:
+        map1, map2, _ = self.maps((frame.shape[1], frame.shape[0]))
+        return cv2.remap(frame, map1, map2, cv2.INTER_LINEAR, dst=self._output(frame.shape),
+                         borderMode=cv2.BORDER_CONSTANT)
+
+    def camera_matrix(self, size: tuple[int, int]) -> np.ndarray:
+        """
+        Intrinsics of the undistorted frames of the given (width, height).
+        """
+        return self.maps(size)[2]
+
+    def maps(self, size: tuple[int, int]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (map1, map2, new K) for frames of the given (width, height).
+        """
+        key = self._key(size)
+        maps = _maps.get(key)
+        if maps is not None:
+            return maps
+        with _maps_lock:
+            # another thread may have built them while this one waited
+            maps = _maps.get(key)
+            if maps is None:
+                maps = _maps[key] = self._load(key) or self._build(size, key)
+        return maps
+
+    def _key(self, size: tuple[int, int]) -> str:
+        digest = hashlib.sha1(self.K.tobytes() + self.D.tobytes())
+        digest.update(repr((tuple(size), float(self.balance), self.calibration_size)).encode())
+        return digest.hexdigest()[:16]
+
+    def _path(self, key: str) -> Optional[str]:
+        return os.path.join(self.cache_dir, f'undistort_{key}.npz') if self.cache_dir else None
+
+    def _load(self, key: str) -> Optional[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        path = self._path(key)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                return data['map1'], data['map2'], data['K']
+        except (OSError, ValueError, KeyError):
+            # truncated or from an incompatible version, rebuilt below
+            return None
+
+    def _build(self, size: tuple[int, int], key: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        calibration_width, calibration_height = self.calibration_size
+        if abs(size[0] * calibration_height - size[1] * calibration_width) > 0.01 * size[1] * calibration_width:
+            # the sensor window differs between aspect ratios, scaling each axis only approximates it
+            print_t(f'Undistorting {size[0]}x{size[1]} frames with a {calibration_width}x{calibration_height} '
+                    f'calibration, the aspect ratios differ; calibrate at this frame size for accurate results')
+        K = self.K.copy()
+        K[0] *= size[0] / self.calibration_size[0]
+        K[1] *= size[1] / self.calibration_size[1]
+        new_K = cv2.fisheye.estimateNewCameraMatrixForUndistortRectify(K, self.D, size, np.eye(3),
+                                                                       balance=self.balance)
+        map1, map2 = cv2.fisheye.initUndistortRectifyMap(K, self.D, np.eye(3), new_K, size, cv2.CV_16SC2)
+        path = self._path(key)
+        if path is not None:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                # write then rename, so a reader never sees half a file
+                temp = f'{path}.{os.getpid()}.tmp'
+                with open(temp, 'wb') as file:
+                    np.savez(file, map1=map1, map2=map2, K=new_K)
+                os.replace(temp, path)
+            except OSError:
+                pass
+        return map1, map2, new_K
+
+    def _output(self, shape: tuple) -> Optional[np.ndarray]:
+        if self.buffers <= 0:
+            return None
+        with self._lock:
+            index = self._next
+            self._next = (index + 1) % self.buffers
+            out = self._ring[index]
+            if out is None or out.shape != shape:
+                out = self._ring[index] = np.empty(shape, dtype=np.uint8)
+        return out
+
+class UndistortingDecoder:
+    """
+    A JpegDecoder followed by an Undistorter as one decode callable, so the
+    remap runs on the decode pool workers. Pickles for process pools.
+    """
+    def __init__(self, decoder: JpegDecoder, undistorter: Undistorter) -> None:
+        self.decoder = decoder
+        self.undistorter = undistorter
+
+    @property
+    def last_error(self) -> Optional[str]:
+        return self.decoder.last_error
+
+    def __call__(self, jpeg: bytes | memoryview) -> Optional[np.ndarray]:
+        frame = self.decoder(jpeg)
+        if frame is None:
+            return None
+        return self.undistorter(frame)
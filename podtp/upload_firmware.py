@@ -1,68 +1,33 @@
 import math, time, json
-import struct
 import argparse
 from tqdm import tqdm
 
 from .podtp import Podtp
-from .podtp_packet import PodtpPacket, PodtpType, PodtpPort
+from .podtp_codec import MSG_BOOT_LOADER_LOAD_BUFFER, MSG_BOOT_LOADER_WRITE_FLASH, \
+    MSG_ESP32_START_STM32_BOOTLOADER
 from .utils import print_t
-from .podtp_packet import PODTP_MAX_DATA_LEN
 
 FIRMWARE_START_PAGE = 128
 BUFFER_PAGE_COUNT = 10
 PAGE_SIZE = 1024
 
-class LoadBuffer:
-    def __init__(self):
-        self.bufferPage = 0
-        self.offset = 0
-
-    def size(self):
-        return struct.calcsize('<HH')
-
-    def pack(self):
-        return struct.pack('<HH', self.bufferPage, self.offset)
-
-class WriteFlash:
-    def __init__(self):
-        self.bufferPage = 0
-        self.flashPage = 0
-        self.numPages = 0
-
-    def size(self):
-        return struct.calcsize('<HHH')
-
-    def pack(self):
-        return struct.pack('<HHH', self.bufferPage, self.flashPage, self.numPages)
-
 def read_bin_file(file_path):
     with open(file_path, 'rb') as file:
         return file.read()
 
 def send_write_flash(podtp: Podtp, flash_page, num_pages) -> bool:
     # print_t(f'Writing flash page {flash_page} with {num_pages} pages')
-    packet = PodtpPacket().set_header(PodtpType.BOOT_LOADER,
-                                      PodtpPort.BOOT_LOADER_WRITE_FLASH, ack=True)
-    write_flash = WriteFlash()
-    write_flash.bufferPage = 0
-    write_flash.flashPage = flash_page + FIRMWARE_START_PAGE
-    write_flash.numPages = num_pages
-
-    packet.data[:write_flash.size()] = write_flash.pack()
-    packet.length = 1 + write_flash.size()
-    if not podtp._send_packet(packet, timeout=10):
+    # buffer page, flash page, number of pages
+    if not podtp._send_message(MSG_BOOT_LOADER_WRITE_FLASH, 0, flash_page + FIRMWARE_START_PAGE,
+                               num_pages, timeout=10):
         print_t(f'Failed to write flash page {flash_page}')
         return False
     return True
 
 def send_load_buffer(podtp: Podtp, file_path) -> bool:
     binary = read_bin_file(file_path)
-    packet = PodtpPacket().set_header(PodtpType.BOOT_LOADER,
-                                      PodtpPort.BOOT_LOADER_LOAD_BUFFER, ack=True)
-
-    load_buffer = LoadBuffer()
-
-    max_packet_load = PODTP_MAX_DATA_LEN - load_buffer.size() - 1
+    view = memoryview(binary)
+    max_packet_load = MSG_BOOT_LOADER_LOAD_BUFFER.max_payload
 
     total_size = len(binary)
     page_count = math.ceil(total_size / PAGE_SIZE)
@@ -80,9 +45,6 @@ def send_load_buffer(podtp: Podtp, file_path) -> bool:
                 return False
             buffer_free_size = BUFFER_PAGE_COUNT * PAGE_SIZE
 
-        load_buffer.bufferPage = page % 10
-        load_buffer.offset = offset
-        packet.data[:load_buffer.size()] = load_buffer.pack()
         # the last packet may not be full
         if index + max_packet_load > total_size:
             packet_load = total_size - index
@@ -95,10 +57,10 @@ def send_load_buffer(podtp: Podtp, file_path) -> bool:
         buffer_free_size -= packet_load
         pbar.update(packet_load)
 
-        # print_t(f'Sent page {page} offset {offset} packet_length {packet.length} packet_load {packet_load}')
-        packet.data[load_buffer.size():load_buffer.size() + packet_load] = binary[index:index + packet_load]
-        packet.length = 1 + load_buffer.size() + packet_load
-        if not podtp._send_packet(packet, timeout=5):
+        # print_t(f'Sent page {page} offset {offset} packet_load {packet_load}')
+        # buffer page, offset, followed by the firmware chunk
+        if not podtp._send_message(MSG_BOOT_LOADER_LOAD_BUFFER, page % 10, offset,
+                                   payload=view[index:index + packet_load], timeout=5):
             print_t(f'Upload failed at page {page} offset {offset}')
             return False
         index += packet_load
@@ -108,18 +70,10 @@ def send_load_buffer(podtp: Podtp, file_path) -> bool:
     return True
 
 def start_stm32_bootloader(podtp: Podtp):
-    packet = PodtpPacket().set_header(PodtpType.ESP32,
-                                      PodtpPort.ESP32_START_STM32_BOOTLOADER)
-    packet.length = 2
-    packet.data[0] = 1
-    podtp._send_packet(packet)
+    podtp._send_message(MSG_ESP32_START_STM32_BOOTLOADER, 1)
 
 def start_stm32_firmware(podtp: Podtp):
-    packet = PodtpPacket().set_header(PodtpType.ESP32,
-                                      PodtpPort.ESP32_START_STM32_BOOTLOADER)
-    packet.length = 2
-    packet.data[0] = 0
-    podtp._send_packet(packet)
+    podtp._send_message(MSG_ESP32_START_STM32_BOOTLOADER, 0)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Upload firmware to STM32 via ESP32 over WiFi')
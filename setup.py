@@ -9,4 +9,10 @@ setup(
         'numpy>=1.18.1',
         'Pillow>=8.0',
     ],
+    entry_points={
+        'console_scripts': [
+            'podtp-bench=podtp.bench.__main__:main',
+            'podtp-replay=podtp.session_recorder:main',
+        ],
+    },
 )
\ No newline at end of file
@@ -1,8 +1,100 @@
 import numpy as np
 import cv2
 import glob
+import hashlib
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import json
+import time
+from threading import Event, Lock, Thread
 import matplotlib.pyplot as plt
+from podtp.jpeg_decoder import JpegDecoder
+from podtp.undistort import Undistorter
+
+# Try different methods of corner detection
+CORNER_METHODS = [
+    cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE,
+    cv2.CALIB_CB_ADAPTIVE_THRESH,
+    cv2.CALIB_CB_NORMALIZE_IMAGE,
+    0
+]
+# coarse detection runs on images scaled down to this width
+DETECT_WIDTH = 640
+# OpenCV 5 moved the fisheye calibration flags from cv2.fisheye to cv2
+FISHEYE_FLAGS = cv2.fisheye if hasattr(cv2.fisheye, 'CALIB_FIX_SKEW') else cv2
+
+def detect_corners(gray, checkerboard_size, criteria, detect_width=DETECT_WIDTH):
+    """
+    Find the checkerboard on a downscaled copy of a grayscale image, then
+    refine the corners with cornerSubPix at full resolution.
+
+    :return: Refined corners at full resolution, or None
+    """
+    scale = min(1.0, detect_width / gray.shape[1])
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+    for method in CORNER_METHODS:
+        ret, corners = cv2.findChessboardCorners(small, checkerboard_size, method)
+        if ret:
+            break
+    else:
+        if scale == 1:
+            return None
+        # boards that are small in the frame can vanish when downscaled, one full resolution try
+        ret, corners = cv2.findChessboardCorners(gray, checkerboard_size, CORNER_METHODS[0] + cv2.CALIB_CB_FAST_CHECK)
+        if not ret:
+            return None
+        scale = 1.0
+    corners = corners / scale
+    # More aggressive corner refinement
+    return cv2.cornerSubPix(gray, corners.astype(np.float32), (11, 11), (-1, -1), criteria)
+
+def detect_corners_file(fname, checkerboard_size, criteria, cache_dir=None, detect_width=DETECT_WIDTH):
+    """
+    detect_corners for an image file, cached in cache_dir by a hash of the file content.
+
+    :return: (corners or None, (width, height) or None if the image could not be read)
+    """
+    try:
+        with open(fname, 'rb') as file:
+            data = file.read()
+    except OSError:
+        data = b''
+    cache_file = None
+    if cache_dir:
+        digest = hashlib.sha1(data)
+        digest.update(repr((tuple(checkerboard_size), criteria, detect_width)).encode())
+        cache_file = os.path.join(cache_dir, digest.hexdigest() + '.npz')
+        if os.path.exists(cache_file):
+            try:
+                with np.load(cache_file) as cached:
+                    corners = cached['corners']
+                    return (corners if len(corners) else None), tuple(cached['size'])
+            except (OSError, ValueError, KeyError):
+                pass
+
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE) if data else None
+    if img is None:
+        return None, None
+    corners = detect_corners(img, checkerboard_size, criteria, detect_width)
+    size = img.shape[::-1]
+
+    if cache_file is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            temp = f'{cache_file}.{os.getpid()}.tmp'
+            with open(temp, 'wb') as file:
+                np.savez(file, corners=corners if corners is not None else np.zeros((0, 1, 2), np.float32),
+                         size=np.array(size))
+            os.replace(temp, cache_file)
+        except OSError:
+            pass
+    return corners, size
+
+def _init_worker():
+    # one OpenCV thread per process, the pool already uses every core
+    cv2.setNumThreads(1)
 
 class FisheyeCameraCalibration:
     def __init__(self, checkerboard_size=(9, 6), square_size=0.025):
@@ -19,51 +111,55 @@ class FisheyeCameraCalibration:
         self.objpoints = []  # 3D points in real world space
         self.imgpoints = []  # 2D points in image plane
     
-    def find_checkerboard_corners(self, images_folder):
+    def find_checkerboard_corners(self, images_folder, workers=None, cache_dir=None, load_images=True):
+        """
+        Detect the checkerboard in every image of the folder on a process pool.
+
+        :param workers: Number of processes, None for one per CPU, 0 to run serially
+        :param cache_dir: Where detected corners are cached by image content,
+            default images_folder/.corners; False disables the cache
+        :param load_images: Also return the images, with and without the corners drawn
+        :return: (processed_images, valid_images) as lists of images and (fname, image)
+        """
         images = glob.glob(os.path.join(images_folder, '*.jpg')) + \
                  glob.glob(os.path.join(images_folder, '*.png')) + \
                  glob.glob(os.path.join(images_folder, '*.jpeg'))
-        
+        if cache_dir is None:
+            cache_dir = os.path.join(images_folder, '.corners')
+        detect = partial(detect_corners_file, checkerboard_size=self.checkerboard_size,
+                         criteria=self.criteria, cache_dir=cache_dir or None)
+
+        if workers == 0:
+            results = map(detect, images)
+        else:
+            executor = ProcessPoolExecutor(workers, initializer=_init_worker)
+            results = executor.map(detect, images, chunksize=4)
+
         processed_images = []
         valid_images = []
-        
-        for fname in images:
-            img = cv2.imread(fname)
-            if img is None:
-                print(f"Could not read image: {fname}")
-                continue
-            
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            
-            # Try different methods of corner detection
-            methods = [
-                cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE,
-                cv2.CALIB_CB_ADAPTIVE_THRESH,
-                cv2.CALIB_CB_NORMALIZE_IMAGE,
-                0
-            ]
-            
-            ret = False
-            for method in methods:
-                ret, corners = cv2.findChessboardCorners(gray, self.checkerboard_size, method)
-                if ret:
-                    break
-            
-            if ret:
+        try:
+            for fname, (corners, size) in zip(images, results):
+                if size is None:
+                    print(f"Could not read image: {fname}")
+                    continue
+                if corners is None:
+                    print(f"Could not find checkerboard corners in {fname}")
+                    continue
                 self.objpoints.append(self.objp)
-                
-                # More aggressive corner refinement
-                corners2 = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), self.criteria)
-                self.imgpoints.append(corners2.reshape(1, -1, 2).astype(np.float64))
-                
+                self.imgpoints.append(corners.reshape(1, -1, 2).astype(np.float64))
+                if not load_images:
+                    valid_images.append((fname, None))
+                    continue
+                img = cv2.imread(fname)
                 # Draw and save processed images
                 img_with_corners = img.copy()
-                cv2.drawChessboardCorners(img_with_corners, self.checkerboard_size, corners2, ret)
+                cv2.drawChessboardCorners(img_with_corners, self.checkerboard_size, corners, True)
                 processed_images.append(img_with_corners)
                 valid_images.append((fname, img))
-            else:
-                print(f"Could not find checkerboard corners in {fname}")
-        
+        finally:
+            if workers != 0:
+                executor.shutdown()
+
         return processed_images, valid_images
     
     def calibrate_camera(self, image_size):
@@ -72,8 +168,8 @@ class FisheyeCameraCalibration:
         
         # Try multiple calibration strategies
         flags_list = [
-            cv2.fisheye.CALIB_RECOMPUTE_EXTRINSIC + cv2.fisheye.CALIB_FIX_SKEW,
-            cv2.fisheye.CALIB_RECOMPUTE_EXTRINSIC,
+            FISHEYE_FLAGS.CALIB_RECOMPUTE_EXTRINSIC + FISHEYE_FLAGS.CALIB_FIX_SKEW,
+            FISHEYE_FLAGS.CALIB_RECOMPUTE_EXTRINSIC,
             0
         ]
         
@@ -114,26 +210,240 @@ class FisheyeCameraCalibration:
         :param balance: Balance parameter to control FOV (0.0 to 1.0)
         :return: Undistorted image
         """
+        # the remap tables are cached per (K, D, size, balance), repeated calls only remap
         dim1 = img.shape[:2][::-1]
-        
-        # Compute new camera matrix
-        new_K = cv2.fisheye.estimateNewCameraMatrixForUndistortRectify(
-            K, D, dim1, np.eye(3), balance=balance
-        )
-        
-        # Create map for undistortion
-        map1, map2 = cv2.fisheye.initUndistortRectifyMap(
-            K, D, np.eye(3), new_K, dim1, cv2.CV_16SC2
-        )
-        
-        # Remap the image
-        undistorted_img = cv2.remap(
-            img, map1, map2, 
-            interpolation=cv2.INTER_LINEAR, 
-            borderMode=cv2.BORDER_CONSTANT
-        )
-        
-        return undistorted_img
+        undistorter = Undistorter(K, D, balance, calibration_size=dim1, buffers=0)
+        return undistorter(img)
+
+def board_pose(corners, checkerboard_size, image_size):
+    """
+    A rough pose descriptor of a detected board: center and size relative to
+    the image, and the tilt about both axes from the ratio of opposite edges.
+
+    :return: np.array([cx, cy, scale, tilt_x, tilt_y]), each roughly in [-1, 1]
+    """
+    grid = corners.reshape(checkerboard_size[1], checkerboard_size[0], 2)
+    # the detector may number the corners from either end, start at the one nearest the image origin
+    if np.linalg.norm(grid[0, 0]) > np.linalg.norm(grid[-1, -1]):
+        grid = grid[::-1, ::-1]
+    tl, tr, bl, br = grid[0, 0], grid[0, -1], grid[-1, 0], grid[-1, -1]
+    width, height = image_size
+    center = grid.reshape(-1, 2).mean(axis=0) / (width, height)
+    area = cv2.contourArea(np.array([tl, tr, br, bl], dtype=np.float32))
+    top, bottom = np.linalg.norm(tr - tl), np.linalg.norm(br - bl)
+    left, right = np.linalg.norm(bl - tl), np.linalg.norm(br - tr)
+    return np.array([center[0], center[1], np.sqrt(area / (width * height)),
+                     2 * (bottom - top) / (bottom + top), 2 * (right - left) / (right + left)])
+
+class LiveCalibration:
+    """
+    Fisheye calibration from the live Podtp stream. A background thread
+    detects the checkerboard in the newest frame of podtp.sensor_data and
+    keeps a view only if it adds pose diversity: it covers image cells no
+    kept view covered, or its position, size and tilt differ enough from
+    every kept view. Each accepted view re-runs cv2.fisheye.calibrate on
+    another thread, starting from the previous K and D, and reports the RMS.
+
+    Calibrate with undistort off, on frames as the consumers receive them.
+    """
+    # image area split into this many (columns, rows) cells for coverage
+    COVERAGE_GRID = (8, 6)
+
+    def __init__(self, podtp, checkerboard_size=(9, 6), square_size=0.025, min_frames=10, max_frames=40,
+                 min_distance=0.15, interval=0.2):
+        self.podtp = podtp
+        self.calibrator = FisheyeCameraCalibration(checkerboard_size, square_size)
+        self.min_frames = min_frames
+        self.max_frames = max_frames
+        self.min_distance = min_distance
+        self.interval = interval
+        self.poses = []
+        self.coverage = np.zeros(self.COVERAGE_GRID[::-1], dtype=bool)
+        self.image_size = None
+        # latest result and (views, rms) after every calibration run
+        self.K = None
+        self.D = None
+        self.rms = None
+        self.history = []
+        self.frames_checked = 0
+        self.lock = Lock()
+        self.stop_event = Event()
+        self.calibrate_event = Event()
+        self.threads = []
+
+    def start(self):
+        if getattr(self.podtp, 'undistorter', None) is not None:
+            print("Warning: the stream is undistorted, calibration needs the raw frames")
+        self.stop_event.clear()
+        self.threads = [Thread(target=self._detect_func, daemon=True), Thread(target=self._calibrate_func, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.calibrate_event.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _detect_func(self):
+        sensor = self.podtp.sensor_data
+        # frames come in the decoder's channel order
+        decoder = getattr(self.podtp, 'jpeg_decoder', None)
+        to_gray = cv2.COLOR_BGR2GRAY if decoder is not None and decoder.pixel_format == JpegDecoder.PixelFormat.BGR \
+            else cv2.COLOR_RGB2GRAY
+        seq = sensor.seq('frame')
+        while not self.stop_event.is_set():
+            updated = sensor.wait_for_update('frame', seq, timeout=0.5)
+            if updated is None:
+                continue
+            seq = updated
+            frame = sensor.frame
+            if frame is None:
+                continue
+            # both copy, a frame from a ring buffer may be rewritten afterwards
+            frame = cv2.cvtColor(frame, to_gray) if frame.ndim == 3 else frame.copy()
+            if self.add_frame(frame):
+                self.calibrate_event.set()
+            self.stop_event.wait(self.interval)
+
+    def add_frame(self, gray):
+        """
+        Detect the board in a grayscale frame and keep the view if it adds diversity.
+
+        :return: True if the view was kept
+        """
+        self.frames_checked += 1
+        image_size = gray.shape[::-1]
+        if self.image_size is not None and image_size != self.image_size:
+            # the camera frame size changed, the kept views no longer fit
+            return False
+        if len(self.poses) >= self.max_frames:
+            return False
+        corners = detect_corners(gray, self.calibrator.checkerboard_size, self.calibrator.criteria)
+        if corners is None:
+            return False
+
+        pose = board_pose(corners, self.calibrator.checkerboard_size, image_size)
+        cells = self._cells(corners, image_size)
+        new_cells = np.count_nonzero(cells & ~self.coverage)
+        distance = min((np.linalg.norm(pose - kept) for kept in self.poses), default=np.inf)
+        if new_cells < 2 and distance < self.min_distance:
+            return False
+
+        with self.lock:
+            self.image_size = image_size
+            self.poses.append(pose)
+            self.coverage |= cells
+            self.calibrator.objpoints.append(self.calibrator.objp)
+            self.calibrator.imgpoints.append(corners.reshape(1, -1, 2).astype(np.float64))
+        print(f"View {len(self.poses)} kept: {new_cells} new cells, {self.coverage.mean():.0%} coverage, "
+              f"tilt {pose[3]:+.2f} {pose[4]:+.2f}")
+        return True
+
+    def _cells(self, corners, image_size):
+        columns, rows = self.COVERAGE_GRID
+        points = corners.reshape(-1, 2)
+        x = np.clip((points[:, 0] * columns / image_size[0]).astype(int), 0, columns - 1)
+        y = np.clip((points[:, 1] * rows / image_size[1]).astype(int), 0, rows - 1)
+        cells = np.zeros((rows, columns), dtype=bool)
+        cells[y, x] = True
+        return cells
+
+    def _calibrate_func(self):
+        while True:
+            self.calibrate_event.wait()
+            self.calibrate_event.clear()
+            if self.stop_event.is_set():
+                return
+            if len(self.poses) >= self.min_frames:
+                self.calibrate()
+
+    def calibrate(self):
+        """
+        Run cv2.fisheye.calibrate on the views kept so far, from the previous result if there is one.
+
+        :return: The RMS reprojection error, or None if the calibration failed
+        """
+        with self.lock:
+            objpoints = list(self.calibrator.objpoints)
+            imgpoints = list(self.calibrator.imgpoints)
+            image_size = self.image_size
+        flags = FISHEYE_FLAGS.CALIB_RECOMPUTE_EXTRINSIC + FISHEYE_FLAGS.CALIB_FIX_SKEW
+        if self.K is not None:
+            # the previous result is close, starting there converges in a few iterations
+            flags += FISHEYE_FLAGS.CALIB_USE_INTRINSIC_GUESS
+            K, D = self.K.copy(), self.D.copy()
+        else:
+            K, D = np.zeros((3, 3)), np.zeros((4, 1))
+        try:
+            rms, K, D, _, _ = cv2.fisheye.calibrate(objpoints, imgpoints, image_size, K, D,
+                                                    flags=flags, criteria=self.calibrator.criteria)
+        except cv2.error as e:
+            print(f"Calibration with {len(objpoints)} views failed: {e}")
+            return None
+        self.K, self.D, self.rms = K, D, rms
+        self.history.append((len(objpoints), rms))
+        print(f"Calibration with {len(objpoints)} views: RMS {rms:.3f} px")
+        return rms
+
+    def camera_config_source(self):
+        """
+        The result as the K and D attributes of CameraConfig, ready to paste.
+        """
+        def rows(array):
+            return ',\n                  '.join('[' + ', '.join(f'{v:12.8f}' for v in row) + ']' for row in array)
+        return (f"    K = np.array([{rows(self.K)}])\n"
+                f"    \n"
+                f"    D = np.array([{rows(self.D)}])\n")
+
+    def save(self, path):
+        """
+        Write the result as podtp config keys (camera_K, camera_D, calibration_size), merged into the file if it exists.
+        """
+        config = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                config = json.load(file)
+        config.update({
+            "camera_K": self.K.tolist(),
+            "camera_D": self.D.tolist(),
+            "calibration_size": list(self.image_size),
+            "calibration_rms": self.rms,
+        })
+        with open(path, 'w') as file:
+            json.dump(config, file, indent=4)
+
+def live_calibration(config_path, output_path, duration=120):
+    from podtp import Podtp
+    with open(config_path) as file:
+        config = json.load(file)
+    # the frames must be the camera's own, not undistorted ones
+    config["undistort"] = False
+    podtp = Podtp(config)
+    if not podtp.connect():
+        return None, None
+    podtp.start_stream()
+    calibration = LiveCalibration(podtp)
+    calibration.start()
+    try:
+        deadline = time.time() + duration
+        while time.time() < deadline and len(calibration.poses) < calibration.max_frames:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    calibration.stop()
+    podtp.stop_stream()
+    podtp.disconnect()
+    if not calibration.history or calibration.history[-1][0] != len(calibration.poses):
+        # views kept after the last background run
+        calibration.calibrate()
+    if calibration.K is None:
+        print(f"No calibration, {len(calibration.poses)} views kept")
+        return None, None
+    print(calibration.camera_config_source())
+    calibration.save(output_path)
+    return calibration.K, calibration.D
 
 def debug_calibration(images_folder):
     # Create calibration object
@@ -187,7 +497,10 @@ def debug_calibration(images_folder):
     
     return None, None
 
-# Run the debug script
+# Run the debug script, or `python calibration.py --live ../examples/config.json` to calibrate from the stream
 if __name__ == '__main__':
-    images_folder = '../examples/cache/image'
-    debug_calibration(images_folder)
\ No newline at end of file
+    if len(sys.argv) > 2 and sys.argv[1] == '--live':
+        live_calibration(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else 'calibration.json')
+    else:
+        images_folder = '../examples/cache/image'
+        debug_calibration(images_folder)
\ No newline at end of file